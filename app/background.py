@@ -0,0 +1,52 @@
+from typing import Coroutine, Set
+import asyncio
+
+from fastapi import WebSocket
+
+try:
+    from .sessions import SERVICE_RESTART
+    from .system_messages import SystemMessages
+except ImportError:
+    from sessions import SERVICE_RESTART
+    from system_messages import SystemMessages
+
+
+class BackgroundTasks:
+    """Coroutines run as tasks of their own, each kept referenced until it is done.
+
+    For work a handler shouldn't wait on, such as closing sockets: closing a
+    half-open one waits for a reply that won't come.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+
+    def spawn(self, coroutine: Coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+async def close_quietly(websocket: WebSocket, code: int = 1000):
+    """Close a socket, if it isn't closed already.
+
+    Used for a connection that has been replaced or dropped: its own
+    handler notices and finds itself no longer current.
+    """
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass  # Already closed
+
+
+async def send_away(websocket: WebSocket, catalog: SystemMessages):
+    """Tell a client this worker is shutting down and close, so it reconnects (to the worker taking over)."""
+    try:
+        for frame in catalog.frames("server_restarting"):
+            await websocket.send_text(frame)
+        await websocket.close(code=SERVICE_RESTART)
+    except Exception:
+        pass  # Already gone
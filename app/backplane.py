@@ -0,0 +1,321 @@
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import json
+
+# Called with each message published on a subscribed channel
+Handler = Callable[[Dict], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """Publish/subscribe transport shared by every worker process.
+
+    Messages are JSON-serializable dicts. Handlers are awaited one at a time
+    in the order messages were published on their channel and must not
+    modify the message they are given.
+    """
+
+    async def start(self):
+        """Connect to the transport."""
+
+    async def stop(self):
+        """Disconnect from the transport."""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict):
+        """Send a message to every subscriber of a channel, on any worker."""
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler):
+        """Have `handler` called with each message published on a channel."""
+
+
+class InMemoryHub:
+    """Channels shared by InMemoryBackplane instances in the same process."""
+
+    def __init__(self):
+        self.subscribers: Dict[str, List[Tuple["InMemoryBackplane", Handler]]] = {}
+
+
+class InMemoryBackplane(Backplane):
+    """Backplane for a single worker process (or several instances sharing a hub)."""
+
+    def __init__(self, hub: Optional[InMemoryHub] = None):
+        self.hub = hub or InMemoryHub()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # Deliver from a queue so publishing never runs handlers re-entrantly
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._deliver())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for channel, subscribers in self.hub.subscribers.items():
+            subscribers[:] = [entry for entry in subscribers if entry[0] is not self]
+        self._queue = None
+
+    async def publish(self, channel: str, message: Dict):
+        for backplane, handler in self.hub.subscribers.get(channel, ()):
+            if backplane._queue is not None:
+                backplane._queue.put_nowait((handler, message))
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.hub.subscribers.setdefault(channel, []).append((self, handler))
+
+    async def _deliver(self):
+        while True:
+            handler, message = await self._queue.get()
+            try:
+                await handler(message)
+            except Exception as e:
+                print(f"Error handling backplane message: {e}")
+
+
+def encode_command(*args: str) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg.encode("utf-8")
+        parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read one RESP value. Errors are returned as Exception instances."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Backplane connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return Exception(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode("utf-8")
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected backplane reply: {line!r}")
+
+
+class RedisBackplane(Backplane):
+    """Backplane over the Redis pub/sub protocol (Redis, Valkey, or LocalPubSubServer).
+
+    Uses one connection for PUBLISH and one for SUBSCRIBE, and reconnects
+    (resubscribing to every channel) if either drops. Messages published
+    while disconnected are lost, as with Redis pub/sub itself.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._pub_writer: Optional[asyncio.StreamWriter] = None
+        self._sub_writer: Optional[asyncio.StreamWriter] = None
+        self._tasks: List[asyncio.Task] = []
+        self._connected = asyncio.Event()
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run_publisher()), loop.create_task(self._run_subscriber())]
+        await asyncio.wait_for(self._connected.wait(), timeout=10)
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        for writer in (self._pub_writer, self._sub_writer):
+            if writer is not None:
+                writer.close()
+        self._tasks = []
+
+    async def publish(self, channel: str, message: Dict):
+        if self._pub_writer is None:
+            await self._connected.wait()
+        payload = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        # Pipelined; replies are read and discarded by _run_publisher
+        self._pub_writer.write(encode_command("PUBLISH", channel, payload))
+
+    async def subscribe(self, channel: str, handler: Handler):
+        first = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if first and self._sub_writer is not None:
+            self._sub_writer.write(encode_command("SUBSCRIBE", channel))
+            await self._sub_writer.drain()
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command("AUTH", self.password))
+            reply = await read_reply(reader)
+            if isinstance(reply, Exception):
+                writer.close()
+                raise reply
+        return reader, writer
+
+    async def _run_publisher(self):
+        delay = 0.5
+        while not self._stopping:
+            try:
+                reader, self._pub_writer = await self._open()
+                self._connected.set()
+                delay = 0.5
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, Exception):
+                        print(f"Backplane publish failed: {reply}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._pub_writer = None
+                self._connected.clear()
+                print(f"Backplane publisher disconnected ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    async def _run_subscriber(self):
+        delay = 0.5
+        while not self._stopping:
+            try:
+                reader, writer = await self._open()
+                if self._handlers:
+                    writer.write(encode_command("SUBSCRIBE", *self._handlers))
+                self._sub_writer = writer
+                delay = 0.5
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                        await self._dispatch(reply[1], reply[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._sub_writer = None
+                print(f"Backplane subscriber disconnected ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    async def _dispatch(self, channel: str, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            print(f"Ignoring malformed backplane message on {channel}")
+            return
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(message)
+            except Exception as e:
+                print(f"Error handling backplane message: {e}")
+
+
+def create_backplane(url: str) -> Backplane:
+    """Pick a backplane from a URL: memory:// (default) or redis://host:port."""
+    if not url or url.startswith("memory://"):
+        return InMemoryBackplane()
+    if url.startswith("redis://"):
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+
+class LocalPubSubServer:
+    """Minimal stand-in for Redis pub/sub (SUBSCRIBE, UNSUBSCRIBE, PUBLISH, PING).
+
+    Enough to run several workers on one machine without installing Redis:
+
+        python -m app.backplane --port 6379
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379):
+        self.host = host
+        self.port = port
+        self.channels: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Pub/sub stand-in listening on {self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: Set[str] = set()
+        self._clients.add(writer)
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    break
+                name = command[0].upper()
+                if name == "PUBLISH" and len(command) == 3:
+                    receivers = self.channels.get(command[1], set())
+                    frame = encode_command("message", command[1], command[2])
+                    for subscriber in receivers:
+                        subscriber.write(frame)
+                    writer.write(f":{len(receivers)}\r\n".encode())
+                elif name == "SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(self._subscription_reply("subscribe", channel, len(subscribed)))
+                elif name == "UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscribed):
+                        self.channels.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(self._subscription_reply("unsubscribe", channel, len(subscribed)))
+                elif name == "PING":
+                    writer.write(b"+PONG\r\n")
+                elif name in ("AUTH", "SELECT"):
+                    writer.write(b"+OK\r\n")
+                else:
+                    writer.write(f"-ERR unknown command '{command[0]}'\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _subscription_reply(kind: str, channel: str, count: int) -> bytes:
+        data = channel.encode("utf-8")
+        return (f"*3\r\n${len(kind)}\r\n{kind}\r\n${len(data)}\r\n".encode() + data +
+                f"\r\n:{count}\r\n".encode())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local pub/sub stand-in for the backplane.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(LocalPubSubServer(args.host, args.port).serve_forever())
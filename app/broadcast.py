@@ -0,0 +1,249 @@
+from fastapi import WebSocket
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import time
+
+try:
+    from .codec import dumps
+    from .metrics import BROKEN_SOCKETS, FANOUT_SECONDS, FRAMES_DROPPED, SEND_SECONDS
+except ImportError:
+    from codec import dumps
+    from metrics import BROKEN_SOCKETS, FANOUT_SECONDS, FRAMES_DROPPED, SEND_SECONDS
+
+# What to do when a connection's outbound queue is full
+DROP = "drop"  # Drop the new frame, keep what is already queued
+COALESCE = "coalesce"  # Replace a queued frame with the same key, else drop the oldest frame
+DISCONNECT = "disconnect"  # Close the connection
+POLICIES = (DROP, COALESCE, DISCONNECT)
+
+
+def encode_frame(message: Dict) -> str:
+    """Serialize a message once, with the configured codec (compact, like WebSocket.send_json)."""
+    return dumps(message)
+
+
+def encode_batch(frames: List[str]) -> str:
+    """Join already-encoded message frames into one "batch" frame."""
+    return '{"type":"batch","messages":[' + ",".join(frames) + "]}"
+
+
+class OutboundQueue:
+    """Bounded send queue for one connection, drained by its own writer task.
+
+    A slow client only ever backs up its own queue; what happens once that
+    queue is full is decided by the slow-consumer policy.
+    """
+
+    def __init__(self, user_id: str, websocket: WebSocket, maxsize: int, policy: str,
+                 on_broken: Optional[Callable[[str, "OutboundQueue"], None]] = None,
+                 channel: str = "global"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.user_id = user_id
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_broken = on_broken
+        self.dropped = 0  # Frames dropped or replaced because the queue was full
+        self._send_seconds = SEND_SECONDS.labels(channel)
+        self._dropped_total = FRAMES_DROPPED.labels(channel)
+        self._broken_total = BROKEN_SOCKETS.labels(channel)
+        self.closed = False
+        self._frames: Deque[List] = deque()  # [coalesce_key, frame] entries
+        self._keyed: Dict[str, List] = {}  # coalesce_key -> pending entry
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._writer())
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def push(self, frame: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a pre-encoded frame without waiting. Returns False if it was not queued."""
+        if self.closed:
+            return False
+
+        if coalesce_key is not None and self.policy == COALESCE:
+            pending = self._keyed.get(coalesce_key)
+            if pending is not None:
+                # A newer state supersedes the one still waiting to go out
+                pending[1] = frame
+                self._count_drop()
+                return True
+
+        if len(self._frames) >= self.maxsize:
+            if self.policy == DROP:
+                self._count_drop()
+                return False
+            if self.policy == DISCONNECT:
+                self._fail()
+                return False
+            oldest = self._frames.popleft()
+            if oldest[0] is not None:
+                self._keyed.pop(oldest[0], None)
+            self._count_drop()
+
+        entry = [coalesce_key, frame]
+        self._frames.append(entry)
+        if coalesce_key is not None:
+            self._keyed[coalesce_key] = entry
+        self._ready.set()
+        return True
+
+    def _count_drop(self):
+        self.dropped += 1
+        self._dropped_total.inc()
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self._frames:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                entry = self._frames.popleft()
+                if entry[0] is not None and self._keyed.get(entry[0]) is entry:
+                    del self._keyed[entry[0]]
+                started = time.perf_counter()
+                await self.websocket.send_text(entry[1])
+                self._send_seconds.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Connection is broken, let the owner forget about it
+            self._fail()
+
+    def _fail(self):
+        if self.closed:
+            return
+        self._broken_total.inc()
+        self.close()
+        asyncio.get_running_loop().create_task(self._close_socket())
+        if self.on_broken:
+            self.on_broken(self.user_id, self)
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Stop the writer task and discard anything still queued."""
+        self.closed = True
+        self._frames.clear()
+        self._keyed.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+
+class Broadcaster:
+    """Fans pre-encoded frames out to per-connection outbound queues.
+
+    With a `batch_window`, connections added with ``batched=True`` get
+    batchable frames collected over the window and sent as one "batch"
+    frame, so their sends scale with windows rather than messages. Other
+    connections still get every frame on its own, straight away.
+    """
+
+    def __init__(self, maxsize: int = 256, policy: str = COALESCE,
+                 on_broken: Optional[Callable[[str], None]] = None, channel: str = "global",
+                 batch_window: float = 0.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_broken = on_broken
+        self.channel = channel  # Label for this broadcaster's metrics
+        self._fanout_seconds = FANOUT_SECONDS.labels(channel)
+        self.queues: Dict[str, OutboundQueue] = {}  # user_id -> outbound queue
+        self.batch_window = batch_window  # Seconds; 0 sends every frame on its own
+        self.batched: Set[str] = set()  # Users who asked for batch frames
+        self._batch: List[Tuple[str, Optional[str]]] = []  # (frame, excluded user) waiting for the flush
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def add(self, user_id: str, websocket: WebSocket, batched: bool = False) -> OutboundQueue:
+        """Start a writer for a newly accepted connection, replacing any older one."""
+        self.remove(user_id)
+        queue = OutboundQueue(user_id, websocket, self.maxsize, self.policy, self._queue_broken, self.channel)
+        self.queues[user_id] = queue
+        if batched and self.batch_window > 0:
+            self.batched.add(user_id)
+        return queue
+
+    def remove(self, user_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """Stop the writer for a connection that went away.
+
+        With `websocket`, nothing happens unless it is still the user's
+        current connection. Returns whether a connection was removed.
+        """
+        queue = self.queues.get(user_id)
+        if queue is None or (websocket is not None and queue.websocket is not websocket):
+            return False
+        del self.queues[user_id]
+        self.batched.discard(user_id)
+        queue.close()
+        return True
+
+    def send(self, user_id: str, message: Dict) -> bool:
+        """Queue a message for a single connection."""
+        queue = self.queues.get(user_id)
+        if queue is None:
+            return False
+        return queue.push(encode_frame(message))
+
+    def broadcast(self, message: Dict, exclude: Optional[str] = None,
+                  coalesce_key: Optional[str] = None) -> int:
+        """Encode a message once and queue it for every connection. Returns how many were queued."""
+        return self.broadcast_frame(encode_frame(message), exclude, coalesce_key)
+
+    def broadcast_frame(self, frame: str, exclude: Optional[str] = None,
+                        coalesce_key: Optional[str] = None, batch: bool = False) -> int:
+        """Queue an encoded frame for every connection. A `batch` frame may wait for the next batch flush."""
+        started = time.perf_counter()
+        batched = self.batched if batch else ()
+        queued = 0
+        for user_id, queue in list(self.queues.items()):
+            if user_id == exclude or user_id in batched:
+                continue
+            if queue.push(frame, coalesce_key):
+                queued += 1
+        if batched:
+            self._batch.append((frame, exclude))
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self.flush_batch)
+        self._fanout_seconds.observe(time.perf_counter() - started)
+        return queued
+
+    def flush_batch(self):
+        """Send everything collected since the last flush to the batched connections."""
+        self._flush_handle = None
+        pending, self._batch = self._batch, []
+        if not pending:
+            return
+
+        # Most users get the same frame; only senders need one without their own messages
+        everyone = pending[0][0] if len(pending) == 1 else encode_batch([frame for frame, _ in pending])
+        senders = {exclude for _, exclude in pending if exclude is not None}
+        for user_id in list(self.batched):
+            queue = self.queues.get(user_id)
+            if queue is None:
+                continue
+            if user_id not in senders:
+                queue.push(everyone)
+                continue
+            frames = [frame for frame, exclude in pending if exclude != user_id]
+            if frames:
+                queue.push(frames[0] if len(frames) == 1 else encode_batch(frames))
+
+    def queued_frames(self) -> int:
+        """Frames waiting in every connection's queue."""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _queue_broken(self, user_id: str, queue: OutboundQueue):
+        # Only forget the user if this is still their current connection
+        if self.queues.get(user_id) is queue:
+            del self.queues[user_id]
+            self.batched.discard(user_id)
+            if self.on_broken:
+                self.on_broken(user_id)
@@ -0,0 +1,246 @@
+from array import array
+from typing import Dict, List, Optional, Tuple
+import mmap
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: no writer lock, so run a single worker there
+
+SEGMENT_SUFFIX = ".jsonl"
+LOCK_FILE = "writer.lock"
+STREAM_FILE = "stream"  # Name of the message numbering the positions belong to
+
+
+class Segment:
+    """One log file: the frames from position `base` on, one per line."""
+
+    __slots__ = ("base", "path", "offsets", "size", "_map")
+
+    def __init__(self, base: int, path: str):
+        self.base = base
+        self.path = path
+        self.offsets = array("Q")  # Byte offset where each line starts
+        self.size = 0  # Bytes of complete lines
+        self._map: Optional[mmap.mmap] = None  # Kept for sealed segments only
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read(self, start: int, end: int, sealed: bool) -> List[str]:
+        """Lines start..end (indexes within this segment), through a read-only mmap."""
+        if start >= end or not self.size:
+            return []
+        stop = self.offsets[end] if end < len(self.offsets) else self.size
+        view = self._map
+        if view is None:
+            with open(self.path, "rb") as segment_file:
+                view = mmap.mmap(segment_file.fileno(), self.size, access=mmap.ACCESS_READ)
+            if sealed:
+                self._map = view  # Won't change any more, so keep it mapped
+        try:
+            data = view[self.offsets[start]:stop]
+        finally:
+            if view is not self._map:
+                view.close()
+        # Split the bytes rather than the text: frames may contain U+2028 and friends, which splitlines() breaks on
+        return [line.decode("utf-8") for line in data.split(b"\n")[:-1]]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class ChatLog:
+    """Append-only global chat log, split into segment files.
+
+    Each message is its encoded JSON frame on one line, and has a position
+    counting up from the first message ever logged. Only byte offsets are
+    kept in memory (8 bytes a message); reads map the segment files instead
+    of loading them. Once the log has `max_segments` segments, the oldest
+    is deleted, so disk use stays around `segment_bytes * max_segments`.
+
+    Only one process may write to a directory. A worker that can't get the
+    lock logs nothing and `open()` returns False.
+
+    The log also keeps the name of the numbering (`stream`) its positions
+    belong to, so a restart can carry it on.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 4 * 1024 * 1024, max_segments: int = 8):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(1, max_segments)
+        self.segments: List[Segment] = []
+        self._fd: Optional[int] = None  # Active segment, opened for appending
+        self._lock_fd: Optional[int] = None
+        self.stream: Optional[str] = None  # Saved with save_stream(), read back by open()
+
+    @property
+    def is_open(self) -> bool:
+        return self._fd is not None
+
+    @property
+    def start(self) -> int:
+        """Position of the oldest message still on disk."""
+        return self.segments[0].base if self.segments else 0
+
+    @property
+    def end(self) -> int:
+        """Position the next message will get."""
+        if not self.segments:
+            return 0
+        last = self.segments[-1]
+        return last.base + len(last)
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def open(self) -> bool:
+        """Take the writer lock and index the existing segments. Returns whether the log is usable."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            print(f"Global chat log disabled, can't use {self.directory}: {e}")
+            return False
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock_fd)
+            print(f"Global chat log {self.directory} is in use by another worker; not logging here")
+            return False
+        self._lock_fd = lock_fd
+
+        self.segments = []
+        for base, path in self._segment_files():
+            segment = Segment(base, path)
+            self._index(segment)
+            if self.segments and segment.base != self.end:
+                print(f"Global chat log has a gap before {path}; dropping the segments before it")
+                for old in self.segments:
+                    self._remove(old)
+                self.segments = []
+            self.segments.append(segment)
+        if not self.segments:
+            self.segments.append(Segment(0, self._segment_path(0)))
+        self._fd = os.open(self.segments[-1].path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            with open(os.path.join(self.directory, STREAM_FILE), encoding="utf-8") as stream_file:
+                self.stream = stream_file.read().strip() or None
+        except OSError:
+            self.stream = None  # None saved yet
+        return True
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # Releases the lock
+            self._lock_fd = None
+
+    def save_stream(self, stream: Optional[str]) -> bool:
+        """Save the name of the numbering the positions belong to (None to forget it). Returns whether it was saved."""
+        path = os.path.join(self.directory, STREAM_FILE)
+        try:
+            if stream is None:
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                with open(path + ".tmp", "w", encoding="utf-8") as stream_file:
+                    stream_file.write(stream)
+                os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save the global chat log's stream in {self.directory}: {e}")
+            return False
+        self.stream = stream
+        return True
+
+    def append(self, frame: str) -> int:
+        """Log an encoded frame (one line, as produced by encode_frame). Returns its position."""
+        segment = self.segments[-1]
+        if segment.size >= self.segment_bytes:
+            segment = self._roll()
+        data = frame.encode("utf-8") + b"\n"
+        os.write(self._fd, data)  # One write per message, straight to the OS; no Python buffering
+        segment.offsets.append(segment.size)
+        segment.size += len(data)
+        return segment.base + len(segment) - 1
+
+    def read(self, start: int, end: int) -> List[str]:
+        """Frames at positions start..end that are still on disk, oldest first."""
+        start = max(start, self.start)
+        end = min(end, self.end)
+        frames: List[str] = []
+        last = len(self.segments) - 1
+        for number, segment in enumerate(self.segments):
+            segment_end = segment.base + len(segment)
+            if segment_end <= start or segment.base >= end:
+                continue
+            frames.extend(segment.read(max(start, segment.base) - segment.base,
+                                       min(end, segment_end) - segment.base, sealed=number < last))
+        return frames
+
+    def tail(self, count: int) -> List[str]:
+        """The last `count` frames, oldest first."""
+        return self.read(self.end - count, self.end)
+
+    def before(self, position: int, limit: int) -> Tuple[List[str], Optional[int]]:
+        """Up to `limit` frames just before `position`, and the position to ask for the page before that."""
+        position = min(position, self.end)
+        start = max(self.start, position - limit)
+        frames = self.read(start, position)
+        return frames, (start if start > self.start else None)
+
+    def _roll(self) -> Segment:
+        """Seal the active segment and start a new one, dropping the oldest if there are too many."""
+        os.close(self._fd)
+        segment = Segment(self.end, self._segment_path(self.end))
+        self.segments.append(segment)
+        self._fd = os.open(segment.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        while len(self.segments) > self.max_segments:
+            self._remove(self.segments.pop(0))
+        return segment
+
+    def _remove(self, segment: Segment):
+        segment.close()
+        try:
+            os.remove(segment.path)
+        except OSError as e:
+            print(f"Could not remove old global chat log segment {segment.path}: {e}")
+
+    def _index(self, segment: Segment):
+        """Find the line offsets of an existing segment, cutting off a torn last line."""
+        size = os.path.getsize(segment.path)
+        if size:
+            with open(segment.path, "rb") as segment_file:
+                with mmap.mmap(segment_file.fileno(), size, access=mmap.ACCESS_READ) as view:
+                    position = 0
+                    while True:
+                        newline = view.find(b"\n", position)
+                        if newline < 0:
+                            break
+                        segment.offsets.append(position)
+                        position = newline + 1
+            if position < size:
+                # The process died in the middle of a write; the partial line is dropped
+                os.truncate(segment.path, position)
+            segment.size = position
+
+    def _segment_files(self) -> List[Tuple[int, str]]:
+        files: Dict[int, str] = {}
+        for name in os.listdir(self.directory):
+            stem, suffix = os.path.splitext(name)
+            if suffix == SEGMENT_SUFFIX and stem.isdigit():
+                files[int(stem)] = os.path.join(self.directory, name)
+        return sorted(files.items())
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:012d}{SEGMENT_SUFFIX}")
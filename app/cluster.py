@@ -0,0 +1,358 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+try:
+    from .backplane import Backplane
+    from .broadcast import encode_frame
+    from .config import CLUSTER_WORKER_TIMEOUT
+except ImportError:
+    from backplane import Backplane
+    from broadcast import encode_frame
+    from config import CLUSTER_WORKER_TIMEOUT
+
+GLOBAL_CHANNEL = "adzu:global"  # Global chat messages and per-worker user counts
+MATCH_CHANNEL = "adzu:match"  # Users waiting for a partner, announced to every worker
+WORKER_CHANNEL = "adzu:worker:{}"  # Messages for the users connected to one worker
+
+# ("pair", campus, preference) or ("code", code)
+ClusterKey = Tuple[str, ...]
+
+
+def pair_key(campus: str, preference: str) -> ClusterKey:
+    return ("pair", campus, preference)
+
+
+def code_key(code: str) -> ClusterKey:
+    return ("code", code)
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class ClusterRouter:
+    """Routes matchmaking, pair messages and global chat between worker processes.
+
+    Each worker keeps its own sockets. Users who can't be matched locally are
+    announced on the match channel; a worker with a compatible user claims
+    the oldest remote waiter from the worker that owns it, which accepts or
+    rejects the claim so a user can never end up in two pairs. Once paired,
+    chat messages travel to the partner's worker channel.
+
+    Workers also republish their global chat user count as a heartbeat
+    (see heartbeat()), so one that dies without saying so stops counting
+    after `worker_timeout` seconds.
+    """
+
+    def __init__(self, backplane: Backplane, worker_id: Optional[str] = None,
+                 worker_timeout: float = CLUSTER_WORKER_TIMEOUT, clock=time.monotonic):
+        self.backplane = backplane
+        self.worker_id = worker_id or make_worker_id()
+        self.worker_timeout = worker_timeout
+        self._clock = clock
+        self.inbox = WORKER_CHANNEL.format(self.worker_id)
+        self.manager = None  # ConnectionManager
+        self.global_chat = None  # GlobalChatManager
+        self.remote_waiting: Dict[ClusterKey, "OrderedDict[str, str]"] = {}  # key -> remote user -> worker
+        self.remote_waiting_keys: Dict[str, ClusterKey] = {}  # remote user -> key
+        self.announced: Dict[str, ClusterKey] = {}  # Local users announced as waiting
+        self.pending_claims: Dict[str, Tuple[str, str, ClusterKey]] = {}  # local user -> (remote user, worker, key)
+        self.remote_partners: Dict[str, str] = {}  # local user -> worker hosting their partner
+        self.remote_global_users: Dict[str, int] = {}  # worker -> users in global chat there
+        self.remote_heard: Dict[str, float] = {}  # worker -> when it last published on the global channel
+        self._tasks: Set[asyncio.Task] = set()
+
+    def bind(self, manager, global_chat):
+        self.manager = manager
+        self.global_chat = global_chat
+        manager.cluster = self
+        global_chat.cluster = self
+
+    async def start(self):
+        await self.backplane.start()
+        await self.backplane.subscribe(self.inbox, self._on_direct)
+        await self.backplane.subscribe(MATCH_CHANNEL, self._on_match)
+        await self.backplane.subscribe(GLOBAL_CHANNEL, self._on_global)
+
+    async def stop(self):
+        # Tell the other workers to forget this one's users
+        for user_id in list(self.announced):
+            await self._publish(MATCH_CHANNEL, {"op": "gone", "user": user_id, "worker": self.worker_id})
+        await self._publish(GLOBAL_CHANNEL, {"op": "count", "worker": self.worker_id, "count": 0, "stopping": True})
+        await self.backplane.stop()
+
+    # Matchmaking
+
+    async def offer(self, user_id: str, key: ClusterKey):
+        """Find a partner on another worker for a user that couldn't be matched locally."""
+        remote = self._oldest_remote(key)
+        if remote is None:
+            self.announced[user_id] = key
+            await self._publish(MATCH_CHANNEL, {"op": "waiting", "user": user_id, "key": list(key), "worker": self.worker_id})
+            return
+
+        remote_user, worker = remote
+        self._forget_remote(remote_user)
+        # Keep the user out of local matching until the owning worker answers
+        self.pending_claims[user_id] = (remote_user, worker, key)
+        if key[0] == "code":
+            self.manager.remove_user_from_code_waiting(user_id)
+        else:
+            self.manager.waiting_users.hold(user_id)
+        await self._publish(WORKER_CHANNEL.format(worker), {
+            "op": "claim", "user": remote_user, "partner": user_id, "worker": self.worker_id, "key": list(key)
+        })
+
+    def withdraw(self, user_id: str):
+        """Stop advertising a local user as waiting (they were paired or left)."""
+        if self.announced.pop(user_id, None) is not None:
+            self._spawn(self._publish(MATCH_CHANNEL, {"op": "gone", "user": user_id, "worker": self.worker_id}))
+
+    def user_left(self, user_id: str, partner_id: Optional[str]):
+        """Clean up after a local user disconnects, telling a remote partner if there is one."""
+        self.withdraw(user_id)
+        self.pending_claims.pop(user_id, None)  # The claim answer will find them gone
+        worker = self.remote_partners.pop(user_id, None)
+        if worker is not None and partner_id is not None:
+            self._spawn(self._publish(WORKER_CHANNEL.format(worker), {
+                "op": "partner_left", "to": partner_id, "user": user_id
+            }))
+
+    def _oldest_remote(self, key: ClusterKey) -> Optional[Tuple[str, str]]:
+        waiting = self.remote_waiting.get(key)
+        if not waiting:
+            return None
+        return next(iter(waiting.items()))
+
+    def _forget_remote(self, user_id: str):
+        key = self.remote_waiting_keys.pop(user_id, None)
+        if key is None:
+            return
+        waiting = self.remote_waiting.get(key)
+        if waiting is not None:
+            waiting.pop(user_id, None)
+            if not waiting:
+                del self.remote_waiting[key]
+
+    def _oldest_local(self, key: ClusterKey) -> Optional[str]:
+        if key[0] == "code":
+            user_id = self.manager.code_waiting_users.get(key[1])
+        else:
+            user_id = self.manager.waiting_users.oldest((key[1], key[2]))
+        if user_id is not None and user_id in self.announced:
+            return user_id
+        return None
+
+    def _can_be_claimed(self, user_id: str, key: ClusterKey) -> bool:
+        manager = self.manager
+        if user_id not in manager.active_connections or user_id in manager.chat_pairs:
+            return False
+        if user_id in self.pending_claims:
+            return False
+        if key[0] == "code":
+            return manager.code_waiting_users.get(key[1]) == user_id
+        return user_id in manager.waiting_users and not manager._user_has_code(user_id)
+
+    async def _on_match(self, message: Dict):
+        worker = message.get("worker")
+        if worker == self.worker_id:
+            return
+        user_id = message["user"]
+        if message["op"] == "gone":
+            self._forget_remote(user_id)
+            return
+        if message["op"] != "waiting":
+            return
+
+        key = tuple(message["key"])
+        self._forget_remote(user_id)
+        self.remote_waiting.setdefault(key, OrderedDict())[user_id] = worker
+        self.remote_waiting_keys[user_id] = key
+
+        # Two workers may announce compatible users at the same time; the one
+        # with the lower id makes the claim so they don't both sit waiting
+        if self.worker_id < worker:
+            local_user = self._oldest_local(key)
+            if local_user is not None:
+                await self.offer(local_user, key)
+
+    async def _on_direct(self, message: Dict):
+        op = message.get("op")
+        if op == "claim":
+            await self._on_claim(message)
+        elif op == "claim_ok":
+            await self._on_claim_ok(message)
+        elif op == "claim_rejected":
+            await self._on_claim_rejected(message)
+        elif op == "deliver":
+            user_id = message["to"]
+            if self.manager.chat_pairs.get(user_id) == message["from"]:
+                try:
+                    # Held for the user if they are reconnecting
+                    await self.manager.send_frame(user_id, encode_frame(message["payload"]))
+                except Exception as e:
+                    print(f"Error delivering message to {user_id}: {e}")
+        elif op == "partner_left":
+            user_id = message["to"]
+            if self.manager.chat_pairs.get(user_id) == message["user"]:
+                self.manager.chat_pairs.unpair(user_id)
+                self.remote_partners.pop(user_id, None)
+                if user_id in self.manager.active_connections:
+                    await self._notify(self.manager.notify_partner_left(user_id))
+                else:
+                    self.manager.disconnect(user_id)  # Away and reconnecting, with no chat left to come back to
+
+    async def _on_claim(self, message: Dict):
+        user_id, partner_id, worker = message["user"], message["partner"], message["worker"]
+        key = tuple(message["key"])
+        reply_to = WORKER_CHANNEL.format(worker)
+        if not self._can_be_claimed(user_id, key):
+            await self._publish(reply_to, {"op": "claim_rejected", "user": partner_id, "partner": user_id, "key": list(key)})
+            return
+
+        if key[0] == "code":
+            self.manager.remove_user_from_code_waiting(user_id)
+        self.manager.waiting_users.pop(user_id, None)
+        self.manager.chat_pairs.link(user_id, partner_id)
+        self.remote_partners[user_id] = worker
+        self.withdraw(user_id)
+        await self._publish(reply_to, {
+            "op": "claim_ok", "user": partner_id, "partner": user_id, "worker": self.worker_id, "key": list(key)
+        })
+        await self._notify(self.manager.notify_paired(user_id, via_code=key[0] == "code"))
+
+    async def _on_claim_ok(self, message: Dict):
+        user_id, partner_id, worker = message["user"], message["partner"], message["worker"]
+        key = tuple(message["key"])
+        self.pending_claims.pop(user_id, None)
+        if user_id not in self.manager.active_connections or user_id in self.manager.chat_pairs:
+            # They left (or were paired) while the claim was in flight
+            await self._publish(WORKER_CHANNEL.format(worker), {"op": "partner_left", "to": partner_id, "user": user_id})
+            return
+
+        self.manager.waiting_users.pop(user_id, None)
+        self.manager.chat_pairs.link(user_id, partner_id)
+        self.remote_partners[user_id] = worker
+        self.withdraw(user_id)
+        await self._notify(self.manager.notify_paired(user_id, via_code=key[0] == "code"))
+
+    async def _on_claim_rejected(self, message: Dict):
+        user_id = message["user"]
+        key = tuple(message["key"])
+        pending = self.pending_claims.pop(user_id, None)
+        if pending is None or user_id not in self.manager.active_connections:
+            return
+
+        # Put the user back and try again, locally first
+        if key[0] == "code":
+            matched_user = self.manager.pair_with_code(user_id, key[1])
+        else:
+            self.manager.waiting_users[user_id] = (key[1], key[2])
+            matched_user = self.manager.pair_users(user_id)
+        if matched_user:
+            self.withdraw(user_id)
+            await self._notify(self.manager.notify_paired(user_id, via_code=key[0] == "code"))
+            await self._notify(self.manager.notify_paired(matched_user, via_code=key[0] == "code"))
+        else:
+            await self.offer(user_id, key)
+
+    # Pair messages
+
+    def is_remote_partner(self, user_id: str) -> bool:
+        return user_id in self.remote_partners
+
+    async def deliver(self, sender: str, receiver: str, payload: Dict):
+        """Send a message to a partner connected to another worker."""
+        worker = self.remote_partners.get(sender)
+        if worker is not None:
+            await self._publish(WORKER_CHANNEL.format(worker), {
+                "op": "deliver", "to": receiver, "from": sender, "payload": payload
+            })
+
+    # Global chat
+
+    async def publish_global(self, frame: str):
+        """Share an encoded global chat frame with the other workers."""
+        await self._publish(GLOBAL_CHANNEL, {"op": "message", "worker": self.worker_id, "frame": frame})
+
+    def publish_global_count(self, count: int):
+        """Let the other workers know how many global chat users this worker has."""
+        self._spawn(self._publish(GLOBAL_CHANNEL, {"op": "count", "worker": self.worker_id, "count": count}))
+
+    def remote_global_user_count(self) -> int:
+        return sum(self.remote_global_users.values())
+
+    def heartbeat(self):
+        """Republish this worker's global chat user count, and forget workers that went quiet."""
+        if self.global_chat is not None:
+            self.publish_global_count(len(self.global_chat.active_connections))
+        self.expire_silent_workers()
+
+    def expire_silent_workers(self, now: Optional[float] = None) -> int:
+        """Drop the users of workers not heard from within `worker_timeout`. Returns how many workers."""
+        if not self.worker_timeout:
+            return 0
+        now = self._clock() if now is None else now
+        silent = [worker for worker, heard in self.remote_heard.items() if now - heard > self.worker_timeout]
+        if not silent:
+            return 0
+        for worker in silent:
+            del self.remote_heard[worker]
+            self.remote_global_users.pop(worker, None)
+            for user_id in [user for user, owner in self._remote_waiting_workers() if owner == worker]:
+                self._forget_remote(user_id)
+        print(f"Forgot {len(silent)} worker(s) not heard from for {self.worker_timeout}s: {', '.join(silent)}")
+        if self.global_chat is not None:
+            self.global_chat.user_count_changed()
+        return len(silent)
+
+    def _remote_waiting_workers(self):
+        for waiting in self.remote_waiting.values():
+            yield from waiting.items()
+
+    async def _on_global(self, message: Dict):
+        worker = message.get("worker")
+        if worker == self.worker_id:
+            return
+        op = message["op"]
+        if message.get("stopping"):
+            self.remote_heard.pop(worker, None)
+        else:
+            self.remote_heard[worker] = self._clock()
+        if op == "message":
+            self.global_chat.deliver_remote(message["frame"])
+        elif op == "count":
+            if message["count"]:
+                self.remote_global_users[worker] = message["count"]
+            else:
+                self.remote_global_users.pop(worker, None)
+            self.global_chat.user_count_changed()
+
+    # Helpers
+
+    async def _publish(self, channel: str, message: Dict):
+        try:
+            await self.backplane.publish(channel, message)
+        except Exception as e:
+            print(f"Error publishing to {channel}: {e}")
+
+    async def _notify(self, coro):
+        # The user may have dropped in the meantime; their own handler cleans up
+        try:
+            await coro
+        except Exception as e:
+            print(f"Error notifying user: {e}")
+
+    def _spawn(self, coro):
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()  # No event loop, nothing to tell
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
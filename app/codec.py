@@ -0,0 +1,90 @@
+from typing import Any, Dict
+import json
+
+try:
+    from .config import JSON_CODEC, LOG_PREVIEW_CHARS, MAX_FRAME_SIZE, MAX_MESSAGE_LENGTH
+    from .metrics import MESSAGES_REJECTED
+except ImportError:
+    from config import JSON_CODEC, LOG_PREVIEW_CHARS, MAX_FRAME_SIZE, MAX_MESSAGE_LENGTH
+    from metrics import MESSAGES_REJECTED
+
+# Why an incoming message was dropped
+FRAME_TOO_LARGE = "frame_too_large"  # Rejected on length alone, never parsed
+MESSAGE_TOO_LONG = "message_too_long"
+MALFORMED = "malformed"  # Not JSON, or not a {"message": "..."} object
+
+
+def _stdlib_dumps(message: Any) -> str:
+    # Same output as WebSocket.send_json
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+dumps = _stdlib_dumps
+loads = json.loads
+codec_name = "json"
+
+if JSON_CODEC == "orjson":
+    try:
+        import orjson
+
+        def _orjson_dumps(message: Any) -> str:
+            return orjson.dumps(message).decode("utf-8")
+
+        dumps = _orjson_dumps
+        loads = orjson.loads
+        codec_name = "orjson"
+    except ImportError:
+        print("JSON_CODEC=orjson but orjson is not installed, using json")
+elif JSON_CODEC != "json":
+    print(f"Unknown JSON_CODEC={JSON_CODEC!r}, using json")
+
+# Both codecs raise a subclass of ValueError on bad input
+DecodeError = ValueError
+
+
+async def send_json(websocket, message: Dict):
+    """WebSocket.send_json, encoded with the configured codec."""
+    await websocket.send_text(dumps(message))
+
+
+def truncate(text: str, limit: int = LOG_PREVIEW_CHARS) -> str:
+    """A client payload cut down for logging."""
+    if len(text) <= limit:
+        return repr(text)
+    return f"{text[:limit]!r}... ({len(text)} chars)"
+
+
+class RejectedMessage(ValueError):
+    """An incoming frame that won't be handled, with the reason why."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+        MESSAGES_REJECTED.labels(reason).inc()
+
+    @property
+    def notice(self) -> str:
+        """System message for the sender, or "" if they don't need telling."""
+        if self.reason == MALFORMED:
+            return ""
+        return f"⚠️ Your message is too long. Keep it under {MAX_MESSAGE_LENGTH} characters."
+
+
+def decode_chat_message(raw: str) -> str:
+    """The text of a {"message": "..."} frame. Raises RejectedMessage.
+
+    Length is checked before parsing, so an oversized frame costs a len()
+    rather than a full decode followed by moderation.
+    """
+    if len(raw) > MAX_FRAME_SIZE:
+        raise RejectedMessage(FRAME_TOO_LARGE)
+    try:
+        data = loads(raw)
+    except DecodeError:
+        raise RejectedMessage(MALFORMED) from None
+    message = data.get("message") if isinstance(data, dict) else None
+    if not isinstance(message, str):
+        raise RejectedMessage(MALFORMED)
+    if len(message) > MAX_MESSAGE_LENGTH:
+        raise RejectedMessage(MESSAGE_TOO_LONG)
+    return message
@@ -0,0 +1,110 @@
+import os
+
+# Runtime settings, overridable through environment variables on the host
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def _env_str(name: str, default: str) -> str:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip()
+
+
+# Global chat fan-out
+GLOBAL_SEND_QUEUE_SIZE = _env_int("GLOBAL_SEND_QUEUE_SIZE", 256)  # Frames buffered per connection
+GLOBAL_SLOW_CONSUMER_POLICY = _env_str("GLOBAL_SLOW_CONSUMER_POLICY", "coalesce")  # drop | coalesce | disconnect
+
+# Global chat history
+GLOBAL_HISTORY_CAPACITY = _env_int("GLOBAL_HISTORY_CAPACITY", 100)  # Messages kept in memory
+GLOBAL_HISTORY_REPLAY = _env_int("GLOBAL_HISTORY_REPLAY", 20)  # Messages sent to a user when they join
+GLOBAL_HISTORY_PAGE_SIZE = _env_int("GLOBAL_HISTORY_PAGE_SIZE", 50)  # Most messages per "load older messages" page
+GLOBAL_RESYNC_MAX = _env_int("GLOBAL_RESYNC_MAX", 100)  # Most missed messages resent on reconnect; further behind gets a reset
+# Collect messages for this long and send them as one "batch" frame to clients that support it (0 = off)
+GLOBAL_BATCH_WINDOW_MS = _env_int("GLOBAL_BATCH_WINDOW_MS", 0)
+# Joins and leaves within this window are sent as one user count update (0 = an update per join or leave)
+USER_COUNT_DEBOUNCE_MS = _env_int("USER_COUNT_DEBOUNCE_MS", 250)
+
+# Global chat log on disk, so history survives restarts ("off" to disable)
+GLOBAL_LOG_DIR = _env_str(
+    "GLOBAL_LOG_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "global_chat"),
+)
+if GLOBAL_LOG_DIR.lower() == "off":
+    GLOBAL_LOG_DIR = ""
+GLOBAL_LOG_SEGMENT_KB = _env_int("GLOBAL_LOG_SEGMENT_KB", 4096)  # Size at which a new segment file is started
+GLOBAL_LOG_MAX_SEGMENTS = _env_int("GLOBAL_LOG_MAX_SEGMENTS", 8)  # Older segments are deleted
+
+# Profanity filter
+MODERATION_CACHE_SIZE = _env_int("MODERATION_CACHE_SIZE", 4096)  # Recently moderated messages kept
+MODERATION_CACHE_MAX_LENGTH = _env_int("MODERATION_CACHE_MAX_LENGTH", 280)  # Longer messages skip the cache
+MODERATION_EXECUTOR = _env_str("MODERATION_EXECUTOR", "process")  # process | thread | inline (on the event loop)
+MODERATION_WORKERS = _env_int("MODERATION_WORKERS", 2)  # Pool size (0 = inline)
+MODERATION_MAX_IN_FLIGHT = _env_int("MODERATION_MAX_IN_FLIGHT", 64)  # Messages queued for or running in the pool at once
+MODERATION_INLINE_CHARS = _env_int("MODERATION_INLINE_CHARS", 200)  # Messages up to this long skip the pool
+FILTER_SNAPSHOT_PATH = _env_str(  # Compiled filter + admin edits, reloaded on restart ("off" to disable)
+    "FILTER_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "filter_snapshot.json"),
+)
+if FILTER_SNAPSHOT_PATH.lower() == "off":
+    FILTER_SNAPSHOT_PATH = ""
+
+# Cross-worker backplane: memory:// for a single worker, redis://host:port to share state between workers
+BACKPLANE_URL = _env_str("BACKPLANE_URL", "memory://")
+# Each worker republishes its global chat user count this often; a worker not heard from for
+# CLUSTER_WORKER_TIMEOUT seconds (it died without saying so) has its users dropped from the count (0 = never)
+CLUSTER_HEARTBEAT_INTERVAL = _env_int("CLUSTER_HEARTBEAT_INTERVAL", 10)
+CLUSTER_WORKER_TIMEOUT = _env_int("CLUSTER_WORKER_TIMEOUT", 35)
+
+# Flood protection: token buckets per user and per IP on incoming chat messages
+RATE_LIMIT_USER_BURST = _env_int("RATE_LIMIT_USER_BURST", 8)  # Messages a user can send at once
+RATE_LIMIT_USER_PER_MINUTE = _env_int("RATE_LIMIT_USER_PER_MINUTE", 60)  # Sustained rate
+# Per-IP limit, off by default: behind a proxy every client has the proxy's address unless uvicorn is
+# told to trust its X-Forwarded-For (--forwarded-allow-ips). Turn it on with e.g. 100 once it is
+RATE_LIMIT_IP_BURST = _env_int("RATE_LIMIT_IP_BURST", 0)  # 0 = no per-IP limit
+RATE_LIMIT_IP_PER_MINUTE = _env_int("RATE_LIMIT_IP_PER_MINUTE", 1200)
+RATE_LIMIT_MUTE_AFTER = _env_int("RATE_LIMIT_MUTE_AFTER", 20)  # Dropped messages in a row before muting (0 = never)
+RATE_LIMIT_MUTE_SECONDS = _env_int("RATE_LIMIT_MUTE_SECONDS", 60)
+
+# Paired chats survive a dropped connection for this long, so the user can reconnect to the same chat (0 = off)
+SESSION_GRACE_SECONDS = _env_int("SESSION_GRACE_SECONDS", 30)
+SESSION_BUFFER_SIZE = _env_int("SESSION_BUFFER_SIZE", 50)  # Frames held for a reconnecting user
+
+# Handoff between deploys: held chats, waiting users and history saved on shutdown, loaded on startup ("off" to disable)
+HANDOFF_PATH = _env_str(
+    "HANDOFF_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "handoff.json"),
+)
+if HANDOFF_PATH.lower() == "off":
+    HANDOFF_PATH = ""
+ADMIN_TOKEN = _env_str("ADMIN_TOKEN", "")  # Needed for POST /admin/drain (unset = drain only on shutdown)
+
+# Incoming messages
+MAX_FRAME_SIZE = _env_int("MAX_FRAME_SIZE", 4096)  # Characters; larger frames are rejected before parsing
+MAX_MESSAGE_LENGTH = _env_int("MAX_MESSAGE_LENGTH", 1000)  # Characters of chat text
+LOG_PREVIEW_CHARS = _env_int("LOG_PREVIEW_CHARS", 200)  # Client payloads are cut to this in logs
+JSON_CODEC = _env_str("JSON_CODEC", "json")  # json | orjson (needs `pip install orjson`)
+
+# Background jobs (seconds between runs)
+STANDBY_CLEANUP_INTERVAL = _env_int("STANDBY_CLEANUP_INTERVAL", 30)
+STANDBY_TIMEOUT = _env_int("STANDBY_TIMEOUT", 60)  # Seconds without a heartbeat before a standby user is dropped
+USER_COUNT_BROADCAST_INTERVAL = _env_int("USER_COUNT_BROADCAST_INTERVAL", 30)
+REAPER_INTERVAL = _env_int("REAPER_INTERVAL", 60)
+# Keepalive for pair, code and global chat clients that connect with ?keepalive=1 (either 0 = off)
+KEEPALIVE_INTERVAL = _env_int("KEEPALIVE_INTERVAL", 25)  # Seconds between pings
+KEEPALIVE_TIMEOUT = _env_int("KEEPALIVE_TIMEOUT", 60)  # Seconds without hearing from a client before it is dropped
+PRESENCE_STATS_INTERVAL = _env_int("PRESENCE_STATS_INTERVAL", 2)  # How often changed stats are pushed to presence sockets
+
+# Stats endpoints
+STATS_CACHE_TTL = _env_int("STATS_CACHE_TTL", 1)  # Seconds a stats snapshot is reused (and may be cached by clients)
+STATS_STREAM_KEEPALIVE = _env_int("STATS_STREAM_KEEPALIVE", 15)  # Seconds between keepalive comments on idle streams
@@ -0,0 +1,88 @@
+from typing import Dict, Iterator, List, Optional, Set
+import time
+
+
+class ExpiryWheel:
+    """Keys that expire `timeout` seconds after they were last touched.
+
+    A hashed timing wheel: each key sits in the slot for the tick its deadline
+    falls in, so touching a key is O(1) and ``expire()`` only visits the slots
+    that came due since the previous call, instead of every key. Deadlines are
+    rounded up to the next tick, so a key may outlive its timeout by up to
+    `resolution` seconds.
+    """
+
+    def __init__(self, timeout: float, resolution: float = 1.0, clock=time.monotonic):
+        self.timeout = timeout
+        self.resolution = resolution
+        self._clock = clock
+        self._ticks: Dict[str, int] = {}  # key -> tick its deadline falls in
+        self._slots: Dict[int, Set[str]] = {}  # tick -> keys due then
+        self._swept = self._tick(clock())  # Every slot before this one has been expired
+
+    def _tick(self, when: float) -> int:
+        return int(when // self.resolution)
+
+    def touch(self, key: str, now: Optional[float] = None):
+        """Add a key, or push back its deadline if it is already here."""
+        tick = int(((self._clock() if now is None else now) + self.timeout) // self.resolution)
+        old_tick = self._ticks.get(key)
+        if old_tick == tick:
+            return
+        if old_tick is not None:
+            self._unslot(key, old_tick)
+        self._ticks[key] = tick
+        keys = self._slots.get(tick)
+        if keys is None:
+            keys = self._slots[tick] = set()
+        keys.add(key)
+
+    def refresh(self, key: str, now: Optional[float] = None) -> bool:
+        """Push back the deadline of a key that is already here. Returns False if it isn't."""
+        if key not in self._ticks:
+            return False
+        self.touch(key, now)
+        return True
+
+    def discard(self, key: str):
+        tick = self._ticks.pop(key, None)
+        if tick is not None:
+            self._unslot(key, tick)
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """Remove and return every key whose deadline has passed."""
+        current = self._tick(self._clock() if now is None else now)
+        if current <= self._swept:
+            return []
+
+        if current - self._swept <= len(self._slots):
+            due = range(self._swept, current)
+        else:
+            # Long gap since the last sweep: cheaper to look at the occupied slots
+            due = sorted(tick for tick in self._slots if tick < current)
+        self._swept = current
+
+        expired = []
+        for tick in due:
+            keys = self._slots.pop(tick, None)
+            if keys:
+                for key in keys:
+                    del self._ticks[key]
+                expired.extend(keys)
+        return expired
+
+    def _unslot(self, key: str, tick: int):
+        keys = self._slots.get(tick)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._slots[tick]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._ticks
+
+    def __len__(self) -> int:
+        return len(self._ticks)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ticks)
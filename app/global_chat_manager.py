@@ -1,33 +1,119 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List
-import json
-import threading
+from starlette.websockets import WebSocketState
+from typing import Dict, List, Optional
+import asyncio
+import secrets
 import time
 import uuid
-from better_profanity import profanity
 from datetime import datetime, timedelta
+
+try:
+    from .background import BackgroundTasks, close_quietly, send_away
+    from .broadcast import Broadcaster, OutboundQueue, encode_frame
+    from .chatlog import ChatLog
+    from .codec import RejectedMessage, decode_chat_message, loads, truncate
+    from .config import (GLOBAL_BATCH_WINDOW_MS, GLOBAL_HISTORY_CAPACITY, GLOBAL_HISTORY_REPLAY,
+                         GLOBAL_LOG_DIR, GLOBAL_LOG_MAX_SEGMENTS, GLOBAL_LOG_SEGMENT_KB, GLOBAL_RESYNC_MAX,
+                         GLOBAL_SEND_QUEUE_SIZE, GLOBAL_SLOW_CONSUMER_POLICY, KEEPALIVE_INTERVAL, KEEPALIVE_TIMEOUT,
+                         USER_COUNT_DEBOUNCE_MS)
+    from .history import MessageHistory
+    from .keepalive import PING_FRAME, KeepAlive
+    from .metrics import CONNECTION_ACCEPT_SECONDS, CONNECTIONS_REAPED, GLOBAL_REPLAYS, MODERATION_SECONDS
+    from .moderation import moderation_pool
+    from .ratelimit import ALLOW, flood_guard, flood_notice
+    from .sessions import IDLE_TIMEOUT
+    from .system_messages import system_messages
+except ImportError:
+    from background import BackgroundTasks, close_quietly, send_away
+    from broadcast import Broadcaster, OutboundQueue, encode_frame
+    from chatlog import ChatLog
+    from codec import RejectedMessage, decode_chat_message, loads, truncate
+    from config import (GLOBAL_BATCH_WINDOW_MS, GLOBAL_HISTORY_CAPACITY, GLOBAL_HISTORY_REPLAY,
+                        GLOBAL_LOG_DIR, GLOBAL_LOG_MAX_SEGMENTS, GLOBAL_LOG_SEGMENT_KB, GLOBAL_RESYNC_MAX,
+                        GLOBAL_SEND_QUEUE_SIZE, GLOBAL_SLOW_CONSUMER_POLICY, KEEPALIVE_INTERVAL, KEEPALIVE_TIMEOUT,
+                        USER_COUNT_DEBOUNCE_MS)
+    from history import MessageHistory
+    from keepalive import PING_FRAME, KeepAlive
+    from metrics import CONNECTION_ACCEPT_SECONDS, CONNECTIONS_REAPED, GLOBAL_REPLAYS, MODERATION_SECONDS
+    from moderation import moderation_pool
+    from ratelimit import ALLOW, flood_guard, flood_notice
+    from sessions import IDLE_TIMEOUT
+    from system_messages import system_messages
+
 class GlobalChatManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}  # user_id -> websocket
-        self.message_history: List[Dict] = []  # Store recent messages
-        self.max_messages = 100  # Keep last 100 messages
-        self.lock = threading.Lock()
-        self.start_user_count_broadcast()
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        """Accept websocket connection and add user to global chat."""
+        self.message_history = MessageHistory(GLOBAL_HISTORY_CAPACITY)  # Recent messages, pre-encoded
+        self.replay_depth = GLOBAL_HISTORY_REPLAY  # Messages replayed to a user when they join
+        self.resync_max = GLOBAL_RESYNC_MAX  # Most missed messages resent to a user coming back
+        # Every message gets the next sequence number; `stream` names the numbering, which starts
+        # over in another worker, or after a restart unless picked up from the log or a handoff
+        self.seq = 0  # Number of the newest message
+        self.stream = secrets.token_urlsafe(6)
+        # Every message on disk too, opened with the app; older pages are read from it on demand
+        self.log = ChatLog(GLOBAL_LOG_DIR, GLOBAL_LOG_SEGMENT_KB * 1024, GLOBAL_LOG_MAX_SEGMENTS) if GLOBAL_LOG_DIR else None
+        # Every send goes through a per-connection queue so one slow client can't hold up the rest
+        self.broadcaster = Broadcaster(
+            maxsize=GLOBAL_SEND_QUEUE_SIZE,
+            policy=GLOBAL_SLOW_CONSUMER_POLICY,
+            on_broken=self._connection_broken,
+            batch_window=GLOBAL_BATCH_WINDOW_MS / 1000,
+        )
+        self.cluster = None  # ClusterRouter, set when the app starts
+        # Joins and leaves within this many seconds make one user count update
+        self.count_debounce = USER_COUNT_DEBOUNCE_MS / 1000
+        self._count_handle: Optional[asyncio.TimerHandle] = None
+        self._sent_count: Optional[int] = None  # Count in the last update sent
+        self._count_frame: Optional[str] = None  # That update, encoded, for users who join before the next one
+        self._published_count: Optional[int] = None  # Local count the other workers were last told
+        self.keepalive = KeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_TIMEOUT)  # Connections pinged, and dropped once they go quiet
+        self._tasks = BackgroundTasks()  # Idle and replaced connections being closed, and clients being sent away
+        self.draining = False  # Set by drain(): new joins are turned away
+        # Metrics, bound once
+        self._accept_seconds = CONNECTION_ACCEPT_SECONDS.labels("global")
+        self._moderation_seconds = MODERATION_SECONDS.labels("global")
+        self._reaped_idle = CONNECTIONS_REAPED.labels("global", "idle")
+        self._reaped_closed = CONNECTIONS_REAPED.labels("global", "closed")
+        self._replays = {kind: GLOBAL_REPLAYS.labels(kind) for kind in ("join", "resync", "current", "reset")}
+
+    @property
+    def active_connections(self) -> Dict[str, OutboundQueue]:
+        """Connected users. The broadcaster's queues (each holding its websocket) are the only table of them."""
+        return self.broadcaster.queues
+
+    async def connect(self, websocket: WebSocket, user_id: str, batch: bool = False, keepalive: bool = False,
+                      since: Optional[int] = None, stream: Optional[str] = None) -> bool:
+        """Accept websocket connection and add user to global chat.
+
+        Clients that can read "batch" frames pass `batch` to get bursts of
+        messages grouped into one frame (when GLOBAL_BATCH_WINDOW_MS is set).
+        Clients that answer pings pass `keepalive`. Clients coming back pass
+        the "seq" of the last message they have as `since`, and its "stream",
+        to be sent only what they missed (see replay()). Returns False if the
+        worker is draining and the client was sent away instead.
+        """
+        started = time.perf_counter()
         await websocket.accept()
+        self._accept_seconds.observe(time.perf_counter() - started)
+        if self.draining:
+            await send_away(websocket, system_messages())
+            return False
         
-        with self.lock:
-            self.active_connections[user_id] = websocket
+        previous = self.active_connections.get(user_id)
+        outbound = self.broadcaster.add(user_id, websocket, batched=batch)
+        if previous is not None:
+            self._tasks.spawn(close_quietly(previous.websocket))
+        if keepalive:
+            self.keepalive.watch(user_id)
+        else:
+            self.keepalive.forget(user_id)  # An older connection with this id may have been watched
+        if self._count_frame is not None:
+            # Replaced in the queue if the update for this join comes before it is sent
+            outbound.push(self._count_frame, coalesce_key="user_count")
         
-        # Send recent message history to the new user
-        recent_messages = self.message_history[-20:]  # Last 20 messages
-        for message in recent_messages:
-            try:
-                await websocket.send_json(message)
-            except:
-                pass  # If sending fails, continue
+        # Send recent message history, or what they missed, to the new user as one batched frame
+        history_frame = self.replay(since, stream)
+        if history_frame:
+            outbound.push(history_frame)
         
         # Send welcome message
         # welcome_message = {
@@ -42,57 +128,207 @@ class GlobalChatManager:
         # except:
         #     pass
         
-        # Broadcast user count update
-        await self.broadcast_user_count()
-
-    def disconnect(self, user_id: str):
-        """Remove user from global chat."""
-        with self.lock:
-            if user_id in self.active_connections:
-                del self.active_connections[user_id]
-        
-        # Don't await here since this might be called from a disconnect handler
-        # Instead, we'll rely on the periodic user count broadcast
+        self.user_count_changed()
+        return True
+
+    def replay(self, since: Optional[int] = None, stream: Optional[str] = None) -> Optional[str]:
+        """The frame of messages for a user joining, or coming back after message `since`.
+
+        A new user gets a "history" frame of recent messages. One coming back
+        gets a "history" frame with just the messages after `since`, or
+        nothing if they missed none. If those aren't all still in memory (more
+        than `resync_max` ago), or `since` is from another stream, they get a
+        "reset" frame of recent messages to show instead of what they have.
+        Every frame carries the current "seq" and "stream".
+        """
+        if since is None:
+            self._replays["join"].inc()
+            return self.message_history.replay_frame(
+                self.replay_depth, before=self.history_cursor(), seq=self.seq, stream=self.stream)
+        missed = self.seq - since
+        if (stream is None or stream == self.stream) and 0 <= missed <= min(self.resync_max, len(self.message_history)):
+            if not missed:
+                self._replays["current"].inc()
+                return None
+            self._replays["resync"].inc()
+            return self.message_history.replay_frame(missed, since=since, seq=self.seq, stream=self.stream)
+        self._replays["reset"].inc()
+        return self.message_history.replay_frame(
+            self.replay_depth, "reset", before=self.history_cursor(), seq=self.seq, stream=self.stream)
+
+    def open_log(self):
+        """Open the log on disk and reload recent history from its tail."""
+        if self.log is None or not self.log.open():
+            self.log = None
+            return
+        if not len(self.message_history):
+            for frame in self.log.tail(self.message_history.capacity):
+                self.message_history.append(frame)
+            # Message N is at log position N - 1, so the numbering carries on from the log,
+            # under the same stream if the log was saved with one and agrees with it
+            self.seq = max(self.log.end, last_seq(self.message_history.recent(1)))
+            if self.log.stream and self.seq == self.log.end:
+                self.stream = self.log.stream
+        self.log.save_stream(self.stream)
+        print(f"Global chat log: {len(self.log)} messages on disk, {len(self.message_history)} reloaded")
+
+    def close_log(self):
+        if self.log is not None:
+            self.log.close()
+
+    def export_history(self) -> List[str]:
+        """Recent messages to hand to the next worker; none if the log on disk already has them."""
+        if self.log is not None:
+            return []
+        return self.message_history.recent(self.message_history.capacity)
+
+    def export_stream(self) -> Dict:
+        """The message numbering, for the next worker to carry on with."""
+        return {"stream": self.stream, "seq": self.seq}
+
+    def restore_history(self, frames: List[str], numbering: Optional[Dict] = None):
+        """Seed history with the messages handed over by the previous worker, and carry on its numbering.
+
+        The numbering is only taken if this worker's history ends at the same
+        message, so clients' `since` still means the same thing here.
+        """
+        if not len(self.message_history):
+            for frame in frames:
+                self.message_history.append(frame)
+            self.seq = last_seq(frames) or len(frames)
+        if numbering and numbering.get("seq") == self.seq:
+            self.stream = numbering["stream"]
+            if self.log is not None:
+                self.log.save_stream(self.stream)
+
+    def history_cursor(self) -> Optional[int]:
+        """Log position of the oldest message a joining user is sent, or None if nothing older is on disk."""
+        if self.log is None:
+            return None
+        cursor = self.log.end - min(self.replay_depth, len(self.message_history))
+        return cursor if cursor > self.log.start else None
+
+    def history_page(self, before: Optional[int], limit: int) -> str:
+        """JSON body with up to `limit` messages older than log position `before` (newest if None)."""
+        if self.log is None:
+            return '{"messages":[],"before":null}'
+        frames, cursor = self.log.before(self.log.end if before is None else before, limit)
+        return '{"messages":[' + ",".join(frames) + '],"before":' + ("null" if cursor is None else str(cursor)) + "}"
+
+    def _remember(self, frame: str):
+        self.message_history.append(frame)
+        if self.log is not None:
+            try:
+                self.log.append(frame)
+            except OSError as e:
+                # Message N must be at log position N - 1, and with this one missing every later
+                # one would be off by one. Stop logging, and don't let a restart carry on this
+                # numbering from a log that no longer matches it
+                print(f"Error writing message {self.seq} to the global chat log, no longer logging: {e}")
+                self.log.save_stream(None)
+                self.log.close()
+                self.log = None
+
+    def drain(self):
+        """Turn away new joins and send every client away, to reconnect to the worker taking over.
+
+        History and numbering stay for export_history() and export_stream(),
+        so clients coming back with `since` there only get what they missed.
+        """
+        self.draining = True
+        leaving = [(user_id, queue.websocket) for user_id, queue in self.active_connections.items()]
+        catalog = system_messages()
+        for user_id, websocket in leaving:
+            # Stop the writer first, so the notice is the last thing the client is sent
+            self.broadcaster.remove(user_id, websocket)
+            self.keepalive.forget(user_id)
+            self._tasks.spawn(send_away(websocket, catalog))
+        if self._count_handle is not None:
+            self._count_handle.cancel()
+            self._count_handle = None
+
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Remove user from global chat.
+
+        With `websocket`, nothing happens unless it is still the user's
+        current connection, so a replaced connection can't drop the one that
+        replaced it.
+        """
+        if not self.broadcaster.remove(user_id, websocket) and websocket is not None:
+            return
+        self.keepalive.forget(user_id)
+        self.user_count_changed()
 
     async def broadcast_message(self, message_data: Dict, sender_id: str = None):
         """Broadcast a message to all connected users except the sender."""
-        # Add message to history
-        with self.lock:
-            self.message_history.append(message_data)
-            if len(self.message_history) > self.max_messages:
-                self.message_history.pop(0)
-        
-        # Broadcast to all users except the sender
-        disconnected_users = []
-        
-        for user_id, websocket in list(self.active_connections.items()):
-            # Skip sending to the sender to avoid duplicate messages
-            if sender_id and user_id == sender_id:
-                continue
-                
-            try:
-                await websocket.send_json(message_data)
-            except:
-                # Connection is broken, mark for removal
-                disconnected_users.append(user_id)
+        # Serialize once; the same frame goes into history and out to every connection
+        frame = encode_frame(message_data)
+        numbered = self._number(frame)
+        self._remember(numbered)
         
-        # Clean up disconnected users
-        with self.lock:
-            for user_id in disconnected_users:
-                if user_id in self.active_connections:
-                    del self.active_connections[user_id]
+        # Queue for all users except the sender (avoids duplicate messages);
+        # broken connections are dropped by their writer through _connection_broken
+        self.broadcaster.broadcast_frame(numbered, exclude=sender_id, batch=True)
+
+        # Users connected to other workers get it from there, numbered by that worker
+        if self.cluster:
+            await self.cluster.publish_global(frame)
+
+    def deliver_remote(self, frame: str):
+        """Deliver a message frame that was sent to another worker."""
+        numbered = self._number(frame)
+        self._remember(numbered)
+        self.broadcaster.broadcast_frame(numbered, batch=True)
+
+    def _number(self, frame: str) -> str:
+        """Give an encoded message the next sequence number, as a "seq" key at its end."""
+        self.seq += 1
+        return f'{frame[:-1]},"seq":{self.seq}}}'
+
+    def _connection_broken(self, user_id: str):
+        """Note a user whose connection failed while sending; the broadcaster has already dropped them."""
+        self.keepalive.forget(user_id)
+        self.user_count_changed()
+
+    def allow_message(self, user_id: str, ip: Optional[str] = None) -> bool:
+        """Check a user's next message against the flood limits, telling them if it was dropped."""
+        verdict = flood_guard.check(user_id, ip)
+        if verdict == ALLOW:
+            return True
+        notice = flood_notice(verdict)
+        if notice:
+            self.send_notice(user_id, notice)
+        return False
+
+    def send_notice(self, user_id: str, notice: str):
+        """Send one user a system message."""
+        ph_time = datetime.now() + timedelta(hours=8)
+        self.broadcaster.send(user_id, {
+            "type": "system",
+            "message": notice,
+            "timestamp": ph_time.isoformat(),
+            "message_id": str(uuid.uuid4())
+        })
 
     async def process_message(self, user_id: str, raw_message: str):
         """Process and broadcast a user message."""
         try:
-            message_data = json.loads(raw_message)
-            user_message = message_data.get("message", "").strip()
-            
-            if not user_message:
-                return
-            
-            # Filter profanity
-            filtered_message = profanity.censor(user_message)
+            user_message = decode_chat_message(raw_message).strip()
+        except RejectedMessage as rejected:
+            if rejected.notice:
+                self.send_notice(user_id, rejected.notice)
+            else:
+                print(f"Invalid message from user {user_id}: {truncate(raw_message)}")
+            return
+        if not user_message:
+            return
+
+        try:
+            # Filter profanity (censors and detects in one pass), off the event loop if it's long
+            started = time.perf_counter()
+            moderation = await moderation_pool.moderate(user_message)
+            self._moderation_seconds.observe(time.perf_counter() - started)
+            filtered_message = moderation.text
             
             # Create anonymous user identifier (consistent per session)
             anon_id = f"Anon{user_id[:6]}"
@@ -109,7 +345,7 @@ class GlobalChatManager:
             }
             
             # Check if original message contained profanity
-            if profanity.contains_profanity(user_message):
+            if moderation.filtered:
                 # Send warning to sender
                 warning_message = {
                     "type": "system",
@@ -118,41 +354,51 @@ class GlobalChatManager:
                     "message_id": str(uuid.uuid4())
                 }
                 
-                if user_id in self.active_connections:
-                    try:
-                        await self.active_connections[user_id].send_json(warning_message)
-                    except:
-                        pass
+                self.broadcaster.send(user_id, warning_message)
             
             # Broadcast the filtered message
             await self.broadcast_message(broadcast_message, sender_id=user_id)
             
-        except json.JSONDecodeError:
-            print(f"Invalid JSON from user {user_id}: {raw_message}")
         except Exception as e:
             print(f"Error processing message from {user_id}: {e}")
 
-    async def broadcast_user_count(self):
-        """Broadcast current user count to all connected users."""
+    def user_count_changed(self):
+        """Note a join or leave. Every change within the debounce window goes out as one update."""
+        if self._count_handle is not None:
+            return
+        if self.count_debounce <= 0:
+            self.broadcast_user_count()
+            return
+        self._count_handle = asyncio.get_running_loop().call_later(self.count_debounce, self.broadcast_user_count)
+
+    def broadcast_user_count(self):
+        """Broadcast current user count to all connected users, if it changed since the last update."""
+        self._count_handle = None
+        local_count = len(self.active_connections)
+        if self.cluster and local_count != self._published_count:
+            self._published_count = local_count
+            self.cluster.publish_global_count(local_count)
+
+        count = self.user_count()
+        if count == self._sent_count:
+            return
         ph_time = datetime.now() + timedelta(hours=8)  # Use Philippine time for consistency
         user_count_message = {
             "type": "user_count",
-            "count": len(self.active_connections),
+            "count": count,
             "timestamp": ph_time.isoformat()  # Changed to use ph_time
         }
-        
-        disconnected_users = []
-        for user_id, websocket in list(self.active_connections.items()):
-            try:
-                await websocket.send_json(user_count_message)
-            except:
-                disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        with self.lock:
-            for user_id in disconnected_users:
-                if user_id in self.active_connections:
-                    del self.active_connections[user_id]
+        # Encoded once for everyone; only the latest count matters, so a pending one is replaced
+        self._sent_count = count
+        self._count_frame = encode_frame(user_count_message)
+        self.broadcaster.broadcast_frame(self._count_frame, coalesce_key="user_count")
+
+    def user_count(self) -> int:
+        """Users in global chat across every worker."""
+        count = len(self.active_connections)
+        if self.cluster:
+            count += self.cluster.remote_global_user_count()
+        return count
 
     def get_stats(self):
         """Get global chat statistics."""
@@ -161,18 +407,46 @@ class GlobalChatManager:
             "total_messages": len(self.message_history)
         }
 
-    def start_user_count_broadcast(self):
-        """Start background thread to periodically broadcast user count."""
-        import asyncio
-        
-        def broadcast_task():
-            while True:
-                time.sleep(30)  # Broadcast every 30 seconds
-                # Note: We can't await here in a sync thread
-                # The user count will be updated when users join/leave instead
-        
-        broadcast_thread = threading.Thread(target=broadcast_task, daemon=True)
-        broadcast_thread.start()
+    def reap_dead_connections(self):
+        """Drop users whose socket has already closed but who were never cleaned up."""
+        dead_users = [
+            (user_id, queue.websocket) for user_id, queue in self.active_connections.items()
+            if queue.websocket.client_state == WebSocketState.DISCONNECTED
+            or queue.websocket.application_state == WebSocketState.DISCONNECTED
+        ]
+        for user_id, websocket in dead_users:
+            self.disconnect(user_id, websocket)
+
+        if dead_users:
+            self._reaped_closed.inc(len(dead_users))
+            print(f"Reaped {len(dead_users)} dead global chat connections")
+
+    def keep_alive(self):
+        """Drop the connections that stopped answering pings, then ping the rest."""
+        idle = [(user_id, self.active_connections[user_id].websocket)
+                for user_id in self.keepalive.expire() if user_id in self.active_connections]
+        for user_id, websocket in idle:
+            self.disconnect(user_id, websocket)  # Never a connection that replaced the idle one
+            self._tasks.spawn(close_quietly(websocket, IDLE_TIMEOUT))
+        if idle:
+            self._reaped_idle.inc(len(idle))
+            print(f"Dropped {len(idle)} idle global chat connections")
+
+        # Queued like any other frame; an unsent ping is replaced rather than doubled up
+        for user_id in self.keepalive:
+            queue = self.active_connections.get(user_id)
+            if queue is not None:
+                queue.push(PING_FRAME, coalesce_key="ping")
+
+
+def last_seq(frames: List[str]) -> int:
+    """Sequence number of the last of these message frames (0 if there are none, or it has none)."""
+    if not frames:
+        return 0
+    try:
+        return int(loads(frames[-1]).get("seq", 0))
+    except (ValueError, TypeError, AttributeError):
+        return 0
 
 # Create global instance
 global_chat_manager = GlobalChatManager()
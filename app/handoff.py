@@ -0,0 +1,45 @@
+from typing import Dict, Optional
+import json
+import os
+import time
+
+HANDOFF_FORMAT = 1
+
+
+def save_state(path: str, state: Dict) -> bool:
+    """Write the state a shutting-down worker hands to the next one (atomically). Returns whether it was saved."""
+    state = dict(state, format=HANDOFF_FORMAT, saved_at=time.time())
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handoff_file:
+            json.dump(state, handoff_file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not save handoff state to {path}: {e}")
+        return False
+    return True
+
+
+def load_state(path: str) -> Optional[Dict]:
+    """Take the state left by the previous worker, if any.
+
+    The file is removed once read, so it is only ever picked up once. The
+    returned dict has an "age" key: seconds since it was saved.
+    """
+    try:
+        with open(path, encoding="utf-8") as handoff_file:
+            state = json.load(handoff_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable handoff state {path}: {e}")
+        state = None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if not isinstance(state, dict) or state.get("format") != HANDOFF_FORMAT:
+        return None
+    state["age"] = max(0.0, time.time() - state.get("saved_at", 0))
+    return state
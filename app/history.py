@@ -0,0 +1,47 @@
+from collections import deque
+from typing import Deque, List
+
+try:
+    from .codec import dumps
+except ImportError:
+    from codec import dumps
+
+
+class MessageHistory:
+    """Fixed-capacity ring buffer of recent global chat messages.
+
+    Messages are stored as the JSON frames that were already sent to
+    everyone, so appending never copies or re-encodes and a replay is
+    just a join of the stored frames.
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self._frames: Deque[str] = deque(maxlen=capacity)  # Oldest frame falls off in O(1)
+
+    def append(self, frame: str):
+        """Remember an encoded message frame."""
+        self._frames.append(frame)
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def recent(self, count: int) -> List[str]:
+        """Return up to the last `count` frames, oldest first."""
+        if count <= 0:
+            return []
+        size = len(self._frames)
+        if count >= size:
+            return list(self._frames)
+        frames = self._frames
+        return [frames[i] for i in range(size - count, size)]
+
+    def replay_frame(self, count: int, kind: str = "history", **fields) -> str:
+        """Encode the last `count` messages as a single frame of type `kind`.
+
+        `fields` (e.g. "before", the log position of the oldest of them, for
+        clients to page further back from) are added after the messages,
+        leaving out any that are None.
+        """
+        extra = "".join(f',"{key}":{dumps(value)}' for key, value in fields.items() if value is not None)
+        return f'{{"type":"{kind}","messages":[' + ",".join(self.recent(count)) + "]" + extra + "}"
@@ -0,0 +1,58 @@
+from typing import Hashable, Iterator, List
+
+try:
+    from .broadcast import encode_frame
+    from .expiry import ExpiryWheel
+except ImportError:
+    from broadcast import encode_frame
+    from expiry import ExpiryWheel
+
+PING_FRAME = encode_frame({"type": "ping"})
+PONG_FRAME = '{"type":"pong"}'  # What clients answer, byte for byte, so it is spotted without parsing
+
+
+class KeepAlive:
+    """Which of a channel's connections have been heard from lately.
+
+    Clients that connect with ``?keepalive=1`` are watched: the server pings
+    them every `interval` seconds and they answer with a pong, though any
+    frame from them counts. expire() hands back the ones not heard from in
+    `timeout` seconds, so half-open sockets (a phone that lost signal) are
+    found without waiting for a send to fail. Deadlines sit in an
+    ExpiryWheel, so hearing from a client is O(1) and a sweep only looks at
+    the deadlines that came due.
+    """
+
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self._deadlines = ExpiryWheel(timeout)
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0 and self.timeout > 0
+
+    def watch(self, key: Hashable):
+        """Start expecting to hear from a connection."""
+        if self.enabled:
+            self._deadlines.touch(key)
+
+    def seen(self, key: Hashable):
+        """Note a frame from a connection, if it is watched."""
+        self._deadlines.refresh(key)
+
+    def forget(self, key: Hashable):
+        self._deadlines.discard(key)
+
+    def expire(self) -> List[Hashable]:
+        """Stop watching and return every connection gone quiet for longer than the timeout."""
+        return self._deadlines.expire()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._deadlines))
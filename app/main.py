@@ -1,27 +1,87 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from typing import Dict, Tuple, Optional
-import json
-import threading
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Tuple, Optional
+from contextlib import asynccontextmanager
+from starlette.websockets import WebSocketState
+import asyncio
+import secrets
+import time
 from fastapi.middleware.cors import CORSMiddleware
-from better_profanity import profanity
 
 # Handle both local development and deployment imports
 try:
     # For deployment (when run as a package)
+    from .backplane import create_backplane
+    from .background import BackgroundTasks, close_quietly, send_away
+    from .broadcast import encode_batch, encode_frame
+    from .cluster import ClusterRouter, code_key, pair_key
+    from .codec import RejectedMessage, decode_chat_message, send_json, truncate
+    from .config import (ADMIN_TOKEN, BACKPLANE_URL, CLUSTER_HEARTBEAT_INTERVAL, GLOBAL_HISTORY_PAGE_SIZE, HANDOFF_PATH, KEEPALIVE_INTERVAL,
+                         KEEPALIVE_TIMEOUT, PRESENCE_STATS_INTERVAL, REAPER_INTERVAL, SESSION_BUFFER_SIZE, SESSION_GRACE_SECONDS, STANDBY_CLEANUP_INTERVAL, STANDBY_TIMEOUT,
+                         STATS_CACHE_TTL, STATS_STREAM_KEEPALIVE, USER_COUNT_BROADCAST_INTERVAL)
+    from .expiry import ExpiryWheel
     from .global_chat_manager import global_chat_manager
+    from .handoff import load_state, save_state
+    from .keepalive import PING_FRAME, PONG_FRAME, KeepAlive
+    from .matchmaking import MatchmakingQueue
+    from .metrics import (CONNECTION_ACCEPT_SECONDS, CONNECTIONS_REAPED, MODERATION_SECONDS, REGISTRY, SEND_SECONDS,
+                          SESSION_FRAMES_DROPPED, TIME_TO_PAIR_SECONDS, Gauge)
+    from .moderation import message_filter, moderation_pool
+    from .presence import PresenceManager
+    from .ratelimit import ALLOW, client_ip, flood_guard, flood_notice
+    from .registry import ChatPairs, FieldView, KeyedLocks, UserIndex
+    from .scheduler import PeriodicScheduler
+    from .sessions import IDLE_TIMEOUT, LEAVE_CODES, SESSION_ENDED, ChatSession
+    from .stats import StatsFeed
+    from .system_messages import DEFAULT_LOCALE, system_messages
 except ImportError:
     # For local development (when run directly)
+    from backplane import create_backplane
+    from background import BackgroundTasks, close_quietly, send_away
+    from broadcast import encode_batch, encode_frame
+    from cluster import ClusterRouter, code_key, pair_key
+    from codec import RejectedMessage, decode_chat_message, send_json, truncate
+    from config import (ADMIN_TOKEN, BACKPLANE_URL, CLUSTER_HEARTBEAT_INTERVAL, GLOBAL_HISTORY_PAGE_SIZE, HANDOFF_PATH, KEEPALIVE_INTERVAL,
+                        KEEPALIVE_TIMEOUT, PRESENCE_STATS_INTERVAL, REAPER_INTERVAL, SESSION_BUFFER_SIZE, SESSION_GRACE_SECONDS, STANDBY_CLEANUP_INTERVAL, STANDBY_TIMEOUT,
+                        STATS_CACHE_TTL, STATS_STREAM_KEEPALIVE, USER_COUNT_BROADCAST_INTERVAL)
+    from expiry import ExpiryWheel
     from global_chat_manager import global_chat_manager
-
-# white list 
-# whitelist = ['omg', 'damm', 'queer', 'gay'] 
-
-# # 
-# profanity_filter = profanity()
-# Initialize the profanity filter
-profanity.load_censor_words()
-
-app = FastAPI()
+    from handoff import load_state, save_state
+    from keepalive import PING_FRAME, PONG_FRAME, KeepAlive
+    from matchmaking import MatchmakingQueue
+    from metrics import (CONNECTION_ACCEPT_SECONDS, CONNECTIONS_REAPED, MODERATION_SECONDS, REGISTRY, SEND_SECONDS,
+                         SESSION_FRAMES_DROPPED, TIME_TO_PAIR_SECONDS, Gauge)
+    from moderation import message_filter, moderation_pool
+    from presence import PresenceManager
+    from ratelimit import ALLOW, client_ip, flood_guard, flood_notice
+    from registry import ChatPairs, FieldView, KeyedLocks, UserIndex
+    from scheduler import PeriodicScheduler
+    from sessions import IDLE_TIMEOUT, LEAVE_CODES, SESSION_ENDED, ChatSession
+    from stats import StatsFeed
+    from system_messages import DEFAULT_LOCALE, system_messages
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the compiled filter now rather than at import, or on the first message
+    message_filter.load()
+    moderation_pool.start()
+    global_chat_manager.open_log()
+    # In case the app is started again in the same process
+    manager.draining = global_chat_manager.draining = presence.draining = False
+    take_over()
+    # Connect to the other workers (a no-op hop with the default in-memory backplane)
+    await cluster.start()
+    await scheduler.start()
+    yield
+    await hand_off()
+    await scheduler.stop()
+    await cluster.stop()
+    moderation_pool.stop()
+    global_chat_manager.close_log()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -32,87 +92,310 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Message Filter class to handle content moderation
-class MessageFilter:
+# Connection Manager to handle WebSocket connections
+class ConnectionManager:
     def __init__(self):
-        # Add custom words to the filter if needed
-        self.custom_badwords = ["additional_slur1", "additional_slur2"]
-        profanity.add_censor_words(self.custom_badwords)
-    
-    def filter_message(self, message: str) -> str:
-        """Filter inapprop riate content from messages."""
-        # Replace profanity with asterisks
-        return profanity.censor(message)
-    
-    def contains_profanity(self, message: str) -> bool:
-        """Check if a message contains profanity."""
-        return profanity.contains_profanity(message)
-        
-    def add_custom_word(self, word: str) -> bool:
-        """Add a custom word to the filter."""
-        if word not in self.custom_badwords:
-            self.custom_badwords.append(word)
-            profanity.add_censor_words([word])
+        # One record per local user; the tables below are views over it, so each lookup is one dict hit
+        self.users = UserIndex()
+        self.active_connections = FieldView(self.users, "websocket")  # Connected users
+        self.waiting_users = MatchmakingQueue(self.users)  # Waiting users, indexed by (campus, preference)
+        self.chat_pairs = ChatPairs(self.users)  # Paired users, changed only through pair()/link()/unpair()
+        self.sessions = FieldView(self.users, "session")  # Resume token and, while they're away, held frames
+        self.standby_users = ExpiryWheel(STANDBY_TIMEOUT)  # Users on the AdzuChatCard page, expiring without heartbeats
+        self.code_waiting_users: Dict[str, str] = {}  # Code -> user_id mapping for code-based matching
+        self.cluster = None  # ClusterRouter, set when the app starts
+        self.join_locks = KeyedLocks()  # Per user_id, so a user's joins happen one at a time
+        self.grace_period = SESSION_GRACE_SECONDS  # How long a paired user's chat is kept after their socket drops
+        self._tasks = BackgroundTasks()  # Sessions being ended after their grace period, and clients being sent away
+        self.draining = False  # Set by drain(): no new chats, and connections are sent elsewhere
+        self.keepalive = KeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_TIMEOUT)  # Connections pinged, and dropped once they go quiet
+        # Metrics, bound once
+        self._accept_seconds = CONNECTION_ACCEPT_SECONDS.labels("pair")
+        self._send_seconds = SEND_SECONDS.labels("pair")
+        self._moderation_seconds = MODERATION_SECONDS.labels("pair")
+        self._reaped_idle = CONNECTIONS_REAPED.labels("pair", "idle")
+        self._reaped_closed = CONNECTIONS_REAPED.labels("pair", "closed")
+
+    async def connect(self, websocket: WebSocket, user_id: str, campus: str, preference: str,
+                      batch: bool = False, lang: str = DEFAULT_LOCALE, keepalive: bool = False) -> bool:
+        """Accept the websocket connection and add the user to active connections.
+
+        `batch` clients get multi-message events as one batch frame; `lang`
+        picks the language of system messages; `keepalive` clients answer
+        pings. Returns False if the worker is draining and the client was
+        sent away instead.
+        """
+        async with self.join_locks.hold(user_id):
+            previous = self.active_connections.get(user_id)
+            if (previous is not None or user_id in self.sessions) and not self.draining:
+                # Connecting afresh ends any chat the user was still holding on to
+                await self.replace_connection(user_id, previous)
+            started = time.perf_counter()
+            await websocket.accept()
+            self._accept_seconds.observe(time.perf_counter() - started)
+            if self.draining:
+                await send_away(websocket, system_messages(lang, batch))
+                return False
+            self.active_connections[user_id] = websocket
+            self.waiting_users[user_id] = (campus, preference)  # Add user to waiting list
+            record = self.users.get(user_id)
+            record.joined = time.monotonic()
+            record.catalog = system_messages(lang, batch)
+            if keepalive:
+                self.keepalive.watch(user_id)
+            session = self.sessions[user_id] = ChatSession(user_id, SESSION_BUFFER_SIZE)
+            if self.grace_period > 0:
+                # Lets the client pick its chat back up if the connection drops
+                await send_json(websocket, {"type": "session", "token": session.token, "grace": self.grace_period})
+        return True
+
+    async def replace_connection(self, user_id: str, websocket: Optional[WebSocket]):
+        """End a user's older connection (e.g. a reconnect that beat the old socket's close)."""
+        paired_user = self.disconnect(user_id, websocket)
+        if paired_user:
+            await self.notify_partner_left(paired_user)
+        if websocket is None:
+            return
+        try:
+            await websocket.close(code=1000)
+        except Exception:
+            pass  # Already closed
+
+    async def resume(self, websocket: WebSocket, user_id: str, token: str, batch: bool = False,
+                     lang: str = DEFAULT_LOCALE, keepalive: bool = False) -> Optional[ChatSession]:
+        """Reattach a user to the chat they held before their connection dropped.
+
+        A dict lookup and a token check; the user never goes back through
+        matchmaking. Frames held while they were away are replayed.
+        Returns None (after accepting, so the client can be told) if there
+        is no such session any more. A session with `rejoin` set belongs to
+        a user who was still waiting; see rejoin().
+        """
+        async with self.join_locks.hold(user_id):
+            await websocket.accept()
+            session = self.sessions.get(user_id)
+            if session is None or not session.matches(token):
+                return None
+            if self.draining:
+                # Still held, for the worker taking over
+                await send_away(websocket, system_messages(lang, batch))
+                return session
+            previous = self.active_connections.get(user_id)
+            if previous is not None:
+                await close_quietly(previous)
+            backlog = session.resume()
+            self.active_connections[user_id] = websocket
+            self.users.get(user_id).catalog = system_messages(lang, batch)
+            if keepalive:
+                self.keepalive.watch(user_id)
+            if batch and len(backlog) > 1:
+                backlog = [encode_batch(backlog)]
+            for frame in backlog:
+                await websocket.send_text(frame)
+            if session.dropped:
+                SESSION_FRAMES_DROPPED.inc(session.dropped)
+                session.dropped = 0
+        partner_id = self.chat_pairs.get(user_id)
+        if partner_id is not None:
+            await self.send_system(partner_id, "partner_back")
+        return session
+
+    async def rejoin(self, user_id: str, session: ChatSession):
+        """Put a resumed user who was waiting for a partner back into matchmaking."""
+        campus, preference, code = session.rejoin
+        session.rejoin = None
+        self.waiting_users[user_id] = (campus, preference)
+        if code is not None:
+            matched_user = self.pair_with_code(user_id, code)
+            if matched_user:
+                await self.notify_paired(user_id, via_code=True)
+                await self.notify_paired(matched_user, via_code=True)
+            elif self.cluster:
+                await self.cluster.offer(user_id, code_key(code))
+        else:
+            paired_user = self.pair_users(user_id)
+            if paired_user:
+                await self.notify_paired(user_id)
+                await self.notify_paired(paired_user)
+            elif self.cluster:
+                await self.cluster.offer(user_id, pair_key(campus, preference))
+
+    async def connection_lost(self, user_id: str, websocket: WebSocket, code: int):
+        """Handle a closed socket: hold a paired user's chat for a while unless they left on purpose."""
+        if code not in LEAVE_CODES and await self.suspend(user_id, websocket):
+            return
+        paired_user = self.disconnect(user_id, websocket)
+        if paired_user:
+            await self.notify_partner_left(paired_user)
+
+    async def suspend(self, user_id: str, websocket: WebSocket) -> bool:
+        """Start a paired user's grace period. Returns False if there's no chat to hold on to.
+
+        While draining, users still waiting for a partner are held too, so
+        they keep waiting on the worker taking over.
+        """
+        session = self.sessions.get(user_id)
+        if self.grace_period <= 0 or session is None or self.active_connections.get(user_id) is not websocket:
+            return False
+        partner_id = self.chat_pairs.get(user_id)
+        if partner_id is None:
+            record = self.users.get(user_id)
+            if not self.draining or record.joined is None:
+                return False
+            session.rejoin = (record.campus, record.preference, record.code)
+            self.waiting_users.pop(user_id, None)
+            self.remove_user_from_code_waiting(user_id)
+            if self.cluster:
+                self.cluster.withdraw(user_id)
+        del self.active_connections[user_id]
+        self.keepalive.forget(user_id)
+        session.suspend(self.grace_period, self._session_expired, user_id, session)
+        if partner_id is not None and not self.draining:
+            await self.send_system(partner_id, "partner_reconnecting")
+        return True
+
+    async def drain(self):
+        """Stop starting chats and send every client away, holding their chats and places in line.
+
+        Clients are closed with 1012 (Service Restart) and resume on the
+        worker that takes over; chats with a partner on another worker
+        can't be handed over and are ended.
+        """
+        self.draining = True
+        leaving = [(record.websocket, record.catalog or system_messages())
+                   for record in self.users.records() if record.websocket is not None]
+        # Hold every chat first, so a client slow to close can't use up the others' grace period
+        for user_id, websocket in list(self.active_connections.items()):
+            remote = self.cluster is not None and self.cluster.is_remote_partner(user_id)
+            if remote or not await self.suspend(user_id, websocket):
+                paired_user = self.disconnect(user_id, websocket)
+                if paired_user:
+                    try:
+                        await self.notify_partner_left(paired_user)
+                    except Exception as e:
+                        print(f"Error notifying {paired_user}: {e}")
+        # Closing waits on each client's reply, so it runs in the background
+        for websocket, catalog in leaving:
+            self._tasks.spawn(send_away(websocket, catalog))
+
+    def export_sessions(self) -> List[Dict]:
+        """Held chats and waiting users, for the worker taking over (see restore_sessions())."""
+        now = time.monotonic()
+        entries = []
+        for user_id, session in self.sessions.items():
+            if not session.suspended:
+                continue
+            partner_id = self.chat_pairs.get(user_id)
+            if partner_id is not None and partner_id not in self.sessions:
+                continue  # Partner on another worker
+            joined = self.users.get(user_id).joined
+            entries.append({
+                "user_id": user_id,
+                "token": session.token,
+                "partner": partner_id,
+                "frames": session.held(),
+                "rejoin": session.rejoin,
+                "waited": now - joined if joined is not None else 0,
+            })
+        return entries
+
+    def restore_sessions(self, entries: List[Dict], age: float) -> int:
+        """Hold the chats handed over by the previous worker for what's left of their grace period."""
+        grace = self.grace_period - age
+        if grace <= 0:
+            return 0
+        now = time.monotonic()
+        restored: Dict[str, ChatSession] = {}
+        joined: Dict[str, float] = {}
+        for entry in entries:
+            user_id = entry["user_id"]
+            if user_id in self.users:
+                continue
+            session = ChatSession(user_id, SESSION_BUFFER_SIZE, token=entry["token"])
+            for frame in entry["frames"]:
+                session.hold(frame)
+            if entry["rejoin"]:
+                campus, preference, code = entry["rejoin"]
+                session.rejoin = (campus, preference, code)
+                joined[user_id] = now - entry["waited"]
+            restored[user_id] = session
+        for entry in entries:
+            partner_id = entry["partner"]
+            if partner_id is None or entry["user_id"] not in restored:
+                continue
+            if partner_id in restored:
+                self.chat_pairs.pair(entry["user_id"], partner_id)
+            else:
+                del restored[entry["user_id"]]  # Their partner didn't make it over
+        for user_id, session in restored.items():
+            self.sessions[user_id] = session
+            self.users.get(user_id).joined = joined.get(user_id)
+            session.suspend(grace, self._session_expired, user_id, session)
+        return len(restored)
+
+    def _session_expired(self, user_id: str, session: ChatSession):
+        if self.sessions.get(user_id) is not session:
+            return
+        self._tasks.spawn(self.replace_connection(user_id, None))
+
+    def is_reachable(self, user_id: str) -> bool:
+        """Whether frames for a local user can be delivered now or held for them."""
+        record = self.users.get(user_id)
+        if record is None:
+            return False
+        return record.websocket is not None or (record.session is not None and record.session.suspended)
+
+    async def send_frame(self, user_id: str, frame: str) -> bool:
+        """Send an encoded frame to a local user, or hold it if they are reconnecting."""
+        record = self.users.get(user_id)
+        if record is None:
+            return False
+        if record.websocket is not None:
+            await record.websocket.send_text(frame)
             return True
-        return False
-        
-    def remove_custom_word(self, word: str) -> bool:
-        """Remove a custom word from the filter."""
-        if word in self.custom_badwords:
-            self.custom_badwords.remove(word)
-            # Note: better_profanity doesn't have a direct method to remove words,
-            # so we'd need to reload and re-add our custom list without this word
-            profanity.load_censor_words()
-            profanity.add_censor_words(self.custom_badwords)
+        session = record.session
+        if session is not None and session.suspended:
+            session.hold(frame)
             return True
         return False
-        
-    def get_custom_words(self) -> list:
-        """Get the list of custom bad words."""
-        return self.custom_badwords
 
-# Initialize the message filter
-message_filter = MessageFilter()
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnect a user and clean up their data.
 
-# Connection Manager to handle WebSocket connections
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}  # Connected users
-        self.waiting_users: Dict[str, Tuple[str, str]] = {}  # Waiting users
-        self.chat_pairs: Dict[str, str] = {}  # Paired users
-        self.standby_users: Dict[str, float] = {}  # Users on the AdzuChatCard page with last heartbeat timestamp
-        self.code_waiting_users: Dict[str, str] = {}  # Code -> user_id mapping for code-based matching
-        self.lock = threading.Lock()  # Lock to prevent race conditions
-        self.start_cleanup_thread()  # Start the cleanup thread
-
-    async def connect(self, websocket: WebSocket, user_id: str, campus: str, preference: str):
-        """Accept the websocket connection and add the user to active connections."""
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.waiting_users[user_id] = (campus, preference)  # Add user to waiting list
-
-    def disconnect(self, user_id: str):
-        """Disconnect a user and clean up their data."""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.waiting_users:
-            del self.waiting_users[user_id]
+        With `websocket`, nothing happens unless it is still the user's
+        current connection, so a replaced connection can't tear down the
+        state of the one that replaced it.
+        """
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return None
+        record = self.users.get(user_id)
+        if record is not None:
+            record.joined = None
+            record.catalog = None
+        self.active_connections.pop(user_id, None)
+        self.keepalive.forget(user_id)
+        self.waiting_users.pop(user_id, None)
+        session = self.sessions.pop(user_id, None)
+        if session is not None:
+            session.cancel()
             
         # Clean up from code waiting list
         self.remove_user_from_code_waiting(user_id)
 
         # Clean up chat pair
-        if user_id in self.chat_pairs:
-            paired_user = self.chat_pairs[user_id]
-            del self.chat_pairs[user_id]
-            if paired_user in self.chat_pairs:  # Avoid KeyError
-                del self.chat_pairs[paired_user]
+        paired_user = self.chat_pairs.unpair(user_id)
+        if self.cluster:
+            self.cluster.user_left(user_id, paired_user)
 
-            # Notify the paired user and prevent re-pairing
-            if paired_user in self.active_connections:
-                self.waiting_users.pop(paired_user, None)  # Remove from waiting queue if present
-                return paired_user
+        # A partner who is away has no chat left to come back to
+        if paired_user is not None and paired_user not in self.active_connections and self.is_reachable(paired_user):
+            self.disconnect(paired_user)
+            return None
 
+        # Notify the paired user and prevent re-pairing
+        if paired_user is not None and paired_user in self.active_connections:
+            self.waiting_users.pop(paired_user, None)  # Remove from waiting queue if present
+            return paired_user
         return None
 
     def pair_users(self, user1: str, has_code: bool = False) -> Optional[str]:
@@ -125,230 +408,402 @@ class ConnectionManager:
         if has_code:
             return None
 
-        campus1, preference1 = self.waiting_users[user1]
-
-        with self.lock:
-            for user2, (campus2, preference2) in self.waiting_users.items():
-                if user1 != user2 and campus1 == campus2 and preference1 == preference2:
-                    # Also make sure user2 doesn't have a code match pending
-                    if user2 not in self.chat_pairs and not self._user_has_code(user2):
-                        self.chat_pairs[user1] = user2
-                        self.chat_pairs[user2] = user1
-                        del self.waiting_users[user1]
-                        del self.waiting_users[user2]
-                        return user2
+        # Oldest waiting user in the same (campus, preference) bucket; users
+        # waiting with a code are held out of the buckets entirely
+        user2 = self.waiting_users.pop_match(user1)
+        if user2 and self.chat_pairs.pair(user1, user2):
+            del self.waiting_users[user1]
+            if self.cluster:
+                self.cluster.withdraw(user2)  # Other workers may have been told user2 is waiting
+            return user2
         return None
         
     def _user_has_code(self, user_id: str) -> bool:
         """Check if a user is waiting with a code"""
-        for waiting_user_id in self.code_waiting_users.values():
-            if waiting_user_id == user_id:
-                return True
-        return False
+        record = self.users.get(user_id)
+        return record is not None and record.code is not None
 
     async def send_message(self, sender: str, receiver: str, message: str):
-        """Send a message to the paired user, handle errors."""
+        """Send an already filtered message to the paired user, handle errors."""
         try:
-            if sender in self.chat_pairs and receiver in self.active_connections:
-                filtered_message = message_filter.filter_message(message)
-                await self.active_connections[receiver].send_json({
+            if sender in self.chat_pairs and self.is_reachable(receiver):
+                started = time.perf_counter()
+                await self.send_frame(receiver, encode_frame({
                     "type": "message",
-                    "message": filtered_message
+                    "message": message
+                }))
+                self._send_seconds.observe(time.perf_counter() - started)
+            elif sender in self.chat_pairs and self.cluster and self.cluster.is_remote_partner(sender):
+                # Partner is connected to another worker
+                await self.cluster.deliver(sender, receiver, {
+                    "type": "message",
+                    "message": message
                 })
         except Exception as e:
             print(f"Error sending message: {e}")
-            await self.disconnect(sender)
+            self.disconnect(sender)
 
     async def receive_message(self, websocket: WebSocket, user_id: str):
         """Receive message from user and send to the paired user."""
         data = await websocket.receive_text()
+        self.keepalive.seen(user_id)
+        if data == PONG_FRAME:
+            return
+
+        # Flood protection comes first, so dropped messages cost no parsing or filtering
+        verdict = flood_guard.check(user_id, client_ip(websocket))
+        if verdict != ALLOW:
+            notice = flood_notice(verdict)
+            if notice:
+                await send_json(websocket, {
+                    "type": "system",
+                    "message": notice
+                })
+            return
+
+        try:
+            original_message = decode_chat_message(data)
+        except RejectedMessage as rejected:
+            if rejected.notice:
+                await send_json(websocket, {
+                    "type": "system",
+                    "message": rejected.notice
+                })
+            else:
+                print(f"Received malformed message from {user_id}: {truncate(data)}")
+            return
+
         try:
-            message_data = json.loads(data)
             if user_id in self.chat_pairs:
                 partner_id = self.chat_pairs[user_id]
-                if partner_id in self.active_connections:
-                    original_message = message_data["message"]
-                    
-                    # Check if message contains profanity
-                    if message_filter.contains_profanity(original_message):
+                remote_partner = self.cluster is not None and self.cluster.is_remote_partner(user_id)
+                if self.is_reachable(partner_id) or remote_partner:
+                    # Censor and check for profanity in a single pass, off the event loop if it's long
+                    started = time.perf_counter()
+                    moderation = await moderation_pool.moderate(original_message)
+                    self._moderation_seconds.observe(time.perf_counter() - started)
+                    if self.chat_pairs.get(user_id) != partner_id:
+                        return  # The chat ended meanwhile
+                    if moderation.filtered:
                         # Send a warning to the sender
-                        await self.active_connections[user_id].send_json({
-                            "type": "system",
-                            "message": "⚠️ Your message contained inappropriate content and was filtered."
-                        })
+                        await self.send_system(user_id, "filtered")
                         
                     # Send filtered message to recipient
-                    await self.send_message(user_id, partner_id, original_message)
-        except json.JSONDecodeError:
-            print("Received malformed message:", data)
+                    await self.send_message(user_id, partner_id, moderation.text)
         except Exception as e:
             print(f"Error processing message: {e}")
 
+    async def notify_paired(self, user_id: str, via_code: bool = False):
+        """Tell a user they have been connected to a chat partner."""
+        record = self.users.get(user_id)
+        if record is not None and record.joined is not None:
+            TIME_TO_PAIR_SECONDS.labels(record.campus, "code" if via_code else record.preference).observe(
+                time.monotonic() - record.joined)
+            record.joined = None
+        await self.send_system(user_id, "code_paired" if via_code else "paired")
+
+    async def notify_partner_left(self, user_id: str):
+        """Tell a user their chat partner has disconnected."""
+        await self.send_system(user_id, "partner_left")
+
+    async def send_system(self, user_id: str, event: str):
+        """Send a user the pre-encoded system frames for an event (held for them if they are reconnecting)."""
+        if not self.is_reachable(user_id):
+            return
+        catalog = self.users.get(user_id).catalog or system_messages()
+        for frame in catalog.frames(event):
+            await self.send_frame(user_id, frame)
+
     def add_standby_user(self, user_id: str):
-        """Add a user to the standby pool with current timestamp."""
-        import time
-        with self.lock:
-            self.standby_users[user_id] = time.time()
+        """Add a user to the standby pool, starting their heartbeat timeout."""
+        self.standby_users.touch(user_id)
             
     def remove_standby_user(self, user_id: str):
         """Remove a user from the standby pool."""
-        with self.lock:
-            if user_id in self.standby_users:
-                del self.standby_users[user_id]
+        self.standby_users.discard(user_id)
     
     def update_standby_timestamp(self, user_id: str):
-        """Update the timestamp of a standby user."""
-        import time
-        with self.lock:
-            if user_id in self.standby_users:
-                self.standby_users[user_id] = time.time()
+        """Push back the heartbeat timeout of a standby user."""
+        self.standby_users.refresh(user_id)
     
-    def cleanup_stale_standby_users(self, timeout_seconds=60):
-        """Remove standby users that haven't pinged in the specified timeout period."""
-        import time
-        current_time = time.time()
-        stale_users = []
-        
-        with self.lock:
-            for user_id, last_seen in list(self.standby_users.items()):
-                if current_time - last_seen > timeout_seconds:
-                    stale_users.append(user_id)
-            
-            for user_id in stale_users:
-                del self.standby_users[user_id]
-                
+    def cleanup_stale_standby_users(self):
+        """Remove standby users that haven't pinged within STANDBY_TIMEOUT seconds."""
+        stale_users = self.standby_users.expire()
         if stale_users:
             print(f"Cleaned up {len(stale_users)} stale standby users")
     
-    def start_cleanup_thread(self):
-        """Start a background thread to periodically clean up stale standby users."""
-        import threading
-        import time
-        
-        def cleanup_task():
-            while True:
-                time.sleep(30)  # Check every 30 seconds
-                self.cleanup_stale_standby_users()
-        
-        cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
-        cleanup_thread.start()
+    async def reap_dead_connections(self):
+        """Drop users whose socket has already closed but who were never cleaned up."""
+        dead_users = [
+            (user_id, websocket) for user_id, websocket in self.active_connections.items()
+            if websocket.client_state == WebSocketState.DISCONNECTED
+            or websocket.application_state == WebSocketState.DISCONNECTED
+        ]
+        for user_id, websocket in dead_users:
+            # Only the dead socket: the user may have reconnected while a partner was being notified
+            paired_user = self.disconnect(user_id, websocket)
+            if paired_user:
+                try:
+                    await self.notify_partner_left(paired_user)
+                except Exception as e:
+                    print(f"Error notifying {paired_user}: {e}")
+
+        if dead_users:
+            self._reaped_closed.inc(len(dead_users))
+            print(f"Reaped {len(dead_users)} dead connections")
+
+    async def keep_alive(self):
+        """Drop the connections that stopped answering pings, then ping the rest."""
+        if self.draining:
+            return
+        idle = [(user_id, self.active_connections.get(user_id)) for user_id in self.keepalive.expire()]
+        idle = [(user_id, websocket) for user_id, websocket in idle if websocket is not None]
+        for user_id, websocket in idle:
+            try:
+                # Handled like a dropped connection, so a paired user's chat is held for them to resume
+                await self.connection_lost(user_id, websocket, IDLE_TIMEOUT)
+            except Exception as e:
+                print(f"Error dropping idle connection {user_id}: {e}")
+            self._tasks.spawn(close_quietly(websocket, IDLE_TIMEOUT))
+        if idle:
+            self._reaped_idle.inc(len(idle))
+            print(f"Dropped {len(idle)} idle connections")
+
+        # One send each, all at once, so a stalled socket doesn't hold up the others
+        watched = [self.active_connections.get(user_id) for user_id in self.keepalive]
+        await asyncio.gather(*(self.ping(websocket) for websocket in watched if websocket is not None))
+
+    async def ping(self, websocket: WebSocket):
+        try:
+            await websocket.send_text(PING_FRAME)
+        except Exception:
+            pass  # Gone; its handler cleans up
 
     def get_user_stats(self):
-        """Return the number of active, waiting, and chatting users."""
+        """Return the number of active, waiting, and chatting users, and of chats."""
         return {
             "active_users": len(self.active_connections),
             "waiting_users": len(self.waiting_users),
-            "chatting_users": len(self.chat_pairs),  # Each chat has 2 users
+            "chatting_users": len(self.chat_pairs),  # Users in a chat (one entry per user)
+            "active_chats": self.chat_count(),
             "standby_users": len(self.standby_users)  # Users on the AdzuChatCard page
         }
 
+    def chat_count(self) -> int:
+        """Chats with at least one user on this worker, each counted once."""
+        # chat_pairs has an entry per local user: two for a local chat, one
+        # for a chat with a partner on another worker
+        remote_chats = len(self.cluster.remote_partners) if self.cluster else 0
+        return (len(self.chat_pairs) + remote_chats) // 2
+
     def add_user_with_code(self, user_id: str, code: str) -> Optional[str]:
         """Add a user with a specific code and check if someone is waiting with the same code"""
-        with self.lock:
-            # Check if someone is already waiting with this code
-            if code in self.code_waiting_users:
-                waiting_user = self.code_waiting_users[code]
-                # Make sure the waiting user isn't the same user and is still connected
-                if waiting_user != user_id and waiting_user in self.active_connections:
-                    # Found a match - remove from code waiting
-                    del self.code_waiting_users[code]
-                    return waiting_user
+        # Check if someone is already waiting with this code
+        if code in self.code_waiting_users:
+            waiting_user = self.code_waiting_users[code]
+            # Make sure the waiting user isn't the same user and is still connected
+            if waiting_user != user_id and waiting_user in self.active_connections:
+                # Found a match - remove from code waiting
+                self.remove_user_from_code_waiting(waiting_user)
+                return waiting_user
             
-            # No match yet, add this user to code waiting
-            self.code_waiting_users[code] = user_id
-            return None
+        # No match yet, add this user to code waiting
+        previous_user = self.code_waiting_users.get(code)
+        if previous_user is not None:
+            self.remove_user_from_code_waiting(previous_user)
+        self.remove_user_from_code_waiting(user_id)
+        self.code_waiting_users[code] = user_id
+        self.users.add(user_id).code = code
+        # Keep them out of regular matching while they wait for their code
+        self.waiting_users.hold(user_id)
+        return None
+
+    def pair_with_code(self, user_id: str, code: str) -> Optional[str]:
+        """Pair a user with whoever is waiting with the same code, or leave them waiting for it."""
+        matched_user = self.add_user_with_code(user_id, code)
+        # Code match found - create a chat pair
+        if matched_user and self.chat_pairs.pair(user_id, matched_user):
+            # Remove both users from regular waiting list if they're there
+            self.waiting_users.pop(user_id, None)
+            self.waiting_users.pop(matched_user, None)
+            if self.cluster:
+                self.cluster.withdraw(matched_user)
+            return matched_user
+        return None
 
     def remove_user_from_code_waiting(self, user_id: str):
         """Remove a user from code waiting list when they disconnect or match with someone else"""
-        with self.lock:
-            # Find and remove user from code_waiting_users
-            codes_to_remove = []
-            for code, waiting_user_id in self.code_waiting_users.items():
-                if waiting_user_id == user_id:
-                    codes_to_remove.append(code)
-            
-            for code in codes_to_remove:
-                del self.code_waiting_users[code]
+        record = self.users.get(user_id)
+        if record is None or record.code is None:
+            return
+        code, record.code = record.code, None
+        self.users.release(record)
+        if self.code_waiting_users.get(code) == user_id:
+            del self.code_waiting_users[code]
 
 
 manager = ConnectionManager()
 
+# Routes pairing, pair messages and global chat between worker processes
+cluster = ClusterRouter(create_backplane(BACKPLANE_URL))
+cluster.bind(manager, global_chat_manager)
+
+def collect_user_stats():
+    """Combined pair chat, global chat and standby counts, as served by /user-stats."""
+    # Get regular chat stats
+    regular_stats = manager.get_user_stats()
+    
+    # Get global chat stats
+    global_stats = global_chat_manager.get_stats()
+    
+    # Combine chatting users: regular chat pairs + global chat active users
+    combined_chatting_users = regular_stats["chatting_users"] + global_stats["active_users"]
+    
+    return {
+        "active_users": regular_stats["active_users"],
+        "waiting_users": regular_stats["waiting_users"], 
+        "chatting_users": combined_chatting_users,  # Regular chatting + Global chat users
+        "active_chats": regular_stats["active_chats"],  # Pair chats, not users
+        # Presence sockets, plus older clients still on the HTTP heartbeat
+        "standby_users": presence.user_count() + regular_stats["standby_users"]
+    }
+
+# Stats are served from cached, pre-encoded snapshots rather than rebuilt per request
+user_stats_feed = StatsFeed(collect_user_stats, ttl=STATS_CACHE_TTL)
+global_stats_feed = StatsFeed(global_chat_manager.get_stats, ttl=STATS_CACHE_TTL)
+
+# Users on the AdzuChatCard page, and the live stats pushed to them
+presence = PresenceManager(user_stats_feed)
+
+def refresh_stats():
+    """Pick up changed stats and push them to presence sockets and event streams."""
+    user_stats_feed.refresh()
+    global_stats_feed.refresh()
+    presence.push_stats()
+
+# Queue depths and connection counts, read when /metrics is scraped
+REGISTRY.register(Gauge("adzu_waiting_users", "Users waiting for a partner.",
+                        read=lambda: len(manager.waiting_users)))
+REGISTRY.register(Gauge("adzu_code_waiting_users", "Users waiting for a partner with the same code.",
+                        read=lambda: len(manager.code_waiting_users)))
+REGISTRY.register(Gauge("adzu_connections", "Open WebSocket connections.", ["channel"],
+                        read=lambda: {"pair": len(manager.active_connections),
+                                      "global": len(global_chat_manager.active_connections),
+                                      "presence": len(presence.connections)}))
+REGISTRY.register(Gauge("adzu_moderation_in_flight", "Messages queued for or being moderated in the worker pool.",
+                        read=lambda: moderation_pool.in_flight))
+REGISTRY.register(Gauge("adzu_outbound_queued_frames", "Frames waiting in per-connection send queues.", ["channel"],
+                        read=lambda: {"global": global_chat_manager.broadcaster.queued_frames(),
+                                      "presence": presence.broadcaster.queued_frames()}))
+
+# Housekeeping, run on the event loop once the app starts
+scheduler = PeriodicScheduler()
+scheduler.every(STANDBY_CLEANUP_INTERVAL, manager.cleanup_stale_standby_users, "standby-cleanup")
+scheduler.every(USER_COUNT_BROADCAST_INTERVAL, global_chat_manager.broadcast_user_count, "user-count-broadcast")
+scheduler.every(PRESENCE_STATS_INTERVAL, refresh_stats, "stats-refresh")
+scheduler.every(REAPER_INTERVAL, manager.reap_dead_connections, "reap-pair-connections")
+scheduler.every(REAPER_INTERVAL, flood_guard.prune, "prune-rate-limits")
+scheduler.every(REAPER_INTERVAL, global_chat_manager.reap_dead_connections, "reap-global-connections")
+if CLUSTER_HEARTBEAT_INTERVAL > 0 and not BACKPLANE_URL.startswith("memory://"):
+    scheduler.every(CLUSTER_HEARTBEAT_INTERVAL, cluster.heartbeat, "cluster-heartbeat")
+if manager.keepalive.enabled:
+    scheduler.every(KEEPALIVE_INTERVAL, manager.keep_alive, "keepalive-pair")
+    scheduler.every(KEEPALIVE_INTERVAL, global_chat_manager.keep_alive, "keepalive-global")
+
+def take_over():
+    """Pick up the chats, waiting users and history left by the previous worker, if it handed any over."""
+    state = load_state(HANDOFF_PATH) if HANDOFF_PATH else None
+    if state is None:
+        return
+    restored = manager.restore_sessions(state.get("sessions", []), state["age"])
+    global_chat_manager.restore_history(state.get("history", []), state.get("global"))
+    print(f"Took over {restored} held chats and waiting users from the previous worker ({state['age']:.1f}s ago)")
+
+async def hand_off():
+    """Drain this worker and save what the next one needs to pick up. Only the first call does anything."""
+    if manager.draining:
+        return
+    await manager.drain()
+    global_chat_manager.drain()
+    presence.drain()
+    if not HANDOFF_PATH:
+        return
+    if manager.cluster and not BACKPLANE_URL.startswith("memory://"):
+        # Workers would overwrite each other's state, and a client may come back to any of them
+        print("Not saving handoff state: only a single worker can hand over")
+        return
+    sessions = manager.export_sessions()
+    history = global_chat_manager.export_history()
+    numbering = global_chat_manager.export_stream()
+    if (sessions or history or numbering["seq"]) and save_state(
+            HANDOFF_PATH, {"sessions": sessions, "history": history, "global": numbering}):
+        print(f"Handed off {len(sessions)} held chats and waiting users to {HANDOFF_PATH}")
+
+# Reconnect to a chat after the connection dropped, with the token from the "session" frame.
+# Registered before the pair endpoint, whose /ws/{user_id}/{campus}/{preference} would match it too
+@app.websocket("/ws/resume/{user_id}/{token}")
+async def websocket_resume_endpoint(websocket: WebSocket, user_id: str, token: str, batch: bool = False,
+                                    lang: str = DEFAULT_LOCALE, keepalive: bool = False):
+    session = await manager.resume(websocket, user_id, token, batch=batch, lang=lang, keepalive=keepalive)
+    if session is None:
+        for frame in system_messages(lang, batch).frames("session_expired"):
+            await websocket.send_text(frame)
+        await websocket.close(code=SESSION_ENDED)
+        return
+    if manager.draining:
+        return  # Sent away
+
+    try:
+        if session.rejoin is not None:
+            # Was waiting for a partner when the previous worker handed over
+            await manager.rejoin(user_id, session)
+        while True:
+            await manager.receive_message(websocket, user_id)
+
+    except WebSocketDisconnect as e:
+        await manager.connection_lost(user_id, websocket, e.code)
+
 # WebSocket endpoint that now accepts campus and preference as path parameters
 @app.websocket("/ws/{user_id}/{campus}/{preference}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str, campus: str, preference: str):
-    await manager.connect(websocket, user_id, campus, preference)
+async def websocket_endpoint(websocket: WebSocket, user_id: str, campus: str, preference: str,
+                             batch: bool = False, lang: str = DEFAULT_LOCALE, keepalive: bool = False):
+    if not await manager.connect(websocket, user_id, campus, preference, batch=batch, lang=lang, keepalive=keepalive):
+        return
 
     try:
         paired_user = manager.pair_users(user_id)
         if paired_user:
             # Notify both users that they are paired
-            await manager.active_connections[user_id].send_json({
-                "type": "system",
-                "message": "Connected to a chat partner!"
-            })
-            await manager.active_connections[user_id].send_json({
-                "type": "system",
-                "message": "Chats are anonymous by default — we recommend not sharing personal information. Your identity stays private unless you choose to share it. You’re free to leave a chat anytime."
-            })
-            await manager.active_connections[paired_user].send_json({
-                "type": "system",
-                "message": "Connected to a chat partner!"
-            })
-            await manager.active_connections[paired_user].send_json({
-                "type": "system",
-                "message": "Chats are anonymous by default — we recommend not sharing personal information. Your identity stays private unless you choose to share it. You’re free to leave a chat anytime."
-            })
+            await manager.notify_paired(user_id)
+            await manager.notify_paired(paired_user)
+        elif manager.cluster:
+            # Nobody compatible on this worker; look on the others
+            await manager.cluster.offer(user_id, pair_key(campus, preference))
 
         while True:
             await manager.receive_message(websocket, user_id)
 
-    except WebSocketDisconnect:
-        paired_user = manager.disconnect(user_id)
-        if paired_user and paired_user in manager.active_connections:
-            await manager.active_connections[paired_user].send_json({
-                "type": "system",
-                "message": "Your chat partner has disconnected."
-            })
+    except WebSocketDisconnect as e:
+        await manager.connection_lost(user_id, websocket, e.code)
 
 # New WebSocket endpoint for code-based matching
 @app.websocket("/ws/code/{user_id}/{campus}/{preference}/{code}")
-async def websocket_code_endpoint(websocket: WebSocket, user_id: str, campus: str, preference: str, code: str):
-    await manager.connect(websocket, user_id, campus, preference)
+async def websocket_code_endpoint(websocket: WebSocket, user_id: str, campus: str, preference: str, code: str,
+                                  batch: bool = False, lang: str = DEFAULT_LOCALE, keepalive: bool = False):
+    if not await manager.connect(websocket, user_id, campus, preference, batch=batch, lang=lang, keepalive=keepalive):
+        return
     
     try:
         # First, check for a code match
-        matched_user = manager.add_user_with_code(user_id, code)
+        matched_user = manager.pair_with_code(user_id, code)
         
         if matched_user:
-            # Code match found - create a chat pair
-            manager.chat_pairs[user_id] = matched_user
-            manager.chat_pairs[matched_user] = user_id
-            
-            # Remove both users from regular waiting list if they're there
-            manager.waiting_users.pop(user_id, None)
-            manager.waiting_users.pop(matched_user, None)
-            
-            # Privacy message to send to both users
-            privacy_msg = "Chats are anonymous by default — we recommend not sharing personal information. Your identity stays private unless you choose to share it. You're free to leave a chat anytime."
-            
             # Notify both users that they are paired via code
-            await manager.active_connections[user_id].send_json({
-                "type": "system",
-                "message": "Connected to your chat partner via matching code!"
-            })
-            await manager.active_connections[user_id].send_json({
-                "type": "system",
-                "message": privacy_msg
-            })
-            
-            await manager.active_connections[matched_user].send_json({
-                "type": "system",
-                "message": "Connected to your chat partner via matching code!"
-            })
-            await manager.active_connections[matched_user].send_json({
-                "type": "system",
-                "message": privacy_msg
-            })
+            await manager.notify_paired(user_id, via_code=True)
+            await manager.notify_paired(matched_user, via_code=True)
+        elif manager.cluster:
+            # The other person may have joined through another worker
+            await manager.cluster.offer(user_id, code_key(code))
         # else:
         #     # No code match yet, notify the user that we're waiting
         #     await manager.active_connections[user_id].send_json({
@@ -363,38 +818,62 @@ async def websocket_code_endpoint(websocket: WebSocket, user_id: str, campus: st
         while True:
             await manager.receive_message(websocket, user_id)
 
-    except WebSocketDisconnect:
+    except WebSocketDisconnect as e:
         # Handle disconnection
-        paired_user = manager.disconnect(user_id)
-        if paired_user and paired_user in manager.active_connections:
-            await manager.active_connections[paired_user].send_json({
-                "type": "system",
-                "message": "Your chat partner has disconnected."
-            })
+        await manager.connection_lost(user_id, websocket, e.code)
+
+def stats_response(feed: StatsFeed, request: Request) -> Response:
+    """Serve a stats snapshot, answering 304 when the client already has it."""
+    snapshot = feed.snapshot()
+    headers = {"ETag": snapshot.etag, "Cache-Control": f"public, max-age={STATS_CACHE_TTL}"}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
+
+def stats_stream(feed: StatsFeed) -> StreamingResponse:
+    """Stream a stats snapshot whenever it changes, as server-sent events."""
+    async def events():
+        snapshot = feed.snapshot()
+        yield f"data: {snapshot.body}\n\n"
+        while True:
+            update = await feed.wait_for_change(snapshot.version, timeout=STATS_STREAM_KEEPALIVE)
+            if update is None:
+                yield ": keepalive\n\n"  # Keeps proxies from closing an idle stream
+                continue
+            snapshot = update
+            yield f"data: {snapshot.body}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Endpoint to fetch user stats (active, waiting, chatting users)
 @app.get("/user-stats")
-async def get_user_stats():
-    # Get regular chat stats
-    regular_stats = manager.get_user_stats()
-    
-    # Get global chat stats
-    global_stats = global_chat_manager.get_stats()
-    
-    # Combine chatting users: regular chat pairs + global chat active users
-    combined_chatting_users = regular_stats["chatting_users"] + global_stats["active_users"]
-    
-    return {
-        "active_users": regular_stats["active_users"],
-        "waiting_users": regular_stats["waiting_users"], 
-        "chatting_users": combined_chatting_users,  # Regular chatting + Global chat users
-        "standby_users": regular_stats["standby_users"]
-    }
+async def get_user_stats(request: Request):
+    return stats_response(user_stats_feed, request)
+
+# Same stats, pushed as they change
+@app.get("/user-stats/stream")
+async def stream_user_stats():
+    return stats_stream(user_stats_feed)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format metrics for this worker."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/ping")
 async def ping():
     return {"status": "ok"}
 
+# Drain this worker ahead of a deploy: clients are sent to reconnect and their chats saved for the next process
+@app.post("/admin/drain")
+async def admin_drain(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not secrets.compare_digest(token, ADMIN_TOKEN):
+        return Response(status_code=403)
+    await hand_off()
+    return {"draining": True}
+
 # Administrative endpoints for managing profanity filter
 @app.get("/filter/words")
 async def get_filter_words():
@@ -403,16 +882,41 @@ async def get_filter_words():
 
 @app.post("/filter/words/{word}")
 async def add_filter_word(word: str):
-    """Add a word to the profanity filter."""
+    """Add a word to the profanity filter. The filter is rebuilt in the background."""
     success = message_filter.add_custom_word(word)
-    return {"success": success, "message": f"Word '{word}' added to filter" if success else f"Word '{word}' already in filter"}
+    return {
+        "success": success,
+        "message": f"Word '{word}' added to filter" if success else f"Word '{word}' already in filter",
+        "version": message_filter.version
+    }
 
 @app.delete("/filter/words/{word}")
 async def remove_filter_word(word: str):
-    """Remove a word from the profanity filter."""
+    """Remove a word from the profanity filter. The filter is rebuilt in the background."""
     success = message_filter.remove_custom_word(word)
-    return {"success": success, "message": f"Word '{word}' removed from filter" if success else f"Word '{word}' not in filter"}
+    return {
+        "success": success,
+        "message": f"Word '{word}' removed from filter" if success else f"Word '{word}' not in filter",
+        "version": message_filter.version
+    }
+
+# Presence WebSocket endpoint, replacing the standby heartbeat and /user-stats polling
+@app.websocket("/ws/presence/{user_id}")
+async def presence_websocket(websocket: WebSocket, user_id: str):
+    """Keeps a user counted as on the AdzuChatCard page while open, and pushes them live stats."""
+    connection_id = await presence.connect(websocket, user_id)
+    if connection_id is None:
+        return  # Sent away
+    try:
+        while True:
+            # Nothing is expected from the client; this just notices when it goes away
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        presence.disconnect(connection_id)
 
+# Standby HTTP endpoints, kept for clients that predate the presence socket
 @app.post("/standby/{user_id}")
 async def register_standby_user(user_id: str):
     """Register a user as being on the AdzuChatCard page."""
@@ -433,23 +937,45 @@ async def standby_heartbeat(user_id: str):
 
 # Global Chat WebSocket endpoint
 @app.websocket("/ws/global/{user_id}")
-async def global_chat_websocket(websocket: WebSocket, user_id: str):
-    """WebSocket endpoint for global chat functionality."""
-    await global_chat_manager.connect(websocket, user_id)
+async def global_chat_websocket(websocket: WebSocket, user_id: str, batch: bool = False, keepalive: bool = False,
+                                since: Optional[int] = None, stream: Optional[str] = None):
+    """WebSocket endpoint for global chat functionality.
+
+    Clients that handle "batch" frames connect with ?batch=1, and those that
+    answer pings with ?keepalive=1. Clients reconnecting pass ?since=<seq>&stream=<stream>
+    of the last message they got, to be sent only the ones they missed.
+    """
+    if not await global_chat_manager.connect(websocket, user_id, batch=batch, keepalive=keepalive,
+                                             since=since, stream=stream):
+        return  # Sent away
     
     try:
         while True:
             # Receive message from user
             raw_message = await websocket.receive_text()
-            await global_chat_manager.process_message(user_id, raw_message)
+            global_chat_manager.keepalive.seen(user_id)
+            if raw_message == PONG_FRAME:
+                continue
+            if global_chat_manager.allow_message(user_id, client_ip(websocket)):
+                await global_chat_manager.process_message(user_id, raw_message)
             
     except WebSocketDisconnect:
-        global_chat_manager.disconnect(user_id)
-        # Broadcast updated user count
-        await global_chat_manager.broadcast_user_count()
+        global_chat_manager.disconnect(user_id, websocket)  # Sends the updated user count
 
 # Global Chat stats endpoint
 @app.get("/global-chat-stats")
-async def get_global_chat_stats():
+async def get_global_chat_stats(request: Request):
     """Get global chat statistics."""
-    return global_chat_manager.get_stats()
+    return stats_response(global_stats_feed, request)
+
+# Older global chat messages, a page at a time, for "load older messages"
+@app.get("/global-chat/history")
+async def get_global_chat_history(before: Optional[int] = None, limit: int = GLOBAL_HISTORY_PAGE_SIZE):
+    """Messages older than `before`, the cursor from the history frame or the previous page."""
+    limit = max(1, min(limit, GLOBAL_HISTORY_PAGE_SIZE))
+    return Response(global_chat_manager.history_page(before, limit), media_type="application/json")
+
+@app.get("/global-chat-stats/stream")
+async def stream_global_chat_stats():
+    """Global chat statistics, pushed as they change."""
+    return stats_stream(global_stats_feed)
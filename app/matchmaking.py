@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+import sys
+
+try:
+    from .registry import UserIndex, UserRecord
+except ImportError:
+    from registry import UserIndex, UserRecord
+
+# (campus, preference) bucket that users are matched within
+MatchKey = Tuple[str, str]
+
+
+class MatchmakingQueue:
+    """Waiting users indexed by (campus, preference) with a FIFO queue per bucket.
+
+    Behaves like the old ``Dict[str, Tuple[str, str]]`` of waiting users so the
+    rest of ConnectionManager can keep using ``in``, ``len``, ``pop`` and item
+    assignment, but finding a partner only looks at the head of one bucket
+    instead of scanning every waiting user. Each user's bucket is kept on
+    their record in the UserIndex, with campus and preference interned.
+    """
+
+    def __init__(self, index: Optional[UserIndex] = None):
+        self._index = index if index is not None else UserIndex()
+        self._count = 0  # Records with `waiting` set
+        self._queues: Dict[MatchKey, "OrderedDict[str, None]"] = {}  # bucket -> users in arrival order
+
+    def __setitem__(self, user_id: str, key: MatchKey):
+        record = self._index.add(user_id)
+        if record.waiting:
+            self._unqueue(record)
+        else:
+            record.waiting = True
+            self._count += 1
+        record.campus = sys.intern(key[0])
+        record.preference = sys.intern(key[1])
+        self._queues.setdefault((record.campus, record.preference), OrderedDict())[user_id] = None
+
+    def __getitem__(self, user_id: str) -> MatchKey:
+        record = self._waiting(user_id)
+        if record is None:
+            raise KeyError(user_id)
+        return record.campus, record.preference
+
+    def __delitem__(self, user_id: str):
+        if self.pop(user_id) is None:
+            raise KeyError(user_id)
+
+    def __contains__(self, user_id: object) -> bool:
+        return self._waiting(user_id) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        return (user_id for user_id, _ in self.items())
+
+    def items(self):
+        return [(record.user_id, (record.campus, record.preference))
+                for record in self._index.records() if record.waiting]
+
+    def pop(self, user_id: str, default=None):
+        """Remove a user from the waiting list, returning their (campus, preference)."""
+        record = self._waiting(user_id)
+        if record is None:
+            return default
+        self._unqueue(record)
+        self._forget(record)
+        return record.campus, record.preference
+
+    def hold(self, user_id: str):
+        """Keep a user counted as waiting but out of regular matching (e.g. code matching)."""
+        record = self._waiting(user_id)
+        if record is not None:
+            self._unqueue(record)
+
+    def oldest(self, key: MatchKey) -> Optional[str]:
+        """Return the user who has waited longest in a bucket, without removing them."""
+        queue = self._queues.get(key)
+        if not queue:
+            return None
+        return next(iter(queue))
+
+    def pop_match(self, user_id: str) -> Optional[str]:
+        """Remove and return the oldest matchable user in the same bucket as user_id."""
+        record = self._waiting(user_id)
+        if record is None:
+            return None
+        key = (record.campus, record.preference)
+        queue = self._queues.get(key)
+        if not queue:
+            return None
+
+        # user_id itself can only be in front of a match if it is the oldest
+        # entry, so at most the first two entries are ever looked at
+        for candidate in queue:
+            if candidate != user_id:
+                del queue[candidate]
+                if not queue:
+                    del self._queues[key]
+                self._forget(self._index.get(candidate))
+                return candidate
+        return None
+
+    def _waiting(self, user_id: str) -> Optional[UserRecord]:
+        record = self._index.get(user_id)
+        return record if record is not None and record.waiting else None
+
+    def _forget(self, record: UserRecord):
+        record.waiting = False
+        self._count -= 1
+        self._index.release(record)
+
+    def _unqueue(self, record: UserRecord):
+        key = (record.campus, record.preference)
+        queue = self._queues.get(key)
+        if queue is not None and record.user_id in queue:
+            del queue[record.user_id]
+            if not queue:
+                del self._queues[key]
@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+
+# Seconds; suits everything from a dict lookup to a slow WebSocket send
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Seconds a user waits for a partner
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 15, 30, 60, 120, 300, 600)
+
+MAX_LABEL_SETS = 100  # Beyond this, new label values are counted as "other"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values: str):
+        """The child for a set of label values. Bind it once and keep it on the hot path."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            if len(self._children) >= MAX_LABEL_SETS:
+                # Label values can come from clients; don't let them grow without bound
+                key = ("other",) * len(key)
+                child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """A new child holding the value for one set of label values."""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> Iterable[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """A count that only goes up (sent frames, dropped frames, broken sockets, ...)."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down. With `read`, it is taken from the app when scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (),
+                 read: Optional[Callable[[], object]] = None):
+        super().__init__(name, description, labelnames)
+        # Returns a number, or {label values: number} for a labelled gauge
+        self.read = read
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def render(self) -> List[str]:
+        if self.read is not None:
+            current = self.read()
+            if self.labelnames:
+                for key, value in current.items():
+                    self.labels(*(key if isinstance(key, tuple) else (key,))).set(value)
+            else:
+                self.set(current)
+        return super().render()
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies, waits) in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, description, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _render_child(self, key, child) -> Iterable[str]:
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """The metrics served on /metrics, in Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Timings
+CONNECTION_ACCEPT_SECONDS = REGISTRY.register(Histogram(
+    "adzu_connection_accept_seconds", "Time to accept a WebSocket connection.", ["endpoint"]))
+TIME_TO_PAIR_SECONDS = REGISTRY.register(Histogram(
+    "adzu_time_to_pair_seconds", "Time from connecting to being paired.", ["campus", "preference"],
+    buckets=WAIT_BUCKETS))
+MODERATION_SECONDS = REGISTRY.register(Histogram(
+    "adzu_moderation_seconds", "Time spent filtering one message.", ["channel"]))
+SEND_SECONDS = REGISTRY.register(Histogram(
+    "adzu_send_seconds", "Time to write one frame to a WebSocket.", ["channel"]))
+FANOUT_SECONDS = REGISTRY.register(Histogram(
+    "adzu_broadcast_fanout_seconds", "Time to queue one frame for every connection.", ["channel"]))
+
+# Counts
+FRAMES_DROPPED = REGISTRY.register(Counter(
+    "adzu_frames_dropped_total", "Frames dropped or replaced because a send queue was full.", ["channel"]))
+BROKEN_SOCKETS = REGISTRY.register(Counter(
+    "adzu_broken_sockets_total", "Connections dropped because a send failed.", ["channel"]))
+CONNECTIONS_REAPED = REGISTRY.register(Counter(
+    "adzu_connections_reaped_total",
+    "Connections dropped by the reapers: idle past the keepalive timeout, or already closed.", ["channel", "reason"]))
+MESSAGES_RATE_LIMITED = REGISTRY.register(Counter(
+    "adzu_messages_rate_limited_total", "Incoming messages dropped by flood protection.", ["verdict"]))
+MESSAGES_REJECTED = REGISTRY.register(Counter(
+    "adzu_messages_rejected_total", "Incoming messages dropped as oversized or malformed.", ["reason"]))
+GLOBAL_REPLAYS = REGISTRY.register(Counter(
+    "adzu_global_replays_total",
+    "What global chat joins were sent: recent history (join), only what they missed (resync), nothing "
+    "missed (current), or recent history to replace theirs (reset).", ["kind"]))
+SESSION_FRAMES_DROPPED = REGISTRY.register(Counter(
+    "adzu_session_frames_dropped_total", "Frames dropped because a reconnecting user's buffer was full."))
@@ -0,0 +1,435 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+from better_profanity import profanity
+from better_profanity.constants import ALLOWED_CHARACTERS
+from better_profanity.utils import get_complete_path_of_file, read_wordlist
+
+try:
+    from .config import (FILTER_SNAPSHOT_PATH, MODERATION_CACHE_MAX_LENGTH, MODERATION_CACHE_SIZE, MODERATION_EXECUTOR,
+                         MODERATION_INLINE_CHARS, MODERATION_MAX_IN_FLIGHT, MODERATION_WORKERS)
+except ImportError:
+    from config import (FILTER_SNAPSHOT_PATH, MODERATION_CACHE_MAX_LENGTH, MODERATION_CACHE_SIZE, MODERATION_EXECUTOR,
+                        MODERATION_INLINE_CHARS, MODERATION_MAX_IN_FLIGHT, MODERATION_WORKERS)
+
+CENSOR_REPLACEMENT = "****"  # Same replacement better_profanity uses
+END_OF_WORD = ""  # Trie key marking a complete word; never a character of the text
+SNAPSHOT_FORMAT = 1
+DEFAULT_CUSTOM_WORDS = ("additional_slur1", "additional_slur2")
+EXECUTORS = ("process", "thread", "inline")
+# A word, as better_profanity splits text: a run of allowed characters. The full set has
+# thousands of letters and is slow to match against, so ASCII text uses just the ASCII ones
+WORD = re.compile("[" + "".join(re.escape(char) for char in sorted(ALLOWED_CHARACTERS)) + "]+")
+ASCII_WORD = re.compile("[" + "".join(re.escape(char) for char in sorted(ALLOWED_CHARACTERS) if char.isascii()) + "]+")
+
+
+class ModerationResult(NamedTuple):
+    text: str  # Censored text
+    filtered: bool  # Whether anything was censored
+
+
+def load_default_wordlist() -> List[str]:
+    """Read better_profanity's bundled wordlist."""
+    return list(read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+
+
+def wordlist_digest(words: Iterable[str]) -> str:
+    """Fingerprint of a wordlist, used to tell whether a saved snapshot is still current."""
+    return hashlib.sha1("\n".join(sorted(words)).encode("utf-8")).hexdigest()
+
+
+class CompiledFilter:
+    """A wordlist compiled into a trie, censoring text in a single pass.
+
+    Censors exactly what better_profanity's censor() does, quirks included:
+    text is split into words (runs of allowed characters); each word that
+    is followed by a separator is first tried together with up to as many
+    next words as the longest listed phrase has separators, run together
+    or with the separators between them, then on its own. Matching is case
+    insensitive with the same character substitutions (``@`` for ``a``,
+    ``$`` for ``s``, ...). Each candidate is one walk down the trie instead
+    of a comparison with every listed word.
+    """
+
+    def __init__(self, words: Iterable[str], char_map: Dict[str, Tuple[str, ...]] = None,
+                 cache_size: int = MODERATION_CACHE_SIZE, trie: Optional[Dict] = None):
+        char_map = profanity.CHARS_MAPPING if char_map is None else char_map
+        self.words = frozenset(word.lower() for word in words if word and word.strip())
+        if trie is None:
+            trie = {}
+            for word in self.words:
+                node = trie
+                for char in word:
+                    node = node.setdefault(char, {})
+                node[END_OF_WORD] = True
+        self._trie: Dict = trie
+        # Most next words a word is tried with: the most separators in a listed phrase
+        self._max_next_words = max([1] + [sum(char not in ALLOWED_CHARACTERS for char in word) for word in self.words])
+
+        # Character seen in text -> characters it can stand for in a listed word
+        self._sources: Dict[str, Tuple[str, ...]] = {}
+        reverse: Dict[str, Set[str]] = {}
+        for base, variants in char_map.items():
+            for variant in variants:
+                reverse.setdefault(variant, {variant}).add(base)
+        for variant, bases in reverse.items():
+            self._sources[variant] = tuple(bases)
+
+        self._cache_max_length = MODERATION_CACHE_MAX_LENGTH
+        self._cached = lru_cache(maxsize=cache_size)(self._moderate)
+
+    def moderate(self, text: str) -> ModerationResult:
+        """Return the censored text and whether anything was censored."""
+        if len(text) > self._cache_max_length:
+            return self._moderate(text)
+        return self._cached(text)
+
+    def _moderate(self, text: str) -> ModerationResult:
+        length = len(text)
+        spans = [match.span() for match in (ASCII_WORD if text.isascii() else WORD).finditer(text)]
+        # better_profanity leaves text alone unless a word starts before its last character
+        if not spans or spans[0][0] >= length - 1:
+            return ModerationResult(text, False)
+
+        pieces = []
+        last = 0
+        word = 0
+        while word < len(spans):
+            start, end = spans[word]
+            nodes = self._walk([self._trie], text[start:end].lower())
+            matched = word if self._listed(nodes) else -1
+            if nodes and end < length:
+                # Followed by a separator: the shortest phrase with the next words wins over the word alone
+                joined = spaced = nodes
+                for following in range(word + 1, min(len(spans), word + 1 + self._max_next_words)):
+                    next_start, next_end = spans[following]
+                    if next_start >= length - 1:
+                        break  # better_profanity never looks at a word starting on the last character
+                    joined = self._walk(joined, text[next_start:next_end].lower())
+                    spaced = self._walk(spaced, text[spans[following - 1][1]:next_end].lower())
+                    if self._listed(joined) or self._listed(spaced):
+                        matched = following
+                        break
+                    if not joined and not spaced:
+                        break
+            if matched < 0:
+                word += 1
+                continue
+            pieces.append(text[last:start])
+            pieces.append(CENSOR_REPLACEMENT)
+            last = spans[matched][1]
+            word = matched + 1
+
+        if not pieces:
+            return ModerationResult(text, False)
+        pieces.append(text[last:])
+        censored = "".join(pieces)
+        return ModerationResult(censored, censored != text)
+
+    def _walk(self, nodes: List[Dict], text: str) -> List[Dict]:
+        """The trie nodes reached from `nodes` by reading `text`, substitutions included."""
+        sources = self._sources
+        for char in text:
+            bases = sources.get(char)
+            if bases is None:
+                nodes = [child for node in nodes if (child := node.get(char)) is not None]
+            else:
+                nodes = [child for node in nodes for base in bases if (child := node.get(base)) is not None]
+            if not nodes:
+                break
+        return nodes
+
+    @staticmethod
+    def _listed(nodes: List[Dict]) -> bool:
+        return any(END_OF_WORD in node for node in nodes)
+
+
+class FilterSnapshot:
+    """Immutable, versioned filter state: the custom words and the filter compiled from them.
+
+    Snapshots are never modified; an edit builds a new one and MessageFilter
+    swaps it in with a single attribute assignment, so messages being
+    filtered at the time keep using the old one.
+    """
+
+    __slots__ = ("version", "custom_words", "base_digest", "compiled")
+
+    def __init__(self, version: int, custom_words: Tuple[str, ...], base_digest: str, compiled: CompiledFilter):
+        self.version = version
+        self.custom_words = custom_words
+        self.base_digest = base_digest
+        self.compiled = compiled
+
+    @classmethod
+    def build(cls, version: int, custom_words: Iterable[str], base_words: List[str]) -> "FilterSnapshot":
+        """Compile a snapshot from the base wordlist plus custom words."""
+        custom_words = tuple(custom_words)
+        compiled = CompiledFilter(list(base_words) + list(custom_words))
+        return cls(version, custom_words, wordlist_digest(base_words), compiled)
+
+    def save(self, path: str):
+        """Write the snapshot, compiled trie included, to a file (atomically)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "format": SNAPSHOT_FORMAT,
+            "version": self.version,
+            "custom_words": list(self.custom_words),
+            "base_digest": self.base_digest,
+            "words": sorted(self.compiled.words),
+            "trie": self.compiled._trie,
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+            json.dump(data, snapshot_file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["FilterSnapshot"]:
+        """Load a saved snapshot without recompiling it. Returns None if there is no usable file."""
+        try:
+            with open(path, encoding="utf-8") as snapshot_file:
+                data = json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable filter snapshot {path}: {e}")
+            return None
+        if data.get("format") != SNAPSHOT_FORMAT:
+            return None
+        compiled = CompiledFilter(data["words"], trie=data["trie"])
+        return cls(data["version"], tuple(data["custom_words"]), data["base_digest"], compiled)
+
+
+# Message Filter class to handle content moderation
+class MessageFilter:
+    """The live profanity filter, loaded from its compiled snapshot by load().
+
+    Nothing is read or compiled when the module is imported; the app loads
+    the filter while starting up, and anything that uses it earlier
+    (scripts, tests) loads it on first use.
+    """
+
+    def __init__(self, snapshot_path: str = FILTER_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
+        self.base_words: List[str] = []
+        self._snapshot: Optional[FilterSnapshot] = None
+        # Latest edits; the live snapshot catches up to these in the background
+        self.custom_badwords: List[str] = []
+        self.version = 0
+        self._rebuild_task: Optional[asyncio.Task] = None
+
+    def load(self):
+        """Load the filter from its saved snapshot, compiling one if there is none. Only the first call does anything."""
+        if self._snapshot is not None:
+            return
+        self.base_words = load_default_wordlist()
+        base_digest = wordlist_digest(self.base_words)
+
+        snapshot = FilterSnapshot.load(self.snapshot_path) if self.snapshot_path else None
+        if snapshot is not None and snapshot.base_digest != base_digest:
+            # better_profanity's wordlist changed since it was saved; keep the admin edits, recompile
+            snapshot = FilterSnapshot.build(snapshot.version, snapshot.custom_words, self.base_words)
+            self._save(snapshot)
+        if snapshot is None:
+            # Add custom words to the filter if needed
+            snapshot = FilterSnapshot.build(1, DEFAULT_CUSTOM_WORDS, self.base_words)
+            self._save(snapshot)
+        self._snapshot = snapshot
+        self.custom_badwords = list(snapshot.custom_words)
+        self.version = snapshot.version
+
+    @property
+    def snapshot(self) -> FilterSnapshot:
+        if self._snapshot is None:
+            self.load()
+        return self._snapshot
+
+    def moderate(self, message: str) -> ModerationResult:
+        """Censor a message and report whether it contained profanity, in one pass."""
+        return self.snapshot.compiled.moderate(message)
+
+    def filter_message(self, message: str) -> str:
+        """Filter inappropriate content from messages."""
+        # Replace profanity with asterisks
+        return self.snapshot.compiled.moderate(message).text
+
+    def contains_profanity(self, message: str) -> bool:
+        """Check if a message contains profanity."""
+        return self.snapshot.compiled.moderate(message).filtered
+
+    def add_custom_word(self, word: str) -> bool:
+        """Add a custom word to the filter. Takes effect once the new snapshot is built."""
+        self.load()
+        if word not in self.custom_badwords:
+            self.custom_badwords.append(word)
+            self._schedule_rebuild()
+            return True
+        return False
+
+    def remove_custom_word(self, word: str) -> bool:
+        """Remove a custom word from the filter. Takes effect once the new snapshot is built."""
+        self.load()
+        if word in self.custom_badwords:
+            self.custom_badwords.remove(word)
+            self._schedule_rebuild()
+            return True
+        return False
+
+    def _schedule_rebuild(self):
+        """Build a snapshot for the latest edits off the event loop, then swap it in."""
+        self.version += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, startup): just build it here
+            self._install(self._build(self.version, tuple(self.custom_badwords)))
+            return
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = loop.create_task(self._rebuild())
+
+    async def _rebuild(self):
+        # Edits made while a build is running are picked up by the next round
+        while self.snapshot.version < self.version:
+            version, words = self.version, tuple(self.custom_badwords)
+            try:
+                snapshot = await asyncio.to_thread(self._build, version, words)
+            except Exception as e:
+                print(f"Error rebuilding profanity filter: {e}")
+                return
+            self._install(snapshot)
+
+    def _build(self, version: int, custom_words: Tuple[str, ...]) -> FilterSnapshot:
+        snapshot = FilterSnapshot.build(version, custom_words, self.base_words)
+        self._save(snapshot)
+        return snapshot
+
+    def _save(self, snapshot: FilterSnapshot):
+        if not self.snapshot_path:
+            return
+        try:
+            snapshot.save(self.snapshot_path)
+        except OSError as e:
+            print(f"Error saving filter snapshot to {self.snapshot_path}: {e}")
+
+    def _install(self, snapshot: FilterSnapshot):
+        if snapshot.version > self.snapshot.version:
+            self._snapshot = snapshot
+
+    async def wait_for_rebuild(self):
+        """Wait until the live snapshot reflects every edit made so far."""
+        if self._rebuild_task is not None:
+            await asyncio.shield(self._rebuild_task)
+
+    def get_custom_words(self) -> list:
+        """Get the list of custom bad words."""
+        self.load()
+        return self.custom_badwords
+
+
+# The message filter; loaded when the app starts (see main.lifespan)
+message_filter = MessageFilter()
+
+
+# The filter compiled in a moderation worker process, with the custom words it was built for
+_worker_filter: Optional[FilterSnapshot] = None
+
+
+def _load_worker_filter(version: int, custom_words: Tuple[str, ...]):
+    global _worker_filter
+    _worker_filter = FilterSnapshot.build(version, custom_words, load_default_wordlist())
+
+
+def _moderate_in_worker(text: str, version: int, custom_words: Tuple[str, ...]) -> ModerationResult:
+    """Moderate in a worker process, recompiling first if an admin edit changed the filter."""
+    if _worker_filter is None or _worker_filter.version != version:
+        _load_worker_filter(version, custom_words)
+    return _worker_filter.compiled.moderate(text)
+
+
+class ModerationPool:
+    """Moderates messages off the event loop, for the WebSocket handlers to await.
+
+    Messages up to `inline_chars` long are moderated in place: they take
+    microseconds, less than handing them to a worker would. Longer ones go
+    to a pool of worker processes, each with its own compiled copy of the
+    live filter (rebuilt when the custom words change), or to a thread pool.
+    At most `max_in_flight` are queued or running at once; handlers beyond
+    that wait their turn. Each socket's handler awaits one message before
+    reading the next, so a sender's messages still come out in order.
+    """
+
+    def __init__(self, message_filter: MessageFilter, kind: str = MODERATION_EXECUTOR,
+                 workers: int = MODERATION_WORKERS, max_in_flight: int = MODERATION_MAX_IN_FLIGHT,
+                 inline_chars: int = MODERATION_INLINE_CHARS):
+        if kind not in EXECUTORS:
+            raise ValueError(f"Unknown moderation executor: {kind}")
+        self.message_filter = message_filter
+        self.kind = kind if workers > 0 else "inline"
+        self.workers = workers
+        self.inline_chars = inline_chars
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0  # Messages queued for or running in the pool
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[Executor] = None
+
+    def start(self):
+        """Start the workers (with the app; until then everything is moderated in place)."""
+        if self.kind == "inline" or self._executor is not None:
+            return
+        snapshot = self.message_filter.snapshot
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        if self.kind == "thread":
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="moderation")
+            return
+        # Spawned rather than forked: the app process has an event loop and threads running
+        self._executor = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_worker_filter, initargs=(snapshot.version, snapshot.custom_words))
+        for _ in range(self.workers):
+            self._executor.submit(_moderate_in_worker, "", snapshot.version, snapshot.custom_words)  # Warm up
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def moderate(self, text: str) -> ModerationResult:
+        """Censor a message and report whether it contained profanity."""
+        if self._executor is None or len(text) <= self.inline_chars:
+            return self.message_filter.moderate(text)
+        self.in_flight += 1
+        try:
+            async with self._slots:
+                return await self._run(text)
+        finally:
+            self.in_flight -= 1
+
+    async def _run(self, text: str) -> ModerationResult:
+        loop = asyncio.get_running_loop()
+        snapshot = self.message_filter.snapshot
+        executor = self._executor
+        try:
+            if self.kind == "thread":
+                return await loop.run_in_executor(executor, snapshot.compiled.moderate, text)
+            return await loop.run_in_executor(
+                executor, _moderate_in_worker, text, snapshot.version, snapshot.custom_words)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool, unless a message
+            # that was in flight alongside this one already did, and moderate this one here
+            if self._executor is executor:
+                print("Moderation worker pool broke; restarting it")
+                self.stop()
+                self.start()
+            return snapshot.compiled.moderate(text)
+
+
+# Long messages are moderated off the event loop; started with the app (see main.lifespan)
+moderation_pool = ModerationPool(message_filter)
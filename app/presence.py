@@ -0,0 +1,104 @@
+from fastapi import WebSocket
+from typing import Dict, Optional
+import time
+import uuid
+
+try:
+    from .background import BackgroundTasks, send_away
+    from .broadcast import COALESCE, Broadcaster
+    from .config import GLOBAL_SEND_QUEUE_SIZE
+    from .metrics import CONNECTION_ACCEPT_SECONDS
+    from .stats import StatsFeed
+    from .system_messages import system_messages
+except ImportError:
+    from background import BackgroundTasks, send_away
+    from broadcast import COALESCE, Broadcaster
+    from config import GLOBAL_SEND_QUEUE_SIZE
+    from metrics import CONNECTION_ACCEPT_SECONDS
+    from stats import StatsFeed
+    from system_messages import system_messages
+
+
+class PresenceManager:
+    """Users on the AdzuChatCard page, tracked by an open presence WebSocket.
+
+    The socket being open is the presence: there are no heartbeats, and a
+    user drops out as soon as their socket closes. The same sockets carry
+    live user stats, pushed only when they change, in place of clients
+    polling ``/user-stats``.
+    """
+
+    def __init__(self, stats_feed: StatsFeed):
+        self.stats_feed = stats_feed  # Stats pushed to clients
+        self.connections: Dict[str, str] = {}  # connection id -> user_id
+        self.users: Dict[str, int] = {}  # user_id -> open presence sockets (one per tab)
+        # A client only ever needs the latest stats, so pending ones are replaced rather than queued
+        self.broadcaster = Broadcaster(
+            maxsize=GLOBAL_SEND_QUEUE_SIZE,
+            policy=COALESCE,
+            on_broken=self._connection_broken,
+            channel="presence",
+        )
+        self._pushed_version = 0
+        self._tasks = BackgroundTasks()  # Sockets being sent away by drain()
+        self.draining = False  # Set by drain(): new sockets are turned away
+        self._accept_seconds = CONNECTION_ACCEPT_SECONDS.labels("presence")
+
+    async def connect(self, websocket: WebSocket, user_id: str) -> Optional[str]:
+        """Accept a presence socket and send it the current stats.
+
+        Returns its connection id, or None if the worker is draining and the
+        socket was sent away instead.
+        """
+        started = time.perf_counter()
+        await websocket.accept()
+        self._accept_seconds.observe(time.perf_counter() - started)
+        if self.draining:
+            await send_away(websocket, system_messages())
+            return None
+        connection_id = uuid.uuid4().hex
+        self.connections[connection_id] = user_id
+        self.users[user_id] = self.users.get(user_id, 0) + 1
+        outbound = self.broadcaster.add(connection_id, websocket)
+
+        # Everyone else hears about the new user on the next push
+        outbound.push(self.stats_feed.snapshot().frame, coalesce_key="stats")
+        return connection_id
+
+    def drain(self):
+        """Turn away new sockets and send every open one away, to reconnect to the worker taking over."""
+        self.draining = True
+        catalog = system_messages()
+        for connection_id, queue in list(self.broadcaster.queues.items()):
+            self.disconnect(connection_id)
+            self._tasks.spawn(send_away(queue.websocket, catalog))
+
+    def disconnect(self, connection_id: str):
+        """Forget a presence socket that closed."""
+        self.broadcaster.remove(connection_id)
+        self._forget(connection_id)
+
+    def _connection_broken(self, connection_id: str):
+        self._forget(connection_id)
+
+    def _forget(self, connection_id: str):
+        user_id = self.connections.pop(connection_id, None)
+        if user_id is None:
+            return
+        remaining = self.users.get(user_id, 1) - 1
+        if remaining > 0:
+            self.users[user_id] = remaining
+        else:
+            self.users.pop(user_id, None)
+
+    def user_count(self) -> int:
+        """Users with at least one presence socket open."""
+        return len(self.users)
+
+    def push_stats(self):
+        """Send the stats to every presence socket if they changed since the last push."""
+        snapshot = self.stats_feed.snapshot()
+        if snapshot.version == self._pushed_version:
+            return
+        self._pushed_version = snapshot.version
+        self.broadcaster.broadcast_frame(snapshot.frame, coalesce_key="stats")
@@ -0,0 +1,147 @@
+from typing import Dict, Optional
+import time
+
+try:
+    from .config import (RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_MUTE_AFTER,
+                         RATE_LIMIT_MUTE_SECONDS, RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MINUTE)
+except ImportError:
+    from config import (RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_MUTE_AFTER,
+                        RATE_LIMIT_MUTE_SECONDS, RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MINUTE)
+
+try:
+    from .metrics import MESSAGES_RATE_LIMITED
+except ImportError:
+    from metrics import MESSAGES_RATE_LIMITED
+
+# What to do with an incoming message
+ALLOW = "allow"  # Handle it
+THROTTLE = "throttle"  # Drop it and tell the sender to slow down; they just went over their rate
+THROTTLED = "throttled"  # Drop it; the sender was already told
+MUTE = "mute"  # Drop it; the sender kept going over and is now muted
+MUTED = "muted"  # Drop it; the sender is still muted
+
+
+class TokenBucket:
+    """Rate state for one user or IP."""
+
+    __slots__ = ("tokens", "updated", "strikes", "muted_until")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.strikes = 0  # Messages dropped since the bucket was last full
+        self.muted_until = 0.0
+
+
+class RateLimiter:
+    """Token bucket per key: up to `burst` messages at once, refilled at `per_minute`.
+
+    A key that keeps sending while throttled (`mute_after` dropped messages
+    without ever letting its bucket fill back up) is muted for `mute_seconds`.
+    """
+
+    def __init__(self, burst: int, per_minute: int, mute_after: int = 0, mute_seconds: int = 0,
+                 clock=time.monotonic):
+        self.burst = burst
+        self.rate = per_minute / 60.0  # Tokens per second
+        self.mute_after = mute_after
+        self.mute_seconds = mute_seconds
+        self._clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def check(self, key: str, now: Optional[float] = None) -> str:
+        """Take a token for one message. Returns ALLOW, THROTTLE, THROTTLED, MUTE or MUTED."""
+        now = self._clock() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        elif bucket.muted_until:
+            if now < bucket.muted_until:
+                return MUTED
+            bucket.muted_until = 0.0
+            bucket.strikes = 0
+
+        tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        if tokens >= self.burst:
+            bucket.strikes = 0  # They slowed down since the last strike
+        if tokens >= 1:
+            bucket.tokens = tokens - 1
+            return ALLOW
+
+        bucket.tokens = tokens
+        bucket.strikes += 1
+        if self.mute_after and bucket.strikes >= self.mute_after:
+            bucket.muted_until = now + self.mute_seconds
+            return MUTE
+        return THROTTLE if bucket.strikes == 1 else THROTTLED
+
+    def refund(self, key: str):
+        """Give back a token taken by check() for a message that was dropped anyway."""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(self.burst, bucket.tokens + 1)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Forget keys whose bucket has refilled and who aren't muted; they'd start over the same."""
+        now = self._clock() if now is None else now
+        idle = [key for key, bucket in self._buckets.items()
+                if bucket.muted_until <= now and bucket.tokens + (now - bucket.updated) * self.rate >= self.burst]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class FloodGuard:
+    """Per-user and per-IP limits on incoming chat messages, checked before any parsing."""
+
+    def __init__(self):
+        self.users = RateLimiter(RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MINUTE,
+                                 RATE_LIMIT_MUTE_AFTER, RATE_LIMIT_MUTE_SECONDS)
+        # Looser, since students on campus Wi-Fi can share an IP. Off unless RATE_LIMIT_IP_BURST is set
+        self.ips = RateLimiter(RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MINUTE) if RATE_LIMIT_IP_BURST > 0 else None
+        self.mute_seconds = RATE_LIMIT_MUTE_SECONDS
+
+    def check(self, user_id: str, ip: Optional[str]) -> str:
+        """Returns ALLOW, THROTTLE, THROTTLED, MUTE or MUTED for a message from this user."""
+        verdict = self.users.check(user_id)
+        if verdict == ALLOW and ip is not None and self.ips is not None:
+            verdict = self.ips.check(ip)
+            if verdict != ALLOW:
+                self.users.refund(user_id)  # The user isn't the one over the limit
+        if verdict != ALLOW:
+            MESSAGES_RATE_LIMITED.labels(verdict).inc()
+        return verdict
+
+    def prune(self):
+        """Drop idle buckets so memory follows active senders, not everyone ever seen."""
+        self.users.prune()
+        if self.ips is not None:
+            self.ips.prune()
+
+
+def flood_notice(verdict: str, mute_seconds: int = RATE_LIMIT_MUTE_SECONDS) -> Optional[str]:
+    """System message to send the sender for a verdict, or None to drop the message silently."""
+    if verdict == THROTTLE:
+        return "⚠️ You're sending messages too fast. Slow down a bit."
+    if verdict == MUTE:
+        return f"🔇 You've been muted for {mute_seconds} seconds for flooding the chat."
+    return None
+
+
+def client_ip(websocket) -> Optional[str]:
+    """The peer address of a connection.
+
+    Behind a proxy this is the proxy's address, the same for every user,
+    unless uvicorn is told to trust the proxy's X-Forwarded-For header
+    with --forwarded-allow-ips (by default it only trusts 127.0.0.1).
+    """
+    client = websocket.client
+    return client.host if client else None
+
+
+# Shared by pair chat and global chat, so flooding one counts against the other
+flood_guard = FloodGuard()
@@ -0,0 +1,253 @@
+from contextlib import asynccontextmanager
+from typing import Dict, Iterator, List, Optional
+import asyncio
+
+
+class KeyedLocks:
+    """An asyncio lock per key, made on first use and dropped once nobody holds or waits for it.
+
+    Holding the lock for one key never blocks another key, so a burst of
+    joins only ever queues up behind joins for the same key.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, List] = {}  # key -> [lock, holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class Chat:
+    """A chat between two users: one object, shared by both members' records.
+
+    `second` may be a user on another worker (see ChatPairs.link()), who has
+    no record here.
+    """
+
+    __slots__ = ("first", "second")
+
+    def __init__(self, first: str, second: str):
+        self.first = first
+        self.second = second
+
+    def partner_of(self, user_id: str) -> str:
+        return self.second if user_id == self.first else self.first
+
+
+class UserRecord:
+    """Everything the pair chat keeps about one local user.
+
+    A field is None (or False) when it doesn't apply: `websocket` while the
+    user is away, `chat` until they are paired, `joined` once they are.
+    """
+
+    __slots__ = ("user_id", "websocket", "campus", "preference", "waiting", "code",
+                 "joined", "catalog", "session", "chat")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.websocket = None  # Current connection
+        self.campus: Optional[str] = None  # Interned, like preference: a few values shared by everyone
+        self.preference: Optional[str] = None
+        self.waiting = False  # In the waiting list (see MatchmakingQueue)
+        self.code: Optional[str] = None  # Matching code they are waiting with
+        self.joined: Optional[float] = None  # time.monotonic() they connected at, until paired
+        self.catalog = None  # Pre-encoded system frames for their client
+        self.session = None  # ChatSession: resume token and, while they're away, held frames
+        self.chat: Optional[Chat] = None
+
+    def idle(self) -> bool:
+        """Whether nothing is left to keep the record for."""
+        return (self.websocket is None and self.session is None and self.chat is None
+                and not self.waiting and self.code is None)
+
+
+class UserIndex:
+    """Every local pair chat user's record, by user_id.
+
+    The one index ConnectionManager looks users up in: its connection,
+    session, waiting and chat tables are views over these records. A
+    record is dropped once the last of those lets go of it.
+    """
+
+    def __init__(self):
+        self._records: Dict[str, UserRecord] = {}
+
+    def get(self, user_id: str) -> Optional[UserRecord]:
+        return self._records.get(user_id)
+
+    def add(self, user_id: str) -> UserRecord:
+        """The user's record, made if they don't have one yet."""
+        record = self._records.get(user_id)
+        if record is None:
+            record = self._records[user_id] = UserRecord(user_id)
+        return record
+
+    def release(self, record: UserRecord):
+        """Forget a record if nothing is left in it."""
+        if record.idle() and self._records.get(record.user_id) is record:
+            del self._records[record.user_id]
+
+    def records(self) -> Iterator[UserRecord]:
+        return iter(list(self._records.values()))
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class FieldView:
+    """One field of every record, read like the old ``Dict[str, ...]`` of users who have it set.
+
+    Writes to the field must go through the view, which keeps the count.
+    """
+
+    def __init__(self, index: UserIndex, field: str):
+        self._index = index
+        self._field = field
+        self._count = 0
+
+    def get(self, user_id: str, default=None):
+        record = self._index.get(user_id)
+        if record is None:
+            return default
+        value = getattr(record, self._field)
+        return default if value is None else value
+
+    def __getitem__(self, user_id: str):
+        value = self.get(user_id)
+        if value is None:
+            raise KeyError(user_id)
+        return value
+
+    def __setitem__(self, user_id: str, value):
+        record = self._index.add(user_id)
+        if getattr(record, self._field) is None:
+            self._count += 1
+        setattr(record, self._field, value)
+
+    def __delitem__(self, user_id: str):
+        if self.pop(user_id) is None:
+            raise KeyError(user_id)
+
+    def pop(self, user_id: str, default=None):
+        record = self._index.get(user_id)
+        if record is None:
+            return default
+        value = getattr(record, self._field)
+        if value is None:
+            return default
+        setattr(record, self._field, None)
+        self._count -= 1
+        self._index.release(record)
+        return value
+
+    def __contains__(self, user_id: object) -> bool:
+        return self.get(user_id) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        return (user_id for user_id, _ in self.items())
+
+    def items(self):
+        field = self._field
+        return [(record.user_id, getattr(record, field)) for record in self._index.records()
+                if getattr(record, field) is not None]
+
+
+class ChatPairs:
+    """Who each local user is chatting with.
+
+    Reads like the old ``Dict[str, str]``, but changes only go through
+    pair(), link() and unpair(), each of which checks and updates both
+    sides without awaiting, so it runs as one step on the event loop and
+    nobody can end up in two chats. Both members' records share one Chat.
+    """
+
+    def __init__(self, index: Optional[UserIndex] = None):
+        self._index = index if index is not None else UserIndex()
+        self._count = 0  # Local users in a chat
+
+    def pair(self, user1: str, user2: str) -> bool:
+        """Put two local users in a chat together, unless either is already in one."""
+        if user1 == user2:
+            return False
+        record1 = self._index.add(user1)
+        record2 = self._index.add(user2)
+        if record1.chat is not None or record2.chat is not None:
+            self._index.release(record1)
+            self._index.release(record2)
+            return False
+        record1.chat = record2.chat = Chat(user1, user2)
+        self._count += 2
+        return True
+
+    def link(self, user_id: str, partner_id: str) -> bool:
+        """Put a local user in a chat with a partner on another worker, unless they are already in one."""
+        record = self._index.add(user_id)
+        if record.chat is not None:
+            return False
+        record.chat = Chat(user_id, partner_id)
+        self._count += 1
+        return True
+
+    def unpair(self, user_id: str) -> Optional[str]:
+        """End a user's chat, returning who their partner was."""
+        record = self._index.get(user_id)
+        if record is None or record.chat is None:
+            return None
+        chat = record.chat
+        partner_id = chat.partner_of(user_id)
+        record.chat = None
+        self._count -= 1
+        self._index.release(record)
+        partner = self._index.get(partner_id)
+        if partner is not None and partner.chat is chat:
+            partner.chat = None
+            self._count -= 1
+            self._index.release(partner)
+        return partner_id
+
+    def get(self, user_id: str, default=None) -> Optional[str]:
+        record = self._index.get(user_id)
+        if record is None or record.chat is None:
+            return default
+        return record.chat.partner_of(user_id)
+
+    def __getitem__(self, user_id: str) -> str:
+        partner_id = self.get(user_id)
+        if partner_id is None:
+            raise KeyError(user_id)
+        return partner_id
+
+    def __contains__(self, user_id: object) -> bool:
+        record = self._index.get(user_id)
+        return record is not None and record.chat is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        return (user_id for user_id, _ in self.items())
+
+    def items(self):
+        return [(record.user_id, record.chat.partner_of(record.user_id))
+                for record in self._index.records() if record.chat is not None]
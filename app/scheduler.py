@@ -0,0 +1,43 @@
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import inspect
+
+
+class PeriodicScheduler:
+    """Runs periodic housekeeping jobs as tasks on the event loop.
+
+    Jobs run on the same loop as the request handlers, so they can touch
+    shared state and await sends without any locking, and they stop
+    cleanly when the app shuts down.
+    """
+
+    def __init__(self):
+        self._jobs: List[Tuple[str, float, Callable]] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def every(self, interval: float, job: Callable, name: Optional[str] = None):
+        """Run `job` (a function or coroutine function) every `interval` seconds."""
+        self._jobs.append((name or job.__name__, interval, job))
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run(name, interval, job), name=name)
+                       for name, interval, job in self._jobs]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, name: str, interval: float, job: Callable):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = job()
+                if inspect.isawaitable(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in scheduled job {name}: {e}")
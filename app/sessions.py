@@ -0,0 +1,70 @@
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+import asyncio
+import secrets
+
+# Close codes that mean the user left on purpose (closed the chat, or the tab), so nothing is held
+LEAVE_CODES = (1000, 1001)
+# Close code for a resume attempt whose session is gone; the client should start over
+SESSION_ENDED = 4000
+# Close code for connections sent away by a worker that is shutting down (WebSocket "Service Restart")
+SERVICE_RESTART = 1012
+# Close code for connections dropped for not answering keepalive pings; a client that is still there reconnects
+IDLE_TIMEOUT = 4001
+
+
+class ChatSession:
+    """A paired user's claim on their chat, kept for a grace period after their socket drops.
+
+    The client gets `token` when it connects and can present it to pick the
+    chat back up. While the user is away, frames meant for them are kept in
+    a bounded buffer (oldest dropped first) and replayed when they return.
+    The buffer is only made once there is something to hold.
+    """
+
+    __slots__ = ("user_id", "token", "buffer_size", "buffer", "dropped", "expiry", "rejoin")
+
+    def __init__(self, user_id: str, buffer_size: int, token: Optional[str] = None):
+        self.user_id = user_id
+        self.token = token or secrets.token_urlsafe(16)
+        self.buffer_size = buffer_size
+        self.buffer: Optional[Deque[str]] = None
+        self.dropped = 0  # Frames pushed out of a full buffer
+        self.expiry: Optional[asyncio.TimerHandle] = None  # Set while the user is away
+        # (campus, preference, code) for a user held while still waiting for a partner; they rejoin matchmaking
+        self.rejoin: Optional[Tuple[str, str, Optional[str]]] = None
+
+    @property
+    def suspended(self) -> bool:
+        return self.expiry is not None
+
+    def matches(self, token: str) -> bool:
+        return secrets.compare_digest(self.token, token)
+
+    def hold(self, frame: str):
+        """Keep a frame for when the user comes back."""
+        if self.buffer is None:
+            self.buffer = deque(maxlen=self.buffer_size)
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(frame)
+
+    def suspend(self, grace: float, on_expired, *args):
+        """Start the grace period; `on_expired(*args)` runs if the user hasn't come back by then."""
+        self.expiry = asyncio.get_running_loop().call_later(grace, on_expired, *args)
+
+    def resume(self) -> List[str]:
+        """End the grace period, returning the frames held meanwhile."""
+        self.cancel()
+        frames = self.held()
+        self.buffer = None
+        return frames
+
+    def held(self) -> List[str]:
+        """The frames held so far, oldest first."""
+        return list(self.buffer) if self.buffer else []
+
+    def cancel(self):
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
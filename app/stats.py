@@ -0,0 +1,72 @@
+from typing import Callable, Dict, Optional
+import asyncio
+import hashlib
+import time
+
+try:
+    from .broadcast import encode_frame
+except ImportError:
+    from broadcast import encode_frame
+
+
+class StatsSnapshot:
+    """One version of the stats, encoded once for every reader."""
+
+    __slots__ = ("version", "stats", "body", "etag", "frame")
+
+    def __init__(self, version: int, stats: Dict):
+        self.version = version
+        self.stats = stats
+        self.body = encode_frame(stats)  # JSON body for HTTP and server-sent events
+        self.etag = '"' + hashlib.sha1(self.body.encode("utf-8")).hexdigest()[:16] + '"'
+        self.frame = encode_frame({"type": "stats", **stats})  # WebSocket message
+
+
+class StatsFeed:
+    """Stats read from the managers at most once per `ttl` seconds, shared by every reader.
+
+    The counts themselves are the sizes of the managers' dicts, kept up to
+    date as users connect, pair and leave, so reading them is cheap; what
+    this saves is building and encoding a response per request. A new
+    snapshot (and ETag) is only made when a count actually changes, and
+    ``wait_for_change()`` lets streaming readers sleep until then.
+    """
+
+    def __init__(self, source: Callable[[], Dict], ttl: float = 1.0):
+        self.source = source
+        self.ttl = ttl
+        self._snapshot: Optional[StatsSnapshot] = None
+        self._fetched_at = 0.0
+        self._changed: Optional[asyncio.Event] = None
+
+    def snapshot(self) -> StatsSnapshot:
+        """The current snapshot, refreshed first if it is older than the TTL."""
+        if self._snapshot is None or time.monotonic() - self._fetched_at >= self.ttl:
+            self.refresh()
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """Re-read the stats now. Returns whether they changed."""
+        stats = self.source()
+        self._fetched_at = time.monotonic()
+        if self._snapshot is not None and stats == self._snapshot.stats:
+            return False
+        version = self._snapshot.version + 1 if self._snapshot is not None else 1
+        self._snapshot = StatsSnapshot(version, stats)
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+        return True
+
+    async def wait_for_change(self, version: int, timeout: float) -> Optional[StatsSnapshot]:
+        """Wait for a snapshot newer than `version`. Returns None if none came within `timeout`."""
+        snapshot = self.snapshot()
+        if snapshot.version > version:
+            return snapshot
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self._snapshot
@@ -0,0 +1,80 @@
+from typing import Dict, Tuple
+
+try:
+    from .broadcast import encode_batch, encode_frame
+except ImportError:
+    from broadcast import encode_batch, encode_frame
+
+DEFAULT_LOCALE = "en"
+
+# Text of each system message, per locale
+TEXTS: Dict[str, Dict[str, str]] = {
+    "en": {
+        "paired": "Connected to a chat partner!",
+        "code_paired": "Connected to your chat partner via matching code!",
+        "privacy_notice": "Chats are anonymous by default — we recommend not sharing personal information. Your identity stays private unless you choose to share it. You’re free to leave a chat anytime.",
+        "partner_left": "Your chat partner has disconnected.",
+        "filtered": "⚠️ Your message contained inappropriate content and was filtered.",
+        "partner_reconnecting": "Your chat partner lost their connection. Waiting for them to come back...",
+        "partner_back": "Your chat partner is back.",
+        "session_expired": "Your chat has ended.",
+        "server_restarting": "The server is restarting. Reconnecting you...",
+    },
+    "fil": {
+        "paired": "Nakakonekta ka na sa isang ka-chat!",
+        "code_paired": "Nakakonekta ka na sa iyong ka-chat gamit ang code!",
+        "privacy_notice": "Anonymous ang mga chat bilang default — iminumungkahi naming huwag magbahagi ng personal na impormasyon. Mananatiling pribado ang iyong pagkakakilanlan maliban kung pipiliin mong ibahagi ito. Malaya kang umalis sa chat anumang oras.",
+        "partner_left": "Umalis na ang iyong ka-chat.",
+        "filtered": "⚠️ May hindi angkop na nilalaman ang iyong mensahe kaya ito ay na-filter.",
+        "partner_reconnecting": "Nawalan ng koneksyon ang iyong ka-chat. Hinihintay namin siyang bumalik...",
+        "partner_back": "Nakabalik na ang iyong ka-chat.",
+        "session_expired": "Natapos na ang iyong chat.",
+        "server_restarting": "Nagre-restart ang server. Ikinokonekta ka ulit...",
+    },
+}
+
+# Messages sent together for each event, in order
+EVENTS: Dict[str, Tuple[str, ...]] = {
+    "paired": ("paired", "privacy_notice"),
+    "code_paired": ("code_paired", "privacy_notice"),
+    "partner_left": ("partner_left",),
+    "filtered": ("filtered",),
+    "partner_reconnecting": ("partner_reconnecting",),
+    "partner_back": ("partner_back",),
+    "session_expired": ("session_expired",),
+    "server_restarting": ("server_restarting",),
+}
+
+
+class SystemMessages:
+    """Every system event's frames for one locale, encoded once when the app loads.
+
+    Each frame carries an "event" key so clients can react to it whatever
+    the language. Clients that take batch frames get one frame per event;
+    others get the event's frames one by one.
+    """
+
+    def __init__(self, locale: str, batch: bool):
+        self.locale = locale
+        self.batch = batch
+        texts = TEXTS[locale]
+        self._frames: Dict[str, Tuple[str, ...]] = {}
+        for event, names in EVENTS.items():
+            frames = tuple(encode_frame({"type": "system", "message": texts[name], "event": name}) for name in names)
+            if batch and len(frames) > 1:
+                frames = (encode_batch(list(frames)),)
+            self._frames[event] = frames
+
+    def frames(self, event: str) -> Tuple[str, ...]:
+        return self._frames[event]
+
+
+CATALOGS: Dict[Tuple[str, bool], SystemMessages] = {
+    (locale, batch): SystemMessages(locale, batch) for locale in TEXTS for batch in (False, True)
+}
+
+
+def system_messages(locale: str = DEFAULT_LOCALE, batch: bool = False) -> SystemMessages:
+    """The catalog for a client ("fil", "fil-PH", ...), falling back to English for unknown locales."""
+    language = locale.split("-")[0].lower()
+    return CATALOGS.get((language, batch)) or CATALOGS[(DEFAULT_LOCALE, batch)]
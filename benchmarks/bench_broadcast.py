@@ -0,0 +1,144 @@
+"""Global chat fan-out load test with simulated sockets.
+
+Connects 5k fake sockets to a Broadcaster (a handful of them deliberately
+slow), pushes a stream of chat messages and reports p50/p95/p99 delivery
+latency for the healthy sockets. The old sequential send_json loop is run on
+the same population for comparison.
+
+    python benchmarks/bench_broadcast.py [--sockets 5000] [--slow 10] [--messages 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.broadcast import Broadcaster, POLICIES  # noqa: E402
+
+
+class FakeWebSocket:
+    """Records when each frame arrived; slow sockets stall on every send."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = []
+
+    async def send_text(self, frame: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append((frame, time.perf_counter()))
+
+    async def send_json(self, message):
+        await self.send_text(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self):
+        pass
+
+
+def make_sockets(count: int, slow: int, slow_delay: float):
+    return [FakeWebSocket(slow_delay if i < slow else 0.0) for i in range(count)]
+
+
+def make_message(i: int):
+    return {
+        "type": "global_message",
+        "message": f"hello everyone, message number {i}",
+        "user_id": "Anon1a2b3c",
+        "timestamp": "2024-01-01T08:00:00",
+        "message_id": f"msg-{i}",
+    }
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return 0.0, 0.0, 0.0
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]  # noqa: E731
+    return pick(0.50), pick(0.95), pick(0.99)
+
+
+def latencies(sockets, sent_at, healthy_only=True):
+    samples = []
+    for ws in sockets:
+        if healthy_only and ws.delay:
+            continue
+        for frame, received_at in ws.received:
+            started = sent_at.get(frame)
+            if started is not None:
+                samples.append((received_at - started) * 1000)
+    return samples
+
+
+async def run_engine(args, policy: str):
+    sockets = make_sockets(args.sockets, args.slow, args.slow_delay)
+    broadcaster = Broadcaster(maxsize=args.queue_size, policy=policy)
+    for i, ws in enumerate(sockets):
+        broadcaster.add(f"user{i}", ws)
+
+    sent_at = {}
+    for i in range(args.messages):
+        message = make_message(i)
+        frame = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        sent_at[frame] = time.perf_counter()
+        broadcaster.broadcast_frame(frame)
+        await asyncio.sleep(args.interval)
+
+    # Let healthy writers drain; slow ones are not waited for
+    deadline = time.perf_counter() + 5
+    healthy = [q for q in broadcaster.queues.values() if not q.websocket.delay]
+    while any(len(q) for q in healthy) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+    dropped = sum(q.dropped for q in broadcaster.queues.values())
+    disconnected = args.sockets - len(broadcaster.queues)
+    for user_id in list(broadcaster.queues):
+        broadcaster.remove(user_id)
+    return latencies(sockets, sent_at), dropped, disconnected
+
+
+async def run_legacy(args):
+    sockets = make_sockets(args.sockets, args.slow, args.slow_delay)
+    connections = {f"user{i}": ws for i, ws in enumerate(sockets)}
+
+    sent_at = {}
+    for i in range(args.legacy_messages):
+        message = make_message(i)
+        frame = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        sent_at[frame] = time.perf_counter()
+        for websocket in list(connections.values()):
+            await websocket.send_json(message)
+        await asyncio.sleep(args.interval)
+    return latencies(sockets, sent_at)
+
+
+def report(name, samples, extra=""):
+    p50, p95, p99 = percentiles(samples)
+    mean = statistics.fmean(samples) if samples else 0.0
+    print(f"{name:<22} p50={p50:8.2f}ms p95={p95:8.2f}ms p99={p99:8.2f}ms mean={mean:8.2f}ms {extra}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=10, help="number of deliberately slow sockets")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds each slow send takes")
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--legacy-messages", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between messages")
+    parser.add_argument("--queue-size", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{args.sockets} sockets, {args.slow} slow ({args.slow_delay * 1000:.0f}ms per send), "
+          f"{args.messages} messages, healthy-socket delivery latency:")
+    for policy in POLICIES:
+        samples, dropped, disconnected = await run_engine(args, policy)
+        report(f"queued ({policy})", samples, f"dropped={dropped} disconnected={disconnected}")
+    report("legacy send_json loop", await run_legacy(args), f"({args.legacy_messages} messages)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
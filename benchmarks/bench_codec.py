@@ -0,0 +1,106 @@
+"""JSON encode/decode throughput on chat payloads: json vs. orjson.
+
+Decodes typical incoming {"message": ...} frames and encodes the frames
+the server sends (pair messages, global messages, system notices, stats)
+with the standard library and, if installed, orjson, the two codecs
+JSON_CODEC can select. Also shows what the frame size cap saves on an
+oversized frame: rejecting it on length vs. decoding it first.
+
+    python benchmarks/bench_codec.py [--messages 20000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+
+from app.codec import RejectedMessage, _stdlib_dumps, decode_chat_message  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TEXTS = [
+    "hi", "hello", "asa ka?", "lol", "what course are you taking?",
+    "just finished my exam in the main campus, so tired",
+    "anyone here from BSCS? need help with our data structures project",
+    "grabe ang init karon 🥵 unsa may plano ninyo later?",
+]
+
+
+def make_payloads(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    incoming, outgoing = [], []
+    for i in range(count):
+        text = rng.choice(TEXTS)
+        incoming.append(json.dumps({"message": text}))
+        roll = rng.random()
+        if roll < 0.4:
+            outgoing.append({"type": "message", "message": text})
+        elif roll < 0.8:
+            outgoing.append({"type": "global_message", "message": text, "user_id": f"Anon{i:06d}",
+                             "timestamp": "2025-06-01T12:34:56.789012",
+                             "message_id": "3f2b9a1e-8c4d-4e6f-9a0b-1c2d3e4f5a6b"})
+        elif roll < 0.9:
+            outgoing.append({"type": "system", "message": "Connected to a chat partner!"})
+        else:
+            outgoing.append({"type": "stats", "active_users": rng.randint(0, 500), "waiting_users": 3,
+                             "chatting_users": 40, "active_chats": 20, "standby_users": 120})
+    return incoming, outgoing
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def report(name, elapsed, count):
+    print(f"{name:<36} {elapsed * 1000:9.1f}ms {count / elapsed:12.0f} op/s {elapsed / count * 1e6:8.2f}us/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    incoming, outgoing = make_payloads(args.messages)
+    codecs = {"json": (json.loads, _stdlib_dumps)}
+    if orjson is not None:
+        codecs["orjson"] = (orjson.loads, lambda message: orjson.dumps(message).decode("utf-8"))
+    else:
+        print("orjson is not installed; only timing json")
+
+    print(f"{args.messages} incoming and {args.messages} outgoing frames")
+    for name, (loads, dumps) in codecs.items():
+        report(f"{name} decode", timed(loads, incoming), len(incoming))
+        report(f"{name} encode", timed(dumps, outgoing), len(outgoing))
+
+    if "orjson" in codecs:
+        differ = sum(1 for message in outgoing if codecs["json"][1](message) != codecs["orjson"][1](message))
+        print(f"encoded output differs on {differ}/{len(outgoing)} frames")
+
+    # A 1 MB frame, e.g. a pasted file, against the default 4 KB cap
+    oversized = json.dumps({"message": "x" * 1_000_000})
+    runs = 50
+
+    def reject(raw):
+        try:
+            decode_chat_message(raw)
+        except RejectedMessage:
+            pass
+
+    print(f"\noversized frame ({len(oversized)} chars)")
+    report("decode, then check length", timed(json.loads, [oversized] * runs), runs)
+    report("rejected on frame length", timed(reject, [oversized] * runs), runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""End-to-end load test of the WebSocket routes, in process.
+
+Drives the app through ASGI with thousands of simulated clients (see
+harness.py), no network needed:
+
+- pair:   users join /ws/{user_id}/{campus}/{preference}, get paired, then
+          every user sends messages to their partner
+- code:   users join /ws/code/... two per code, then exchange messages
+- global: users join /ws/global/{user_id} and a few of them chat
+
+Reports connections/sec, time-to-pair, messages/sec and p50/p95/p99
+delivery latency. Results can be saved and compared against a previous run
+(e.g. from another commit), or against the baseline checked in at
+benchmarks/baseline/endpoints.json:
+
+    python benchmarks/bench_endpoints.py --compare
+    python benchmarks/bench_endpoints.py --save
+    python benchmarks/bench_endpoints.py --compare benchmarks/results/endpoints-<commit>.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# Keep runs independent of any saved filter state
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+os.environ.setdefault("GLOBAL_LOG_DIR", "off")
+os.environ.setdefault("HANDOFF_PATH", "off")
+
+from harness import close_all, connect_all, latency_summary  # noqa: E402
+from app.main import app, global_chat_manager  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")  # Your own runs; not checked in
+BASELINE_PATH = os.path.normpath(os.path.join(ROOT, "benchmarks", "baseline", "endpoints.json"))  # Checked in
+PREFERENCES = ["None", "NAO", "SITEAO", "AAO", "SHS", "LAAO", "COL", "SOM", "EAO", "MAO"]
+
+# Metrics where a bigger number is better; for everything else smaller is better
+HIGHER_IS_BETTER = ("per_sec",)
+
+
+# Start of the system message telling a user they were paired (regular, code)
+PAIRED_NOTICES = ("Connected to a chat partner", "Connected to your chat partner")
+
+
+def is_paired(message):
+    return message.get("type") == "system" and message.get("message", "").startswith(PAIRED_NOTICES)
+
+
+class DeliveryTracker:
+    """Send times of tagged messages, and the latency of each arrival."""
+
+    def __init__(self, message_type: str):
+        self.message_type = message_type
+        self.sent_at = {}
+        self.latencies = []
+        self.expected = 0
+        self.frames = 0  # Frames that carried tracked messages (a batch frame counts once)
+        self.done = asyncio.Event()
+
+    def sent(self, text: str, receivers: int = 1):
+        self.sent_at[text] = time.perf_counter()
+        self.expected += receivers
+
+    def on_message(self, arrived, message):
+        if message.get("type") == "batch":
+            self.frames += 1
+            for inner in message["messages"]:
+                self._arrived(arrived, inner)
+        elif message.get("type") == self.message_type:
+            self.frames += 1
+            self._arrived(arrived, message)
+
+    def _arrived(self, arrived, message):
+        if message.get("type") != self.message_type:
+            return
+        started = self.sent_at.get(message.get("message"))
+        if started is None:
+            return
+        self.latencies.append(arrived - started)
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    async def wait(self, timeout: float = 60.0):
+        if len(self.latencies) < self.expected:
+            self.done.clear()
+            try:
+                await asyncio.wait_for(self.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"  timed out: {len(self.latencies)}/{self.expected} messages delivered")
+
+
+async def exchange_messages(clients, tracker: DeliveryTracker, rounds: int, prefix: str):
+    """Every client sends `rounds` messages to its partner, one round at a time."""
+    started = time.perf_counter()
+    for round_number in range(rounds):
+        for index, client in enumerate(clients):
+            text = f"{prefix}{index}r{round_number} says hello"  # One token, so the filter can't censor part of it
+            tracker.sent(text)
+            client.send_json({"message": text})
+        await tracker.wait()
+    return time.perf_counter() - started
+
+
+async def bench_pairing(users: int, rounds: int, code: bool):
+    tracker = DeliveryTracker("message")
+    if code:
+        paths = [f"/ws/code/code{i}/Main/None/c{i // 2}" for i in range(users)]
+    else:
+        # Consecutive users share a preference so every bucket has an even number of users
+        paths = [f"/ws/pair{i}/Main/{PREFERENCES[i // 2 % len(PREFERENCES)]}" for i in range(users)]
+    clients, connect_elapsed = await connect_all(app, paths, on_message=tracker.on_message)
+
+    waits = []
+    for client in clients:
+        arrived, _ = await client.wait_for(is_paired)
+        waits.append(arrived - client.connect_started)
+
+    elapsed = await exchange_messages(clients, tracker, rounds, "code" if code else "pair")
+    await close_all(clients)
+
+    results = {
+        "connections_per_sec": users / connect_elapsed,
+        "messages_per_sec": len(tracker.latencies) / elapsed,
+    }
+    results.update({f"time_to_pair_{key}": value for key, value in latency_summary(waits).items()})
+    results.update({f"delivery_{key}": value for key, value in latency_summary(tracker.latencies).items()})
+    return results
+
+
+async def bench_global(users: int, senders: int, rounds: int, batch_window_ms: int):
+    tracker = DeliveryTracker("global_message")
+    global_chat_manager.broadcaster.batch_window = batch_window_ms / 1000
+    query = "?batch=1" if batch_window_ms else ""
+    paths = [f"/ws/global/global{i}{query}" for i in range(users)]
+    clients, connect_elapsed = await connect_all(app, paths, on_message=tracker.on_message)
+
+    senders = min(senders, users)
+    started = time.perf_counter()
+    for round_number in range(rounds):
+        for index in range(senders):
+            text = f"global{index}r{round_number} says hello"
+            tracker.sent(text, receivers=users - 1)  # Everyone but the sender
+            clients[index].send_json({"message": text})
+        await tracker.wait()
+    elapsed = time.perf_counter() - started
+    await close_all(clients)
+
+    results = {
+        "connections_per_sec": users / connect_elapsed,
+        "deliveries_per_sec": len(tracker.latencies) / elapsed,
+        "frames_per_delivery": tracker.frames / max(1, len(tracker.latencies)),
+    }
+    results.update({f"delivery_{key}": value for key, value in latency_summary(tracker.latencies).items()})
+    return results
+
+
+async def run(args):
+    results = {}
+    async with app.router.lifespan_context(app):
+        print(f"pair: {args.users} users, {args.rounds} messages each")
+        results["pair"] = await bench_pairing(args.users, args.rounds, code=False)
+        print(f"code: {args.users} users, {args.rounds} messages each")
+        results["code"] = await bench_pairing(args.users, args.rounds, code=True)
+        print(f"global: {args.global_users} users, {args.senders} senders x {args.rounds} messages"
+              + (f", {args.batch_window}ms batches" if args.batch_window else ""))
+        results["global"] = await bench_global(args.global_users, args.senders, args.rounds, args.batch_window)
+    return results
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def settings(args):
+    return {key: value for key, value in vars(args).items() if key not in ("save", "compare")}
+
+
+def print_results(results, baseline=None):
+    for scenario, metrics in results.items():
+        print(f"\n[{scenario}]")
+        for name, value in metrics.items():
+            line = f"  {name:<28} {value:>12.2f}"
+            old = (baseline or {}).get(scenario, {}).get(name)
+            if old:
+                change = (value - old) / old * 100
+                better = change > 0 if name.endswith(HIGHER_IS_BETTER) else change < 0
+                line += f"   baseline {old:>12.2f}  {change:+7.1f}% {'better' if better else 'worse'}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="users for the pair and code scenarios")
+    parser.add_argument("--global-users", type=int, default=1000)
+    parser.add_argument("--senders", type=int, default=20, help="global chat users that send messages")
+    parser.add_argument("--batch-window", type=int, default=0, metavar="MS",
+                        help="global chat clients ask for batch frames, collected over this window")
+    parser.add_argument("--rounds", type=int, default=5, help="messages sent by each sender")
+    parser.add_argument("--save", nargs="?", const="", metavar="PATH",
+                        help="save results (default benchmarks/results/endpoints-<commit>.json)")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, metavar="PATH",
+                        help="compare against saved results (default the checked-in baseline)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            saved = json.load(baseline_file)
+        baseline = saved["results"]
+        print(f"comparing with {args.compare} (commit {saved.get('commit')})")
+        if saved.get("settings") != settings(args):
+            print(f"note: the baseline used different settings: {saved.get('settings')}")
+
+    results = asyncio.run(run(args))
+    print_results(results, baseline)
+
+    if args.save is not None:
+        commit = current_commit()
+        path = args.save or os.path.join(RESULTS_DIR, f"endpoints-{commit}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as results_file:
+            json.dump({
+                "commit": commit,
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "settings": settings(args),
+                "results": results,
+            }, results_file, indent=2)
+        print(f"\nsaved to {path}")
+
+
+if __name__ == "__main__":
+    main()
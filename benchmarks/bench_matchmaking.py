@@ -0,0 +1,75 @@
+"""Join latency of regular matchmaking as the waiting list grows.
+
+Fills the waiting list with users nobody can match (each on their own
+preference), then times joins that do find a partner. The indexed queue should
+stay flat from 10 to 100k waiting users; the old linear scan is run alongside
+for comparison.
+
+    python benchmarks/bench_matchmaking.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.matchmaking import MatchmakingQueue  # noqa: E402
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+JOINS = 2_000
+LEGACY_MAX_WORK = 5_000_000  # cap on waiting users scanned by the legacy path
+
+
+def legacy_pair(waiting_users, chat_pairs, code_waiting_users, user1):
+    """The pre-index pair_users loop, kept here only as a baseline."""
+    campus1, preference1 = waiting_users[user1]
+    for user2, (campus2, preference2) in waiting_users.items():
+        if user1 != user2 and campus1 == campus2 and preference1 == preference2:
+            if user2 not in chat_pairs and user2 not in code_waiting_users.values():
+                chat_pairs[user1] = user2
+                chat_pairs[user2] = user1
+                del waiting_users[user1]
+                del waiting_users[user2]
+                return user2
+    return None
+
+
+def bench_indexed(size: int) -> float:
+    queue = MatchmakingQueue()
+    for i in range(size):
+        queue[f"idle{i}"] = ("Main", f"course{i}")
+
+    start = time.perf_counter()
+    for i in range(JOINS):
+        user_id = f"join{i}"
+        queue[user_id] = ("Main", "BSCS")
+        partner = queue.pop_match(user_id)
+        if partner:
+            del queue[user_id]
+    elapsed = time.perf_counter() - start
+    return elapsed / JOINS * 1e6
+
+
+def bench_legacy(size: int) -> float:
+    waiting_users = {f"idle{i}": ("Main", f"course{i}") for i in range(size)}
+    chat_pairs = {}
+    code_waiting_users = {}
+    joins = max(2, min(JOINS, LEGACY_MAX_WORK // size))
+
+    start = time.perf_counter()
+    for i in range(joins):
+        user_id = f"join{i}"
+        waiting_users[user_id] = ("Main", "BSCS")
+        legacy_pair(waiting_users, chat_pairs, code_waiting_users, user_id)
+    elapsed = time.perf_counter() - start
+    return elapsed / joins * 1e6
+
+
+def main():
+    print(f"{'waiting':>10} {'indexed us/join':>16} {'legacy us/join':>16}")
+    for size in SIZES:
+        print(f"{size:>10} {bench_indexed(size):>16.2f} {bench_legacy(size):>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
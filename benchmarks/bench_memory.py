@@ -0,0 +1,100 @@
+"""Memory the pair chat keeps per connected user, at 10k/50k/100k users.
+
+Connects users to a fresh ConnectionManager the way the /ws routes do
+(connect, then pair_users or pair_with_code, then notify_paired) and
+measures, with tracemalloc, everything the manager holds on to per user:
+ids, campus and preference strings, chats, resume sessions and the indexes
+over them. The sockets themselves are made beforehand and not counted.
+One user in twenty waits on a matching code nobody else has; the rest end
+up paired.
+
+    python benchmarks/bench_memory.py [--users 10000 50000 100000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+os.environ.setdefault("GLOBAL_LOG_DIR", "off")
+os.environ.setdefault("HANDOFF_PATH", "off")
+
+from app.main import ConnectionManager  # noqa: E402
+
+CAMPUSES = ["Main Campus"]
+PREFERENCES = ["None", "NAO", "SITEAO", "AAO", "SHS", "LAAO", "COL", "SOM", "EAO", "MAO", "ALUMNI"]
+CODE_EVERY = 20
+
+
+class FakeSocket:
+    """Accepts and swallows everything; stands in for a Starlette WebSocket."""
+
+    __slots__ = ()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+def path_param(value: str) -> str:
+    # Every request parses its own copy out of the URL
+    return "".join(list(value))
+
+
+async def fill(manager: ConnectionManager, sockets):
+    for i, websocket in enumerate(sockets):
+        user_id = str(uuid.uuid4())
+        campus = path_param(CAMPUSES[i % len(CAMPUSES)])
+        preference = path_param(PREFERENCES[i % len(PREFERENCES)])
+        await manager.connect(websocket, user_id, campus, preference)
+        if i % CODE_EVERY == 0:
+            matched = manager.pair_with_code(user_id, f"code-{i}")
+        else:
+            matched = manager.pair_users(user_id)
+        if matched:
+            await manager.notify_paired(user_id)
+            await manager.notify_paired(matched)
+
+
+async def measure(users: int):
+    manager = ConnectionManager()
+    sockets = [FakeSocket() for _ in range(users)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await fill(manager, sockets)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    stats = manager.get_user_stats()
+    return used, stats
+
+
+async def run(args):
+    print(f"{'users':>8} {'paired':>8} {'waiting':>8} {'MB':>8} {'bytes/user':>11} {'users/GB':>10}")
+    for users in args.users:
+        used, stats = await measure(users)
+        per_user = used / users
+        print(f"{users:>8} {stats['chatting_users']:>8} {stats['waiting_users']:>8} {used / 1e6:>8.1f} "
+              f"{per_user:>11.0f} {int(1e9 // per_user):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="*", default=[10_000, 50_000, 100_000])
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Profanity filtering throughput: better_profanity vs. the compiled filter.
+
+Runs a synthetic chat corpus (short greetings repeated a lot, longer
+messages, leetspeak and multi-word profanity) through the old path
+(censor() followed by contains_profanity(), i.e. two better_profanity passes)
+and through CompiledFilter with and without its LRU cache. Also reports how
+often the two disagree on the censored text, over the corpus plus every
+spelled-out and punctuated edge case.
+
+    python benchmarks/bench_moderation.py [--messages 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from better_profanity import profanity  # noqa: E402
+
+from app.moderation import CompiledFilter, load_default_wordlist  # noqa: E402
+
+COMMON = [
+    "hi", "hello", "hey", "hahaha", "lol", "asa ka?", "sup", "ok", "bye", "thanks",
+    "what course are you taking?", "kinsa ni?", "same here", "gg", "nice one",
+]
+SENTENCES = [
+    "just finished my exam in the main campus, so tired",
+    "anyone here from BSCS? need help with our data structures project",
+    "the line at the cafeteria is so long today, grabe",
+    "who else is going to the org fair later at the gym?",
+    "my professor moved the deadline again, I can't believe this",
+    "does anyone know if the library is open on saturday?",
+]
+PROFANE = [
+    "what the fuck", "this is bullshit", "sh1t happens", "you are an a$$hole",
+    "f*ck this class", "such a dumb bitch move", "holy shit that was fast",
+]
+# Spelled out, or with punctuation inside words: censored or not depending on where the words fall
+EDGE_CASES = [
+    "Hello f u c k", "f u c k you", "s h i t", "s h i t happens", "as s", "a s s hole", "f-u-c-k off",
+    "s.h.i.t. again", "sh!+", "sh!+ you", "sh!t man", "b!tch please", "what the f+ck", "x f", "a",
+]
+
+
+def make_corpus(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.5:
+            corpus.append(rng.choice(COMMON))
+        elif roll < 0.85:
+            corpus.append(rng.choice(SENTENCES) + f" #{rng.randint(0, 999)}")
+        elif roll < 0.95:
+            corpus.append(rng.choice(SENTENCES) + " " + rng.choice(PROFANE))
+        else:
+            corpus.append(rng.choice(EDGE_CASES))
+    return corpus
+
+
+def better_profanity_path(corpus):
+    for message in corpus:
+        profanity.censor(message)
+        profanity.contains_profanity(message)
+
+
+def compiled_path(compiled, corpus, cached: bool):
+    moderate = compiled.moderate if cached else compiled._moderate
+    for message in corpus:
+        moderate(message)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    profanity.load_censor_words()
+
+    start = time.perf_counter()
+    compiled = CompiledFilter(load_default_wordlist())
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    results = {
+        "better_profanity (censor + contains)": timed(better_profanity_path, corpus),
+        "compiled, uncached": timed(compiled_path, compiled, corpus, False),
+        "compiled, LRU cached": timed(compiled_path, compiled, corpus, True),
+    }
+
+    print(f"{len(corpus)} messages, compile took {compile_ms:.1f}ms")
+    for name, elapsed in results.items():
+        rate = len(corpus) / elapsed
+        print(f"{name:<40} {elapsed * 1000:9.1f}ms {rate:12.0f} msg/s {elapsed / len(corpus) * 1e6:9.1f}us/msg")
+
+    distinct = sorted(set(corpus) | set(EDGE_CASES))
+    mismatches = [m for m in distinct if profanity.censor(m) != compiled.moderate(m).text]
+    print(f"output differs from better_profanity on {len(mismatches)}/{len(distinct)} distinct messages")
+    for message in mismatches[:5]:
+        print(f"  {message!r}: {profanity.censor(message)!r} vs {compiled.moderate(message).text!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Pair chat latency for everyone else while a few users send huge messages.
+
+In process through ASGI (see harness.py): `--pairs` pairs chat normally,
+one short message per sender every `--interval-ms`, while `--heavy` other
+users each send max-length messages built to be as slow as possible to
+moderate (spelled-out profanity), the next one as soon as their partner
+has the last. Reports the p50/p99/max delivery latency of the normal
+messages and how many heavy ones got through, with moderation done on the
+event loop (inline), in a thread pool and in a process pool.
+
+Rate limits are raised for the run so the heavy senders aren't throttled.
+
+    python benchmarks/bench_moderation_latency.py [--pairs 50] [--heavy 4] [--seconds 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+os.environ.setdefault("GLOBAL_LOG_DIR", "off")
+os.environ.setdefault("HANDOFF_PATH", "off")
+os.environ.setdefault("RATE_LIMIT_USER_BURST", "1000000")
+os.environ.setdefault("RATE_LIMIT_USER_PER_MINUTE", "1000000")
+os.environ.setdefault("RATE_LIMIT_IP_BURST", "1000000")
+os.environ.setdefault("RATE_LIMIT_IP_PER_MINUTE", "1000000")
+
+from harness import close_all, connect_all, latency_summary  # noqa: E402
+from app.config import MAX_MESSAGE_LENGTH  # noqa: E402
+from app.main import app  # noqa: E402
+from app.moderation import moderation_pool  # noqa: E402
+
+PAIRED_NOTICES = ("Connected to a chat partner", "Connected to your chat partner")
+HEAVY_TEXT = "f.u.c.k." * (MAX_MESSAGE_LENGTH // 8)
+
+
+def is_paired(message):
+    return message.get("type") == "system" and message.get("message", "").startswith(PAIRED_NOTICES)
+
+
+async def connect_pairs(prefix: str, pairs: int, on_message=None):
+    paths = [f"/ws/code/{prefix}{i}/Main/None/{prefix}-code{i // 2}" for i in range(pairs * 2)]
+    clients, _ = await connect_all(app, paths, on_message=on_message)
+    for client in clients:
+        await client.wait_for(is_paired)
+    return clients
+
+
+async def heavy_sender(sender, receiver, stop: asyncio.Event, sent: list):
+    while not stop.is_set():
+        seen = len(receiver.messages)
+        sender.send_json({"message": f"{HEAVY_TEXT[:-8]}{sent[0]:08d}"})
+        try:
+            await receiver.wait_for(lambda message: message.get("type") == "message", timeout=30, start=seen)
+        except asyncio.TimeoutError:
+            return
+        sent[0] += 1
+
+
+async def run_once(kind: str, args, round_number: int):
+    moderation_pool.stop()
+    moderation_pool.kind = kind
+    moderation_pool.start()
+    await moderation_pool.moderate(HEAVY_TEXT)  # Wait for the workers to be up
+
+    sent_at = {}
+    latencies = []
+
+    def on_message(arrived, message):
+        started = sent_at.pop(message.get("message"), None) if message.get("type") == "message" else None
+        if started is not None:
+            latencies.append(arrived - started)
+
+    normal = await connect_pairs(f"r{round_number}n", args.pairs, on_message)
+    heavy = await connect_pairs(f"r{round_number}h", args.heavy)
+
+    stop = asyncio.Event()
+    heavy_sent = [0]
+    heavy_tasks = [asyncio.create_task(heavy_sender(heavy[i], heavy[i + 1], stop, heavy_sent))
+                   for i in range(0, len(heavy), 2)]
+
+    senders = normal[::2]
+    deadline = time.perf_counter() + args.seconds
+    tick = 0
+    while time.perf_counter() < deadline:
+        for index, client in enumerate(senders):
+            text = f"n{index}t{tick}"
+            sent_at[text] = time.perf_counter()
+            client.send_json({"message": text})
+        tick += 1
+        await asyncio.sleep(args.interval_ms / 1000)
+
+    stop.set()
+    await asyncio.gather(*heavy_tasks)
+    settle = time.perf_counter() + 10
+    while sent_at and time.perf_counter() < settle:
+        await asyncio.sleep(0.05)
+    await close_all(normal + heavy)
+    result = latency_summary(latencies)
+    result["lost"] = len(sent_at)
+    result["heavy_per_sec"] = heavy_sent[0] / args.seconds
+    return result
+
+
+async def run(args):
+    results = {}
+    async with app.router.lifespan_context(app):
+        for round_number, kind in enumerate(args.executors):
+            results[kind] = await run_once(kind, args, round_number)
+
+    print(f"{args.pairs} pairs sending every {args.interval_ms} ms, {args.heavy} users sending "
+          f"{len(HEAVY_TEXT)}-char messages, {args.seconds}s per run\n")
+    print(f"{'executor':>9} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'lost':>6} {'heavy/s':>8}")
+    for kind, result in results.items():
+        print(f"{kind:>9} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['mean_ms']:>8.2f} "
+              f"{result['lost']:>6} {result['heavy_per_sec']:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--heavy", type=int, default=4, help="Users sending huge messages")
+    parser.add_argument("--interval-ms", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--executors", nargs="*", default=["inline", "thread", "process"])
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
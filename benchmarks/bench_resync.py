@@ -0,0 +1,114 @@
+"""Cost of a global chat reconnect storm, with and without `since`.
+
+In process through ASGI (see harness.py): `--users` users are in global
+chat while messages go by, the connection drops for everyone at once (a
+wifi blip in a lecture hall), `--missed` more messages are sent while
+they're away, and they all reconnect together. Reports the bytes of
+history the server queued for the reconnects and the event loop CPU time
+the storm took, when clients reconnect plainly (and get the last
+GLOBAL_HISTORY_REPLAY messages again, the old behaviour) and when they
+pass ?since=<seq>&stream=<stream> (and get only what they missed).
+
+    python benchmarks/bench_resync.py [--users 2000] [--missed 0 3 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+os.environ.setdefault("GLOBAL_LOG_DIR", "off")
+os.environ.setdefault("HANDOFF_PATH", "off")
+os.environ.setdefault("MODERATION_EXECUTOR", "inline")
+
+from harness import close_all, connect_all  # noqa: E402
+from app.broadcast import encode_frame  # noqa: E402
+from app.main import app, global_chat_manager  # noqa: E402
+
+
+def post(count: int, prefix: str):
+    """Send `count` messages to everyone, as if from a user on another worker."""
+    for i in range(count):
+        global_chat_manager.deliver_remote(encode_frame({
+            "type": "global_message",
+            "message": f"{prefix} message number {i}, about as long as a usual one",
+            "user_id": "Anonbench",
+            "timestamp": datetime.now().isoformat(),
+            "message_id": str(uuid.uuid4()),
+        }))
+
+
+async def drain():
+    while global_chat_manager.broadcaster.queued_frames():
+        await asyncio.sleep(0.01)
+
+
+async def storm(users: int, missed: int, resync: bool, round_number: int):
+    paths = [f"/ws/global/r{round_number}u{i}" for i in range(users)]
+    clients, _ = await connect_all(app, paths, concurrency=users)
+    post(50, "before")
+    await drain()
+
+    # Where each client got to: the "seq" of its last message, and the stream
+    positions = []
+    for client in clients:
+        stream, seq = None, 0
+        for _, message in client.messages:
+            stream = message.get("stream", stream)
+            seq = max(seq, message.get("seq", 0))
+        positions.append((stream, seq))
+    await close_all(clients)
+    post(missed, "missed")
+
+    queued = []
+    replay = global_chat_manager.replay
+
+    def measured_replay(since=None, stream=None):
+        frame = replay(since, stream)
+        queued.append(len(frame.encode("utf-8")) if frame else 0)
+        return frame
+
+    global_chat_manager.replay = measured_replay
+    if resync:
+        paths = [f"{path}?since={seq}&stream={stream}" for path, (stream, seq) in zip(paths, positions)]
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    clients, _ = await connect_all(app, paths, concurrency=users)
+    await drain()
+    cpu, wall = time.process_time() - cpu_started, time.perf_counter() - wall_started
+    del global_chat_manager.replay
+    await close_all(clients)
+    return {"bytes": sum(queued), "frames": sum(1 for size in queued if size), "cpu_seconds": cpu, "wall_seconds": wall}
+
+
+async def run(args):
+    rows = []
+    async with app.router.lifespan_context(app):
+        round_number = 0
+        for missed in args.missed:
+            for resync in (False, True):
+                rows.append((missed, resync, await storm(args.users, missed, resync, round_number)))
+                round_number += 1
+
+    print(f"{args.users} global chat users reconnecting at once\n")
+    print(f"{'missed':>7} {'since':>6} {'replay frames':>14} {'replay KB':>10} {'loop CPU s':>11} {'wall s':>7}")
+    for missed, resync, result in rows:
+        print(f"{missed:>7} {'yes' if resync else 'no':>6} {result['frames']:>14} {result['bytes'] / 1024:>10.0f} "
+              f"{result['cpu_seconds']:>11.2f} {result['wall_seconds']:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--missed", type=int, nargs="*", default=[0, 3, 50])
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Heartbeat and sweep cost of the standby pool at 50k users.
+
+Registers 50k standby users, then times heartbeats and the periodic sweep
+(one in ten users stops sending heartbeats) for the timing wheel and for the
+old dict of timestamps that was scanned in full on every sweep.
+
+    python benchmarks/bench_standby.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.expiry import ExpiryWheel  # noqa: E402
+
+USERS = 50_000
+TIMEOUT = 60
+SWEEP_INTERVAL = 30
+SWEEPS = 10
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def legacy_sweep(standby_users, now, timeout):
+    """The pre-wheel cleanup loop, kept here only as a baseline."""
+    stale_users = []
+    for user_id, last_seen in list(standby_users.items()):
+        if now - last_seen > timeout:
+            stale_users.append(user_id)
+    for user_id in stale_users:
+        del standby_users[user_id]
+    return stale_users
+
+
+def run(touch, sweep, clock):
+    """Simulate heartbeats every 30s from 9 in 10 users; returns (us/heartbeat, ms/sweep, expired)."""
+    user_ids = [f"user{i}" for i in range(USERS)]
+    for user_id in user_ids:
+        touch(user_id)
+
+    live = [user_id for i, user_id in enumerate(user_ids) if i % 10]
+    heartbeat_time = sweep_time = 0.0
+    heartbeats = expired = 0
+    for _ in range(SWEEPS):
+        clock.now += SWEEP_INTERVAL
+        start = time.perf_counter()
+        for user_id in live:
+            touch(user_id)
+        heartbeat_time += time.perf_counter() - start
+        heartbeats += len(live)
+
+        start = time.perf_counter()
+        expired += len(sweep())
+        sweep_time += time.perf_counter() - start
+    return heartbeat_time / heartbeats * 1e6, sweep_time / SWEEPS * 1e3, expired
+
+
+def bench_wheel():
+    clock = FakeClock()
+    wheel = ExpiryWheel(TIMEOUT, clock=clock)
+    return run(wheel.touch, wheel.expire, clock)
+
+
+def bench_legacy():
+    clock = FakeClock()
+    standby_users = {}
+
+    def touch(user_id):
+        import time  # as the old heartbeat handler did on every call
+        standby_users[user_id] = clock()
+
+    return run(touch, lambda: legacy_sweep(standby_users, clock(), TIMEOUT), clock)
+
+
+def main():
+    print(f"{USERS} standby users, {SWEEPS} sweeps {SWEEP_INTERVAL}s apart")
+    print(f"{'':>8} {'us/heartbeat':>13} {'ms/sweep':>10} {'expired':>9}")
+    for name, bench in (("wheel", bench_wheel), ("legacy", bench_legacy)):
+        per_heartbeat, per_sweep, expired = bench()
+        print(f"{name:>8} {per_heartbeat:>13.3f} {per_sweep:>10.3f} {expired:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""User count updates during a global chat join burst.
+
+Connects a burst of users to /ws/global/... at once (a class opening the
+page together), in process through ASGI (see harness.py), and reports how
+many user_count frames were queued (one per connection per update; a
+pending one is replaced in place, so fewer may actually be sent) and
+delivered, the CPU time the event loop spent on the burst and whether every
+client ended up with the right count.
+
+Each run is repeated with USER_COUNT_DEBOUNCE_MS=0, where every join sends
+everyone an update straight away (the old behaviour), and with the
+debounce window(s) given.
+
+    python benchmarks/bench_user_count.py [--users 2000] [--debounce-ms 250]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+os.environ.setdefault("GLOBAL_LOG_DIR", "off")
+os.environ.setdefault("HANDOFF_PATH", "off")
+
+from harness import close_all, connect_all  # noqa: E402
+from app.main import app, global_chat_manager  # noqa: E402
+
+
+async def run_burst(users: int, debounce_ms: int, round_number: int):
+    global_chat_manager.count_debounce = debounce_ms / 1000
+    counts = {"queued": 0, "delivered": 0}
+    broadcaster = global_chat_manager.broadcaster
+    broadcast_frame = broadcaster.broadcast_frame
+
+    def counting_broadcast_frame(frame, exclude=None, coalesce_key=None, batch=False):
+        queued = broadcast_frame(frame, exclude, coalesce_key, batch)
+        if coalesce_key == "user_count":
+            counts["queued"] += queued
+        return queued
+
+    broadcaster.broadcast_frame = counting_broadcast_frame
+
+    def on_message(_, message):
+        if message.get("type") == "user_count":
+            counts["delivered"] += 1
+
+    paths = [f"/ws/global/r{round_number}u{i}" for i in range(users)]
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    clients, _ = await connect_all(app, paths, concurrency=users, on_message=on_message)
+    # Wait for the last update to be sent and every queue to drain
+    while True:
+        await asyncio.sleep(debounce_ms / 1000 + 0.05)
+        if not global_chat_manager.broadcaster.queued_frames() and global_chat_manager._count_handle is None:
+            break
+    elapsed = time.perf_counter() - wall_started - (debounce_ms / 1000 + 0.05)
+    cpu = time.process_time() - cpu_started
+
+    stale = 0
+    for client in clients:
+        last = [message["count"] for _, message in client.messages if message.get("type") == "user_count"]
+        if not last or last[-1] != users:
+            stale += 1
+    del broadcaster.broadcast_frame
+    await close_all(clients)
+    await asyncio.sleep(debounce_ms / 1000 + 0.1)
+    return {
+        "queued": counts["queued"],
+        "delivered": counts["delivered"],
+        "cpu_seconds": cpu,
+        "wall_seconds": elapsed,
+        "wrong_final_count": stale,
+    }
+
+
+async def run(args):
+    windows = [0] + [window for window in args.debounce_ms if window]
+    results = {}
+    async with app.router.lifespan_context(app):
+        for round_number, window in enumerate(windows):
+            results[window] = await run_burst(args.users, window, round_number)
+
+    print(f"{args.users} users joining global chat at once\n")
+    print(f"{'debounce':>10} {'queued':>10} {'delivered':>10} {'loop CPU s':>11} {'wall s':>8} {'wrong count':>12}")
+    for window, result in results.items():
+        print(f"{str(window) + ' ms':>10} {result['queued']:>10} {result['delivered']:>10} "
+              f"{result['cpu_seconds']:>11.2f} {result['wall_seconds']:>8.2f} {result['wrong_final_count']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--debounce-ms", type=int, nargs="*", default=[250])
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""In-process driver for the app's WebSocket routes.
+
+Talks ASGI to the FastAPI app directly: each SimulatedClient is one
+WebSocket connection whose frames are handed to and from the app through
+queues, so thousands of clients run on one event loop without sockets, a
+server or threads. Used by the bench_*.py scripts that exercise whole
+routes rather than a single data structure.
+"""
+import asyncio
+import json
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class SimulatedClient:
+    """One WebSocket connection to an ASGI app."""
+
+    _next_port = 10_000
+
+    def __init__(self, app, path: str, on_message: Optional[Callable[[float, Dict], None]] = None):
+        self.app = app
+        self.path = path
+        self.on_message = on_message  # Called with (arrival time, message) for every message
+        self.connect_started = 0.0
+        self.accepted = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.messages: List[Tuple[float, Dict]] = []  # (arrival time, message)
+        self._to_app: asyncio.Queue = asyncio.Queue()
+        self._arrived = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Every client gets its own address, as real users would, so per-IP limits don't lump them together
+        SimulatedClient._next_port += 1
+        self._port = SimulatedClient._next_port
+        self._host = f"10.{self._port >> 16 & 255}.{self._port >> 8 & 255}.{self._port & 255}"
+
+    async def connect(self, timeout: float = 10.0):
+        path, _, query = self.path.partition("?")
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "scheme": "ws",
+            "http_version": "1.1",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [(b"host", b"testserver")],
+            "client": (self._host, self._port),
+            "server": ("testserver", 80),
+            "subprotocols": [],
+            "state": {},
+        }
+        self.connect_started = time.perf_counter()
+        self._to_app.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.get_running_loop().create_task(self._run(scope))
+        await asyncio.wait_for(self.accepted.wait(), timeout)
+
+    async def _run(self, scope):
+        try:
+            await self.app(scope, self._to_app.get, self._from_app)
+        except Exception as e:
+            print(f"{self.path}: app raised {e!r}")
+        finally:
+            self.closed.set()
+            self._arrived.set()
+
+    async def _from_app(self, message: Dict):
+        kind = message["type"]
+        if kind == "websocket.accept":
+            self.accepted.set()
+        elif kind == "websocket.send":
+            text = message.get("text")
+            if text is None:
+                text = message["bytes"].decode("utf-8")
+            arrived, parsed = time.perf_counter(), json.loads(text)
+            self.messages.append((arrived, parsed))
+            if self.on_message is not None:
+                self.on_message(arrived, parsed)
+            self._arrived.set()
+        elif kind == "websocket.close":
+            self.closed.set()
+            self._arrived.set()
+
+    def send_json(self, data: Dict):
+        self._to_app.put_nowait({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def wait_for(self, predicate: Callable[[Dict], bool], timeout: float = 10.0,
+                       start: int = 0) -> Tuple[float, Dict]:
+        """Wait for a message matching `predicate`; returns (arrival time, message)."""
+        deadline = time.perf_counter() + timeout
+        index = start
+        while True:
+            while index < len(self.messages):
+                arrived, message = self.messages[index]
+                if predicate(message):
+                    return arrived, message
+                index += 1
+            if self.closed.is_set():
+                raise ConnectionError(f"{self.path} closed while waiting")
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"{self.path} timed out waiting")
+            self._arrived.clear()
+            await asyncio.wait_for(self._arrived.wait(), remaining)
+
+    async def close(self):
+        if self._task is None or self._task.done():
+            return
+        self._to_app.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self._task, 10)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean of latencies in seconds, reported in milliseconds."""
+    if not values:
+        return {"p50_ms": float("nan"), "p95_ms": float("nan"), "p99_ms": float("nan"), "mean_ms": float("nan")}
+    return {
+        "p50_ms": percentile(values, 0.50) * 1e3,
+        "p95_ms": percentile(values, 0.95) * 1e3,
+        "p99_ms": percentile(values, 0.99) * 1e3,
+        "mean_ms": sum(values) / len(values) * 1e3,
+    }
+
+
+async def connect_all(app, paths: List[str], concurrency: int = 200,
+                      on_message: Optional[Callable[[float, Dict], None]] = None
+                      ) -> Tuple[List[SimulatedClient], float]:
+    """Open a connection per path, `concurrency` at a time. Returns (clients, elapsed seconds)."""
+    clients = [SimulatedClient(app, path, on_message) for path in paths]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_one(client):
+        async with semaphore:
+            await client.connect()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(open_one(client) for client in clients))
+    return clients, time.perf_counter() - started
+
+
+async def close_all(clients: List[SimulatedClient]):
+    await asyncio.gather(*(client.close() for client in clients))
@@ -0,0 +1,253 @@
+"""Stress test for running several workers over the backplane.
+
+Starts a LocalPubSubServer and two uvicorn workers pointed at it, each a
+separate process with its own ClusterRouter, and connects real WebSocket
+clients to both:
+
+- `--pairs` codes are each used by one user on either worker, so every
+  chat is across workers; each side sends a tagged message that has to
+  reach its partner and nobody else
+- `--global-users` users join global chat on each worker; every client
+  has to see the total user count and every other user's message,
+  from either worker, exactly once
+- the second worker is then killed without warning (SIGKILL), and the
+  count on the first has to drop back to its own users within
+  CLUSTER_WORKER_TIMEOUT
+
+Exits non-zero if anything is off.
+
+    python benchmarks/stress_cluster.py [--pairs 100] [--global-users 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from app.backplane import LocalPubSubServer  # noqa: E402
+
+PAIRED_NOTICES = ("Connected to a chat partner", "Connected to your chat partner")
+HEARTBEAT_INTERVAL = 1
+WORKER_TIMEOUT = 3
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_worker(port: int, backplane_port: int) -> subprocess.Popen:
+    env = dict(os.environ,
+               BACKPLANE_URL=f"redis://127.0.0.1:{backplane_port}",
+               CLUSTER_HEARTBEAT_INTERVAL=str(HEARTBEAT_INTERVAL),
+               CLUSTER_WORKER_TIMEOUT=str(WORKER_TIMEOUT),
+               USER_COUNT_DEBOUNCE_MS="50",
+               MODERATION_EXECUTOR="thread",
+               FILTER_SNAPSHOT_PATH="off",
+               GLOBAL_LOG_DIR="off",
+               HANDOFF_PATH="off",
+               GLOBAL_SEND_QUEUE_SIZE="100000",  # Every global message is sent at once; don't drop any
+               RATE_LIMIT_USER_BURST="1000",
+               RATE_LIMIT_IP_BURST="0")  # Every client comes from 127.0.0.1
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=ROOT, env=env)
+
+
+async def wait_listening(port: int, timeout: float = 20):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+class Client:
+    """One WebSocket connection, collecting everything it is sent."""
+
+    def __init__(self, url: str, name: str):
+        self.url = url
+        self.name = name
+        self.messages = []
+        self.socket = None
+        self._task = None
+        self._arrived = asyncio.Event()
+
+    async def connect(self):
+        self.socket = await websockets.connect(self.url)
+        self._task = asyncio.get_running_loop().create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for raw in self.socket:
+                self.messages.append(json.loads(raw))
+                self._arrived.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    async def wait_for(self, predicate, timeout: float = 10) -> bool:
+        deadline = time.perf_counter() + timeout
+        while not any(predicate(message) for message in self.messages):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    def user_count(self):
+        counts = [message["count"] for message in self.messages if message.get("type") == "user_count"]
+        return counts[-1] if counts else None
+
+    async def send(self, message):
+        await self.socket.send(json.dumps(message))
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+        if self._task is not None:
+            await self._task
+
+
+def is_paired(message):
+    return message.get("type") == "system" and message.get("message", "").startswith(PAIRED_NOTICES)
+
+
+async def wait_until(condition, timeout: float) -> float:
+    """Seconds until condition() held, or -1 if it didn't within timeout."""
+    started = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - started > timeout:
+            return -1
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def check_pairs(urls, pairs: int, problems) -> float:
+    """Pair users across the workers by code and check each side's message reaches only its partner."""
+    first = [Client(f"{urls[0]}/ws/code/left{i}/Main/None/stress{i}", f"left{i}") for i in range(pairs)]
+    second = [Client(f"{urls[1]}/ws/code/right{i}/Main/None/stress{i}", f"right{i}") for i in range(pairs)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client.connect() for client in first))
+    await asyncio.gather(*(client.connect() for client in second))
+    paired = await asyncio.gather(*(client.wait_for(is_paired) for client in first + second))
+    elapsed = time.perf_counter() - started
+    for client, ok in zip(first + second, paired):
+        if not ok:
+            problems.append(f"{client.name} was never paired")
+
+    for client in first + second:
+        await client.send({"message": f"from {client.name}"})
+    await asyncio.gather(*(client.wait_for(lambda message: message.get("type") == "message", timeout=5)
+                           for client in first + second))
+    for i in range(pairs):
+        for client, partner in ((first[i], second[i]), (second[i], first[i])):
+            got = [message["message"] for message in client.messages if message.get("type") == "message"]
+            if got != [f"from {partner.name}"]:
+                problems.append(f"{client.name} got {got}, expected ['from {partner.name}']")
+
+    await asyncio.gather(*(client.close() for client in first + second))
+    return elapsed
+
+
+async def check_global(urls, users: int, problems):
+    """Global chat users on both workers see the total count and everyone else's messages once."""
+    clients = [Client(f"{url}/ws/global/g{side}u{i}", f"g{side}u{i}")
+               for side, url in enumerate(urls) for i in range(users)]
+    await asyncio.gather(*(client.connect() for client in clients))
+    total = len(clients)
+    waited = await wait_until(lambda: all(client.user_count() == total for client in clients), 10)
+    if waited < 0:
+        wrong = sorted({client.user_count() for client in clients if client.user_count() != total}, key=str)
+        problems.append(f"user count never reached {total} everywhere (saw {wrong})")
+
+    for client in clients:
+        await client.send({"message": f"hello from {client.name}"})
+    expected = {f"hello from {client.name}" for client in clients}
+
+    def received(client):
+        return [message["message"] for message in client.messages
+                if message.get("type") == "global_message" and message.get("message") in expected]
+
+    # Senders aren't sent their own message back
+    delivered = await wait_until(lambda: all(len(received(client)) >= total - 1 for client in clients), 60)
+    for client in clients:
+        got = received(client)
+        if len(got) != total - 1 or set(got) != expected - {f"hello from {client.name}"}:
+            problems.append(f"{client.name} got {len(got)} global messages ({len(set(got))} distinct), "
+                            f"expected everyone else's {total - 1}")
+    return clients, waited, delivered
+
+
+async def run(args):
+    server = LocalPubSubServer(port=0)
+    await server.start()
+    ports = [free_port(), free_port()]
+    workers = [start_worker(port, server.port) for port in ports]
+    urls = [f"ws://127.0.0.1:{port}" for port in ports]
+    problems = []
+    try:
+        await asyncio.gather(*(wait_listening(port) for port in ports))
+        await asyncio.sleep(0.5)  # Let both subscribe to the backplane
+
+        elapsed = await check_pairs(urls, args.pairs, problems)
+        print(f"{args.pairs} cross-worker chats paired in {elapsed * 1000:.0f} ms")
+
+        clients, waited, delivered = await check_global(urls, args.global_users, problems)
+        print(f"{len(clients)} global chat users on two workers, count agreed after {max(waited, 0) * 1000:.0f} ms, "
+              f"one message from each delivered to everyone in {max(delivered, 0) * 1000:.0f} ms")
+
+        # The second worker dies without telling anyone
+        workers[1].send_signal(signal.SIGKILL)
+        workers[1].wait()
+        survivors = clients[:args.global_users]
+        gone = await wait_until(lambda: all(client.user_count() == args.global_users for client in survivors),
+                                WORKER_TIMEOUT + HEARTBEAT_INTERVAL * 3)
+        if gone < 0:
+            problems.append(f"count stayed at {sorted({client.user_count() for client in survivors}, key=str)} "
+                            f"after the second worker died, expected {args.global_users}")
+        else:
+            print(f"killed worker's users dropped from the count after {gone:.1f} s")
+        await asyncio.gather(*(client.close() for client in survivors))
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+                worker.wait()
+        await server.stop()
+
+    for problem in problems[:20]:
+        print(f"  {problem}")
+    if problems:
+        print(f"FAILED: {len(problems)} problems")
+        sys.exit(1)
+    print("OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=100)
+    parser.add_argument("--global-users", type=int, default=50, help="Global chat users per worker")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
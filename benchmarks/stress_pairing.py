@@ -0,0 +1,160 @@
+"""Concurrency stress test for pair and code matching.
+
+Opens connections to the pair and code WebSocket routes in concurrent
+bursts, in process through ASGI (see harness.py), while:
+
+- many users join the same few (campus, preference) buckets at once
+- three users share each code, so one of them must stay unmatched
+- some user ids connect twice at the same time (a reconnect racing the
+  old socket), and the older connection has to be replaced
+- random users leave in the middle of the burst
+
+After every round it checks that no user is in two chats: the server's
+pairs agree in both directions, nobody paired is still waiting, and every
+client's messages reach exactly the one client the server paired it with.
+Exits non-zero if anything is off.
+
+    python benchmarks/stress_pairing.py [--rounds 5] [--users 600]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("FILTER_SNAPSHOT_PATH", "off")
+os.environ.setdefault("GLOBAL_LOG_DIR", "off")
+os.environ.setdefault("HANDOFF_PATH", "off")
+# Every client sends a couple of messages; keep flood protection out of the way
+os.environ.setdefault("RATE_LIMIT_USER_BURST", "1000")
+
+from harness import SimulatedClient  # noqa: E402
+from app.main import app, manager  # noqa: E402
+
+PREFERENCES = ["None", "NAO", "SITEAO"]
+PAIRED_NOTICES = ("Connected to a chat partner", "Connected to your chat partner")
+
+
+def is_paired(message):
+    return message.get("type") == "system" and message.get("message", "").startswith(PAIRED_NOTICES)
+
+
+def check_server_state(problems):
+    pairs = manager.chat_pairs
+    for user_id, partner_id in pairs.items():
+        if pairs.get(partner_id) != user_id:
+            problems.append(f"{user_id} is paired with {partner_id}, who is paired with {pairs.get(partner_id)}")
+        if user_id in manager.waiting_users:
+            problems.append(f"{user_id} is both paired and waiting")
+        if user_id not in manager.active_connections:
+            problems.append(f"{user_id} is paired but not connected")
+
+
+async def check_delivery(clients, round_number, problems):
+    """Each open, paired client sends a tagged message; it must arrive at its partner only."""
+    by_user = {client.user_id: client for client in clients
+               if not client.closed.is_set() and manager.active_connections.get(client.user_id) is not None}
+    expected = {}
+    for user_id, client in by_user.items():
+        partner_id = manager.chat_pairs.get(user_id)
+        if partner_id is None:
+            continue
+        tag = f"r{round_number}from{user_id}"
+        expected[tag] = partner_id
+        client.send_json({"message": tag})
+
+    deadline = time.perf_counter() + 10
+    received = {}
+    while time.perf_counter() < deadline:
+        received = {}
+        for user_id, client in by_user.items():
+            for _, message in client.messages:
+                if message.get("type") == "message" and message.get("message", "").startswith(f"r{round_number}from"):
+                    received.setdefault(message["message"], []).append(user_id)
+        if len(received) >= len(expected):
+            break
+        await asyncio.sleep(0.05)
+
+    for tag, partner_id in expected.items():
+        receivers = received.get(tag, [])
+        if receivers != [partner_id]:
+            problems.append(f"{tag} went to {receivers}, expected [{partner_id}]")
+    return len(expected) // 2
+
+
+async def run_round(round_number: int, users: int, rng: random.Random):
+    paths = []
+    for i in range(users):
+        user_id = f"s{round_number}u{i}"
+        if i % 4 == 0:
+            paths.append((user_id, f"/ws/code/{user_id}/Main/None/r{round_number}c{i // 12}"))
+        else:
+            paths.append((user_id, f"/ws/{user_id}/Main/{rng.choice(PREFERENCES)}"))
+    # Some users connect a second time while their first connection is still opening
+    duplicates = rng.sample(paths, users // 20)
+    paths.extend(duplicates)
+    rng.shuffle(paths)
+
+    clients = []
+    for user_id, path in paths:
+        client = SimulatedClient(app, path)
+        client.user_id = user_id
+        clients.append(client)
+
+    async def join(client):
+        await asyncio.sleep(rng.random() * 0.05)
+        await client.connect()
+        if rng.random() < 0.1:
+            await asyncio.sleep(rng.random() * 0.05)
+            await client.close()
+
+    await asyncio.gather(*(join(client) for client in clients))
+    await asyncio.sleep(0.2)
+
+    problems = []
+    check_server_state(problems)
+    chats = await check_delivery(clients, round_number, problems)
+    for client in clients:
+        notices = sum(1 for _, message in client.messages if is_paired(message))
+        if notices > 1:
+            problems.append(f"{client.user_id} was told it was paired {notices} times")
+
+    await asyncio.gather(*(client.close() for client in clients))
+    await asyncio.sleep(0.05)
+    if manager.active_connections or manager.chat_pairs or manager.waiting_users:
+        problems.append(f"left over after everyone closed: {len(manager.active_connections)} connections, "
+                        f"{len(manager.chat_pairs)} paired, {len(manager.waiting_users)} waiting")
+    return len(clients), chats, problems
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    failed = False
+    async with app.router.lifespan_context(app):
+        for round_number in range(args.rounds):
+            started = time.perf_counter()
+            connections, chats, problems = await run_round(round_number, args.users, rng)
+            elapsed = time.perf_counter() - started
+            print(f"round {round_number}: {connections} connections, {chats} chats checked, "
+                  f"{len(problems)} problems ({elapsed:.1f}s)")
+            for problem in problems[:10]:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--users", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,97 +26,59 @@ const AdzuChatCard = () => {
         return newId;
     });
 
-    // Fetch user stats every 5 seconds and manage standby status
+    // Stay connected to the presence socket: it counts this user as standby
+    // while open and pushes the user stats whenever they change
     useEffect(() => {
-        const backendURL = process.env.REACT_APP_URL || "http://localhost:8000";
-
-        const fetchUserStats = async () => {
-            try {
-                const response = await fetch(`${backendURL}/user-stats`);
-                const data = await response.json();
-                setActiveUsers(data.active_users);
-                setWaitingUsers(data.waiting_users);
-                setChattingUsers(data.chatting_users);
-                setStandbyUsers(data.standby_users);
-            } catch (error) {
-                console.error("Error fetching user stats:", error);
-            }
+        const wsUrl = process.env.REACT_APP_WS_URL || 'ws://localhost:8000';
+        let presenceSocket = null;
+        let reconnectTimeoutId = null;
+        let reconnectDelay = 1000;
+        let closedByPage = false;
+
+        const applyStats = (data) => {
+            setActiveUsers(data.active_users);
+            setWaitingUsers(data.waiting_users);
+            setChattingUsers(data.chatting_users);
+            setStandbyUsers(data.standby_users);
         };
 
-        // Register this user as standby
-        const registerStandby = async () => {
-            try {
-                await fetch(`${backendURL}/standby/${userId}`, {
-                    method: 'POST',
-                });
-                // console.log("User registered as standby:", userId);
-            } catch (error) {
-                // console.error("Error registering standby user:", error);
-            }
-        };
-
-        // Unregister standby user when component unmounts
-        const unregisterStandby = async () => {
-            try {
-                await fetch(`${backendURL}/standby/${userId}`, {
-                    method: 'DELETE',
-                });
-                // console.log("User unregistered from standby:", userId);
-            } catch (error) {
-                // console.error("Error unregistering standby user:", error);
-            }
+        const connectPresence = () => {
+            presenceSocket = new WebSocket(`${wsUrl}/ws/presence/${userId}`);
+
+            presenceSocket.onopen = () => {
+                reconnectDelay = 1000;
+            };
+
+            presenceSocket.onmessage = (event) => {
+                try {
+                    const data = JSON.parse(event.data);
+                    if (data.type === "stats") {
+                        applyStats(data);
+                    }
+                } catch (error) {
+                    console.error("Error parsing presence message:", error);
+                }
+            };
+
+            presenceSocket.onclose = () => {
+                if (closedByPage) {
+                    return;
+                }
+                // Reconnect with backoff, e.g. after the server restarts
+                reconnectTimeoutId = setTimeout(connectPresence, reconnectDelay);
+                reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+            };
         };
 
-        // Send heartbeat to keep the standby session active
-        const sendHeartbeat = async () => {
-            try {
-                await fetch(`${backendURL}/standby/heartbeat/${userId}`, {
-                    method: 'POST',
-                });
-                // console.log("Heartbeat sent for user:", userId);
-            } catch (error) {
-                // console.error("Error sending heartbeat:", error);
-            }
-        };
-
-        // Handle browser close/refresh events
-        const handleBeforeUnload = (event) => {
-            // This sync call will run before the browser closes
-            const xhr = new XMLHttpRequest();
-            xhr.open("DELETE", `${backendURL}/standby/${userId}`, false);  // false makes it synchronous
-            try {
-                xhr.send();
-                console.log("User unregistered on page close:", userId);
-            } catch (e) {
-                console.error("Failed to unregister on page close:", e);
-            }
+        connectPresence();
 
-            // Standard for modern browsers
-            event.preventDefault();
-            event.returnValue = '';
-        };
-
-        // Register immediately on mount
-        registerStandby();
-
-        // Fetch immediately on mount
-        fetchUserStats();
-
-        // Add event listener for beforeunload
-        window.addEventListener('beforeunload', handleBeforeUnload);
-
-        // Set an interval to fetch user stats every 5 seconds
-        const statsIntervalId = setInterval(fetchUserStats, 5000);
-
-        // Set an interval to send heartbeat every 20 seconds
-        const heartbeatIntervalId = setInterval(sendHeartbeat, 20000);
-
-        // Cleanup interval and unregister standby on component unmount
+        // Closing the socket is all it takes to leave the standby pool
         return () => {
-            clearInterval(statsIntervalId);
-            clearInterval(heartbeatIntervalId);
-            unregisterStandby();
-            window.removeEventListener('beforeunload', handleBeforeUnload);
+            closedByPage = true;
+            clearTimeout(reconnectTimeoutId);
+            if (presenceSocket) {
+                presenceSocket.close();
+            }
         };
 
     }, [userId]);  // Add userId to dependency array
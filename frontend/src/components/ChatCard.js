@@ -10,6 +10,7 @@ function ChatCard() {
   const [isConnected, setIsConnected] = useState(false);
   const [isWaiting, setIsWaiting] = useState(true);
   const wsRef = useRef(null);
+  const leavingRef = useRef(false);  // Set when we close the chat on purpose, so it isn't resumed
   const [userId] = useState(() => {
     // Check if we already have a UUID stored in localStorage
     const storedId = localStorage.getItem('adzu-chat-user-id');
@@ -57,60 +58,120 @@ function ChatCard() {
       wsEndpoint = `/ws/${userId}/${encodeURIComponent(campus)}/${encodeURIComponent(preference)}`;
     }
 
-    const ws = new WebSocket(`${wsUrl}${wsEndpoint}`);
-    wsRef.current = ws;
-
-    ws.onopen = () => {
-      setIsConnected(true);
-      // if (useCodeMatching) {
-      //   setMessages(prev => [...prev, {
-      //     text: `Using matching code: "${matchingCode}". Waiting for someone with the same code...`,
-      //     sender: 'system'
-      //   }]);
-      // }
+    // Resume token from the server's "session" frame, and how long it keeps our chat after a drop
+    let session = null;
+    let resumeDeadline = 0;
+    let retryDelay = 500;
+    let retryTimer = null;
+    let restartRetries = 0;
+    let restarted = false;
+    leavingRef.current = false;
+
+    const handleServerMessage = (data) => {
+      if (data.type === 'session') {
+        session = data;
+      } else if (data.type === 'system') {
+        setMessages(prev => [...prev, { text: data.message, sender: 'system' }]);
+
+        // Check if this is a filtered content notification
+        if (data.event === 'filtered' || (data.message.includes('inappropriate content') && data.message.includes('filtered'))) {
+          setWasFiltered(true);
+          // Reset the flag after a short period
+          setTimeout(() => setWasFiltered(false), 3000);
+        }
+
+        // Update waiting state based on messages (the event names work in every language)
+        if (data.event === 'partner_left' || data.event === 'session_expired' || data.message === 'Your chat partner has disconnected.') {
+          setIsWaiting(true);
+        } else if (
+          data.event === 'paired' ||
+          data.event === 'code_paired' ||
+          data.message === 'Connected to a chat partner!' ||
+          data.message === 'Connected to your chat partner via matching code!' ||
+          data.message.includes('Connected to a chat partner based on preferences')
+        ) {
+          setIsWaiting(false);
+        }
+      } else if (data.type === 'batch') {
+        // Several system messages for one event, sent in one frame
+        data.messages.forEach(handleServerMessage);
+      } else if (data.type === 'message') {
+        setMessages(prev => [...prev, { text: data.message, sender: 'user' }]);
+      }
     };
 
-    ws.onmessage = (event) => {
-      try {
-        const data = JSON.parse(event.data);
+    const openSocket = (endpoint) => {
+      // batch=1: we can take several system messages grouped into one "batch" frame
+      // keepalive=1: we answer the server's pings, so it can tell a dead connection from a quiet one
+      const ws = new WebSocket(`${wsUrl}${endpoint}?batch=1&keepalive=1`);
+      wsRef.current = ws;
 
-        if (data.type === 'system') {
-          setMessages(prev => [...prev, { text: data.message, sender: 'system' }]);
+      ws.onopen = () => {
+        setIsConnected(true);
+        retryDelay = 500;
+        resumeDeadline = 0;
+        // if (useCodeMatching) {
+        //   setMessages(prev => [...prev, {
+        //     text: `Using matching code: "${matchingCode}". Waiting for someone with the same code...`,
+        //     sender: 'system'
+        //   }]);
+        // }
+      };
 
-          // Check if this is a filtered content notification
-          if (data.message.includes('inappropriate content') && data.message.includes('filtered')) {
-            setWasFiltered(true);
-            // Reset the flag after a short period
-            setTimeout(() => setWasFiltered(false), 3000);
+      ws.onmessage = (event) => {
+        try {
+          const data = JSON.parse(event.data);
+          if (data.type === 'ping') {
+            ws.send('{"type":"pong"}');
+            return;
           }
+          handleServerMessage(data);
+        } catch (error) {
+          console.error('Error parsing message:', error);
+        }
+      };
 
-          // Update waiting state based on messages
-          if (data.message === 'Your chat partner has disconnected.') {
-            setIsWaiting(true);
-          } else if (
-            data.message === 'Connected to a chat partner!' ||
-            data.message === 'Connected to your chat partner via matching code!' ||
-            data.message.includes('Connected to a chat partner based on preferences')
-          ) {
-            setIsWaiting(false);
+      ws.onclose = (event) => {
+        if (ws !== wsRef.current) {
+          return;  // An older socket that a resumed one has replaced
+        }
+        setIsConnected(false);
+        if (event.code === 1012) {
+          restarted = true;  // Server restarting (see below)
+        }
+        // Dropped without us leaving: pick the chat back up while the server still holds it
+        if (!leavingRef.current && session && event.code !== 4000 && event.code !== 1000) {
+          if (!resumeDeadline) {
+            resumeDeadline = Date.now() + session.grace * 1000;
+          }
+          if (Date.now() + retryDelay < resumeDeadline) {
+            retryTimer = setTimeout(() => openSocket(`/ws/resume/${userId}/${session.token}`), retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 5000);
+            return;
           }
-        } else if (data.type === 'message') {
-          setMessages(prev => [...prev, { text: data.message, sender: 'user' }]);
         }
-      } catch (error) {
-        console.error('Error parsing message:', error);
-      }
+        // Sent away by a restarting server, with no chat to resume: join again
+        if (!leavingRef.current && restarted && (!session || event.code === 4000) && restartRetries < 5) {
+          session = null;
+          resumeDeadline = 0;
+          restartRetries += 1;
+          setIsWaiting(true);
+          retryTimer = setTimeout(() => openSocket(wsEndpoint), 1000 * restartRetries);
+          return;
+        }
+        session = null;
+        setIsWaiting(true);
+        setMessages(prev => [...prev, { text: 'Disconnected from server', sender: 'system' }]);
+      };
     };
 
-    ws.onclose = () => {
-      setIsConnected(false);
-      setIsWaiting(true);
-      setMessages(prev => [...prev, { text: 'Disconnected from server', sender: 'system' }]);
-    };
+    openSocket(wsEndpoint);
 
     return () => {
-      if (ws.readyState === WebSocket.OPEN) {
-        ws.close();
+      leavingRef.current = true;
+      clearTimeout(retryTimer);
+      if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+        wsRef.current.close(1000);
       }
     };
   }, [campus, preference, userId, matchingCode, useCodeMatching]);  // Added userId, matchingCode, and useCodeMatching to dependency array
@@ -129,8 +190,9 @@ function ChatCard() {
   };
 
   const handleDisconnect = () => {
+    leavingRef.current = true;
     if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
-      wsRef.current.close();
+      wsRef.current.close(1000);
     }
   };
 
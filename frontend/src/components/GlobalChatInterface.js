@@ -12,15 +12,34 @@ const GlobalChatInterface = () => {
     const [userCount, setUserCount] = useState(0);
     const [isLoading, setIsLoading] = useState(true);
     const [wasFiltered, setWasFiltered] = useState(false);
+    const [olderCursor, setOlderCursor] = useState(null); // Where the next "load older messages" page starts
+    const [isLoadingOlder, setIsLoadingOlder] = useState(false);
     const messagesEndRef = useRef(null);
+    const skipScrollRef = useRef(false);
     const userIdRef = useRef(uuidv4());
+    const positionRef = useRef(null); // { seq, stream } of the newest message we have, to resume from
     const { isDarkMode } = useContext(ThemeContext);
+    // Same server as the WebSocket, over HTTP
+    const apiUrl = (process.env.REACT_APP_WS_URL || 'ws://localhost:8000').replace(/^ws/, 'http');
+
+    // A message from history as shown in the list; our own go on the right
+    const toChatMessage = (msg) => ({
+        text: msg.message,
+        sender: msg.user_id === `Anon${userIdRef.current.slice(0, 6)}` ? 'other' : 'user',
+        user_id: msg.user_id,
+        timestamp: msg.timestamp
+    });
 
     const scrollToBottom = () => {
         messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
     };
 
     useEffect(() => {
+        // Older messages go on top; stay where we are when they load
+        if (skipScrollRef.current) {
+            skipScrollRef.current = false;
+            return;
+        }
         scrollToBottom();
     }, [messages]);
 
@@ -30,7 +49,12 @@ const GlobalChatInterface = () => {
 
             // Use the same backend URL logic as your existing chat
             const wsUrl = process.env.REACT_APP_WS_URL || 'ws://localhost:8000';
-            const websocket = new WebSocket(`${wsUrl}/ws/global/${userIdRef.current}`);
+            // batch=1: we can take bursts of messages grouped into one "batch" frame
+            // keepalive=1: we answer the server's pings, so it can tell a dead connection from a quiet one
+            // since/stream: when reconnecting, only send us the messages we missed
+            const position = positionRef.current;
+            const resume = position ? `&since=${position.seq}&stream=${encodeURIComponent(position.stream)}` : '';
+            const websocket = new WebSocket(`${wsUrl}/ws/global/${userIdRef.current}?batch=1&keepalive=1${resume}`);
 
             websocket.onopen = () => {
                 setIsConnected(true);
@@ -38,44 +62,74 @@ const GlobalChatInterface = () => {
                 console.log('Connected to global chat');
             };
 
-            websocket.onmessage = (event) => {
-                try {
-                    const data = JSON.parse(event.data);
-
-                    if (data.type === 'global_message') {
-                        // Only add messages from other users (not our own)
-                        if (data.user_id !== `Anon${userIdRef.current.slice(0, 6)}`) {
-                            setMessages(prev => [...prev, {
-                                text: data.message,
-                                sender: 'user', // Other users' messages appear on the left
-                                user_id: data.user_id,
-                                timestamp: data.timestamp
-                            }]);
-                        }
-                    } else if (data.type === 'user_count') {
-                        setUserCount(data.count);
-                    } else if (data.type === 'system') {
+            const handleServerMessage = (data) => {
+                if (data.seq !== undefined && positionRef.current && data.seq > positionRef.current.seq) {
+                    positionRef.current = { ...positionRef.current, seq: data.seq };
+                }
+                if (data.type === 'global_message') {
+                    // Only add messages from other users (not our own)
+                    if (data.user_id !== `Anon${userIdRef.current.slice(0, 6)}`) {
                         setMessages(prev => [...prev, {
                             text: data.message,
-                            sender: 'system'
+                            sender: 'user', // Other users' messages appear on the left
+                            user_id: data.user_id,
+                            timestamp: data.timestamp
                         }]);
-
-                        // Check if this is a filtered content notification
-                        if (data.message.includes('inappropriate content') && data.message.includes('filtered')) {
-                            setWasFiltered(true);
-                            // Reset the flag after a short period
-                            setTimeout(() => setWasFiltered(false), 3000);
+                    }
+                } else if (data.type === 'reset') {
+                    // We were away too long for the server to fill the gap: start over from recent history
+                    positionRef.current = { seq: data.seq, stream: data.stream };
+                    setOlderCursor(data.before ?? null);
+                    setMessages(data.messages.filter(msg => msg.type === 'global_message').map(toChatMessage));
+                } else if (data.type === 'history' || data.type === 'batch') {
+                    // Recent messages sent in one frame when we join, what we missed while
+                    // reconnecting (with "since"), or a burst of new ones
+                    if (data.type === 'history') {
+                        positionRef.current = { seq: data.seq, stream: data.stream };
+                        if (data.since === undefined) {
+                            setOlderCursor(data.before ?? null);
                         }
                     }
+                    data.messages.forEach(handleServerMessage);
+                } else if (data.type === 'user_count') {
+                    setUserCount(data.count);
+                } else if (data.type === 'system') {
+                    setMessages(prev => [...prev, {
+                        text: data.message,
+                        sender: 'system'
+                    }]);
+
+                    // Check if this is a filtered content notification
+                    if (data.message.includes('inappropriate content') && data.message.includes('filtered')) {
+                        setWasFiltered(true);
+                        // Reset the flag after a short period
+                        setTimeout(() => setWasFiltered(false), 3000);
+                    }
+                }
+            };
+
+            websocket.onmessage = (event) => {
+                try {
+                    const data = JSON.parse(event.data);
+                    if (data.type === 'ping') {
+                        websocket.send('{"type":"pong"}');
+                        return;
+                    }
+                    handleServerMessage(data);
                 } catch (error) {
                     console.error('Error parsing message:', error);
                 }
             };
 
-            websocket.onclose = () => {
+            websocket.onclose = (event) => {
                 setIsConnected(false);
                 setIsLoading(false);
                 console.log('Disconnected from global chat');
+                if (event.code === 1012) {
+                    // Server restarting; it already said so. Come back to the one taking over
+                    setTimeout(connectWebSocket, 1000);
+                    return;
+                }
                 setMessages(prev => [...prev, { text: 'Disconnected from server', sender: 'system' }]);
                 // Attempt to reconnect after 3 seconds
                 setTimeout(connectWebSocket, 3000);
@@ -124,6 +178,25 @@ const GlobalChatInterface = () => {
         }
     };
 
+    const loadOlderMessages = async () => {
+        if (olderCursor === null || isLoadingOlder) return;
+        setIsLoadingOlder(true);
+        try {
+            const response = await fetch(`${apiUrl}/global-chat/history?before=${olderCursor}`);
+            const page = await response.json();
+            const older = page.messages
+                .filter(msg => msg.type === 'global_message')
+                .map(toChatMessage);
+            skipScrollRef.current = true;
+            setMessages(prev => [...older, ...prev]);
+            setOlderCursor(page.before);
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            setIsLoadingOlder(false);
+        }
+    };
+
     const handleInputChange = (e) => {
         setInputMessage(e.target.value);
     };
@@ -199,6 +272,11 @@ const GlobalChatInterface = () => {
             )}
 
             <div className="chat-body">
+                {olderCursor !== null && (
+                    <button className="load-older" onClick={loadOlderMessages} disabled={isLoadingOlder}>
+                        {isLoadingOlder ? 'Loading...' : 'Load older messages'}
+                    </button>
+                )}
                 {messages.map((msg, index) => (
                     <div key={index} className={`message ${msg.sender}`}>
                         <div className="message-bubble">
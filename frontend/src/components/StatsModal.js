@@ -7,29 +7,24 @@ const StatsModal = () => {
         total_active_chats: 2
     });
 
-    // Function to fetch stats
+    // Stats are pushed by the server whenever they change
     const backendURL = "https://adzu-chat.onrender.com";
-    const fetchStats = async () => {
-        try {
-            const response = await fetch(`${backendURL}/user-stats`);
-            const data = await response.json();
-            console.log("Fetched stats:", data)
-            setStats({
-                total_online: data.active_users,
-                total_waiting: data.waiting_users,
-                total_active_chats: data.chatting_users
-            });
-        } catch (error) {
-            console.error("Failed to fetch chat stats", error);
-        }
-    };
-
-    // Fetch stats every 5 seconds
     useEffect(() => {
-        fetchStats(); // Fetch initially
-        const interval = setInterval(fetchStats, 5000);
-        console.log("Fetching stats again...");
-        return () => clearInterval(interval); // Cleanup interval
+        const source = new EventSource(`${backendURL}/user-stats/stream`);
+        source.onmessage = (event) => {
+            try {
+                const data = JSON.parse(event.data);
+                setStats({
+                    total_online: data.active_users,
+                    total_waiting: data.waiting_users,
+                    total_active_chats: data.active_chats
+                });
+            } catch (error) {
+                console.error("Failed to read chat stats", error);
+            }
+        };
+        // EventSource reconnects on its own if the stream drops
+        return () => source.close(); // Cleanup stream
     }, []);
 
     return (